@@ -1,12 +1,274 @@
-import requests
+import asyncio
 import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import ai_cache
+import analysis_cache
+import ai_scheduler
+import guardrails
+from ai_scheduler import ANALYTICS, BACKGROUND, INTERACTIVE
+import llm
+import similar
+import metrics
+from prompt_budget import chunk_reviews, estimate_tokens, format_reviews, select_reviews
 
 API_KEY = "токен"
 API_URL = "https://openrouter.ai/api/v1/chat/completions"
 MODEL = "deepseek/deepseek-chat"
+REQUEST_TIMEOUT = 60     # сек, основной провайдер
+FALLBACK_TIMEOUT = 30    # сек, запасные модели
+# менять при любой правке промпта ответа на отзыв — старые ответы в кэше станут недоступны
+PROMPT_VERSION = "review-v1"
+# то же для промптов анализа (analysis_cache)
+ANALYSIS_PROMPT_VERSION = "analysis-v1"
 
+metrics.describe("ai_batch_items_total", "Отзывы в пакетной генерации (result=ok|fallback)")
+metrics.describe("ai_first_token_seconds", "Время до первого куска текста в стриминге")
+metrics.describe("ai_analysis_cache_total", "Анализ артикула: result=hit|delta|miss")
+metrics.describe("ai_tokens_total", "Токены AI-запросов (direction=in|out)")
+metrics.describe("ai_call_tokens", "Токены на один AI-запрос (direction=in|out)")
+
+# async callback(накопленный текст) — для прогрессивного вывода ответа
+ProgressCallback = Callable[[str], Awaitable[None]]
+
+_started = False
+
+
+def _default_providers() -> List[llm.Provider]:
+    """
+    Основной провайдер + запасные модели из AI_FALLBACK_MODELS (через запятую).
+    AI_PROVIDER=fake — локальный детерминированный провайдер без сети.
+    """
+    if os.getenv("AI_PROVIDER") == "fake":
+        return [llm.FakeProvider()]
+    providers = [llm.Provider("openrouter", API_URL, MODEL, API_KEY, timeout=REQUEST_TIMEOUT)]
+    for model in filter(None, (m.strip() for m in os.getenv("AI_FALLBACK_MODELS", "").split(","))):
+        providers.append(llm.Provider(f"openrouter:{model}", API_URL, model, API_KEY, timeout=FALLBACK_TIMEOUT))
+    return providers
+
+
+llm.set_providers(_default_providers())
+
+
+async def start():
+    """
+    Открывает общий HTTP-клиент и поднимает кэши (вызывается при старте бота/воркера)
+    """
+    global _started
+    if not _started:
+        ai_cache.load()
+        guardrails.load()
+        analysis_cache.load()
+        similar.load()
+        _started = True
+    await llm.start()
+
+
+async def close():
+    global _started
+    await llm.close()
+    if _started:
+        ai_cache.save()
+        analysis_cache.save()
+        similar.save()
+        _started = False
+
+
+def _record_tokens(endpoint: str, payload: dict, usage: Optional[Dict[str, Any]], completion: str):
+    """
+    Токены запроса/ответа: из usage OpenRouter, а если его нет — локальная оценка
+    """
+    usage = usage or {}
+    tokens_in = usage.get("prompt_tokens")
+    if tokens_in is None:
+        tokens_in = sum(estimate_tokens(m.get("content", "")) for m in payload.get("messages", []))
+    tokens_out = usage.get("completion_tokens")
+    if tokens_out is None:
+        tokens_out = estimate_tokens(completion)
+    for direction, n in (("in", tokens_in), ("out", tokens_out)):
+        labels = {"endpoint": endpoint, "direction": direction}
+        metrics.inc("ai_tokens_total", labels, n)
+        metrics.observe("ai_call_tokens", n, labels)
+
+
+async def _post_chat(payload: dict, endpoint: str, timeout: Optional[float] = None,
+                     priority: int = INTERACTIVE,
+                     user_id: Optional[int] = None) -> Tuple[int, Optional[Dict[str, Any]], str]:
+    """
+    Запрос к LLM через провайдеров llm.py (с запасными и подстраховкой).
+    Слот на запрос выдаёт ai_scheduler по приоритету и лимитам пользователя.
+    Возвращает (status, json или None, сырой текст ответа).
+    """
+    if not _started:
+        await start()
+
+    async with ai_scheduler.slot(priority, user_id):
+        status, data, text = await llm.complete(payload, endpoint, timeout)
+
+    if status == 200 and isinstance(data, dict):
+        try:
+            completion = _content(data)
+        except (KeyError, IndexError, TypeError, AttributeError):
+            completion = ""
+        _record_tokens(endpoint, payload, data.get("usage"), completion)
+    return status, data, text
+
+
+async def _stream_chat(payload: dict, endpoint: str, on_progress: ProgressCallback,
+                       timeout: Optional[float] = None, priority: int = INTERACTIVE,
+                       user_id: Optional[int] = None) -> str:
+    """
+    Стриминговый запрос: on_progress получает накопленный текст по мере
+    прихода кусков. Возвращает весь ответ.
+    """
+    if not _started:
+        await start()
+
+    parts: List[str] = []
+    usage = None
+    async with ai_scheduler.slot(priority, user_id):
+        started = time.perf_counter()
+        async for delta, chunk_usage in llm.stream(payload, endpoint, timeout):
+            usage = chunk_usage or usage
+            if not delta:
+                continue
+            if not parts:
+                metrics.observe("ai_first_token_seconds", time.perf_counter() - started,
+                                {"endpoint": endpoint})
+            parts.append(delta)
+            await on_progress("".join(parts))
+    answer = "".join(parts).strip()
+    if not answer:
+        raise ValueError("пустой ответ модели")
+    _record_tokens(endpoint, payload, usage, answer)
+    return answer
+
+
+def _guarded_progress(on_progress: ProgressCallback) -> ProgressCallback:
+    """
+    Стриминг ответа покупателю — через фильтр "review": показываем текст
+    только до первого срабатывания, после reject превью больше не обновляется
+    (готовый ответ проверит _guarded_reply)
+    """
+    stopped = False
+
+    async def progress(text: str):
+        nonlocal stopped
+        if stopped:
+            return
+        shown, rejected = guardrails.preview("review", text)
+        if rejected:
+            stopped = True
+        elif shown:
+            await on_progress(shown)
+
+    return progress
+
+
+def _content(data: Optional[Dict[str, Any]]) -> str:
+    return data["choices"][0]["message"]["content"].strip()
+
+
+AI_ANSWER_ERROR = "К сожалению, сейчас не могу сгенерировать ответ. Попробуйте ещё раз."
+AI_ANALYSIS_ERROR = "Не удалось выполнить анализ отзывов"
+
+# требования к итоговой выжимке (обычный анализ и reduce-шаг)
+_ANALYSIS_FORMAT = """СДЕЛАЙ КРАТКУЮ ВЫЖИМКУ (максимум 300 символов):
+1. На что чаще всего ХВАЛЯТ покупатели?
+2. На что чаще всего ЖАЛУЮТСЯ покупатели? 
+3. Основные выводы для продавца.
+
+Формат ответа ТОЛЬКО В ТАКОМ СТИЛЕ:
+👍 Хвалят: [кратко основные плюсы]
+👎 Жалуются: [кратко основные минусы]  
+💡 Вывод: [главная рекомендация]
+
+Будь кратким и конкретным! Не генерируй ответы покупателям, только анализ.
+"""
+
+
+def _filter_analysis(result: str) -> str:
+    # фразы-ответы покупателям и прочее по правилам guardrails.py ("analysis");
+    # аналитику не перегенерируем: сработало reject-правило — выжимку не показываем
+    result, rejected = guardrails.apply("analysis", result)
+    return AI_ANALYSIS_ERROR if rejected else result
+
+
+# одна повторная попытка, если ответ покупателю не прошёл фильтр guardrails.py
+GUARDRAIL_RETRIES = 1
+_GUARDRAIL_HINT = ("Ответ не подошёл. Перепиши его: без контактов, ссылок, "
+                   "предложений написать или позвонить и без упоминания других площадок.")
+
+
+async def _guarded_reply(answer: str, payload: dict, endpoint: str, priority: int,
+                         user_id: Optional[int]) -> Optional[str]:
+    """
+    Ответ покупателю после фильтра ("review"); None — так и не прошёл
+    """
+    for attempt in range(GUARDRAIL_RETRIES + 1):
+        answer, rejected = guardrails.apply("review", answer)
+        if not rejected:
+            return answer
+        logging.info(f"guardrails: ответ отклонён правилом {rejected} ({endpoint})")
+        if attempt == GUARDRAIL_RETRIES:
+            break
+        retry = dict(payload, messages=payload["messages"] + [
+            {"role": "assistant", "content": answer},
+            {"role": "user", "content": _GUARDRAIL_HINT},
+        ])
+        status, data, raw = await _post_chat(retry, endpoint, priority=priority, user_id=user_id)
+        answer = _content(data)
+    return None
+
+
+# общие правила ответа на отзыв (одиночный и пакетный промпт)
+_REVIEW_RULES = """• Если отзыв положительный — поблагодари, отметь товар, пожелай приятных покупок.
+• Если отзыв отрицательный — извинись, прояви эмпатию, но не предлагай помощь в личных сообщениях.
+• Если текста нет — дай короткий нейтральный ответ.
+• Обязательно вначале любого отзыва поблагодари за отзыв или за обратную связь.
+• Пиши естественно и разными формулировками.
+• Не будь слишком длинным — 1–3 предложения максимум.
+• Если текста отзыва нет, не надо об этом мне сообщать в ответе 
+"""
+
+
+def _cached_answer(key: Optional[str]) -> Optional[str]:
+    """
+    Ответ из ai_cache через тот же фильтр guardrails ("review"): в кэше могут
+    лежать ответы, сохранённые до появления или правки правил. Отклонённый
+    вариант выбрасывается из кэша и считается промахом.
+    """
+    cached = ai_cache.get(key)
+    if not cached:
+        return None
+    answer, rejected = guardrails.apply("review", cached)
+    if rejected:
+        ai_cache.discard(key, cached)
+        return None
+    return answer
+
+
+def is_answer_cached(text: str, stars: int) -> bool:
+    """
+    generate_ai_answer ответит из кэша, без запроса к модели
+    """
+    return ai_cache.ready(ai_cache.make_key(text, stars, PROMPT_VERSION, MODEL))
+
+
+async def generate_ai_answer(text: str, stars: int, user_id: Optional[int] = None,
+                             priority: int = INTERACTIVE,
+                             on_progress: Optional[ProgressCallback] = None) -> str:
+    """
+    on_progress — получать ответ по кускам по мере генерации (стриминг)
+    """
+    cache_key = ai_cache.make_key(text, stars, PROMPT_VERSION, MODEL)
+    cached = _cached_answer(cache_key)
+    if cached:
+        return cached
 
-async def generate_ai_answer(text: str, stars: int) -> str:
     # корректная подстановка текста
     user_text = text if text else "Покупатель не написал текст"
 
@@ -19,14 +281,7 @@ async def generate_ai_answer(text: str, stars: int) -> str:
 Оценка: {stars} ⭐
 
 Сгенерируй корректный ответ:
-• Если отзыв положительный — поблагодари, отметь товар, пожелай приятных покупок.
-• Если отзыв отрицательный — извинись, прояви эмпатию, но не предлагай помощь в личных сообщениях.
-• Если текста нет — дай короткий нейтральный ответ.
-• Обязательно вначале любого отзыва поблагодари за отзыв или за обратную связь.
-• Пиши естественно и разными формулировками.
-• Не будь слишком длинным — 1–3 предложения максимум.
-• Если текста отзыва нет, не надо об этом мне сообщать в ответе 
-"""
+{_REVIEW_RULES}"""
 
     payload = {
         "model": MODEL,
@@ -37,24 +292,148 @@ async def generate_ai_answer(text: str, stars: int) -> str:
         ]
     }
 
-    r = requests.post(
-        API_URL,
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {API_KEY}"
-        },
-        json=payload  # <==== ИСПРАВЛЕНО
-    )
+    raw = ""
+    try:
+        if on_progress:
+            answer = await _stream_chat(payload, "chat.review_answer", _guarded_progress(on_progress),
+                                        priority=priority, user_id=user_id)
+        else:
+            status, data, raw = await _post_chat(payload, "chat.review_answer", priority=priority, user_id=user_id)
+            answer = _content(data)
+        answer = await _guarded_reply(answer, payload, "chat.review_answer", priority, user_id)
+        if answer is None:
+            return AI_ANSWER_ERROR
+        ai_cache.put(cache_key, answer)
+        return answer
+    except Exception as e:
+        print("AI ERROR:", repr(e), raw)
+        return AI_ANSWER_ERROR
+
+
+# -------------------------
+# Пакетная генерация (воркер)
+# -------------------------
+BATCH_SIZE = 10
+# одновременных запросов одной пачки (куски + одиночные догенерации)
+BATCH_CONCURRENCY = 3
+# ответ длиннее — скорее всего модель склеила несколько отзывов
+MAX_ANSWER_LEN = 1000
 
+
+def _parse_batch(content: str, ids: List[str]) -> Dict[str, str]:
+    """
+    {"<id>": "<ответ>", ...} из ответа модели; невалидные элементы отбрасываются
+    """
+    content = content.strip()
+    if content.startswith("```"):
+        # ```json ... ```
+        content = content.split("\n", 1)[-1].rsplit("```", 1)[0]
+    try:
+        parsed = json.loads(content)
+    except ValueError:
+        return {}
+    if not isinstance(parsed, dict):
+        return {}
+    result = {}
+    for rid in ids:
+        answer = parsed.get(rid)
+        if isinstance(answer, str) and answer.strip() and len(answer) <= MAX_ANSWER_LEN:
+            result[rid] = answer.strip()
+    return result
+
+
+async def _generate_batch_chunk(chunk: List[Tuple[str, str, int]], user_id: Optional[int]) -> Dict[str, str]:
+    reviews = [
+        {"id": rid, "stars": stars, "text": text or "Покупатель не написал текст"}
+        for rid, text, stars in chunk
+    ]
+    prompt = f"""
+Ты — вежливый, внимательный и профессиональный менеджер Wildberries.
+
+Вот отзывы клиентов (JSON, у каждого id, оценка и текст):
+{json.dumps(reviews, ensure_ascii=False)}
+
+Сгенерируй корректный ответ на КАЖДЫЙ отзыв отдельно:
+{_REVIEW_RULES}
+Верни ТОЛЬКО JSON-объект без пояснений: ключ — id отзыва, значение — текст ответа.
+"""
+
+    payload = {
+        "model": MODEL,
+        "max_tokens": 150 * len(chunk) + 100,
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {"role": "system", "content": "Ты — профессиональный менеджер Wildberries"},
+            {"role": "user", "content": prompt}
+        ]
+    }
+
+    raw = ""
     try:
-        response = r.json()
-        return response["choices"][0]["message"]["content"].strip()
+        status, data, raw = await _post_chat(payload, "chat.review_answer_batch",
+                                             priority=BACKGROUND, user_id=user_id)
+        return _parse_batch(_content(data), [rid for rid, _, _ in chunk])
     except Exception as e:
-        print("AI ERROR:", e, r.text)
-        return "К сожалению, сейчас не могу сгенерировать ответ. Попробуйте ещё раз."
+        print("AI BATCH ERROR:", repr(e), raw)
+        return {}
+
+
+async def _gather_limited(coros: list, limit: int) -> list:
+    """
+    asyncio.gather, но одновременно выполняется не больше limit корутин
+    """
+    sem = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with sem:
+            return await coro
 
+    return await asyncio.gather(*(run(c) for c in coros))
 
-async def analyze_reviews_summary(text: str) -> str:
+
+async def generate_ai_answers_batch(items: List[Tuple[str, str, int]],
+                                    user_id: Optional[int] = None) -> Dict[str, str]:
+    """
+    Ответы на пачку отзывов [(id, текст, оценка)] -> {id: ответ}.
+    По BATCH_SIZE отзывов в одном запросе; то, что модель не вернула или
+    вернула криво, догенерируется одиночными вызовами. Отзыва нет в
+    результате — ответ получить не удалось.
+    """
+    answers: Dict[str, str] = {}
+    keys: Dict[str, Optional[str]] = {}
+    pending: List[Tuple[str, str, int]] = []
+    for rid, text, stars in items:
+        keys[rid] = ai_cache.make_key(text, stars, PROMPT_VERSION, MODEL)
+        cached = _cached_answer(keys[rid])
+        if cached:
+            answers[rid] = cached
+        else:
+            pending.append((rid, text, stars))
+
+    chunks = [pending[i:i + BATCH_SIZE] for i in range(0, len(pending), BATCH_SIZE)]
+    results = await _gather_limited([_generate_batch_chunk(c, user_id) for c in chunks], BATCH_CONCURRENCY)
+    for chunk, got in zip(chunks, results):
+        metrics.inc("ai_batch_items_total", {"result": "ok"}, len(got))
+        metrics.inc("ai_batch_items_total", {"result": "fallback"}, len(chunk) - len(got))
+        for rid, answer in got.items():
+            answer, rejected = guardrails.apply("review", answer)
+            if rejected:
+                # догенерируется одиночным вызовом (там есть повторная попытка)
+                continue
+            ai_cache.put(keys[rid], answer)
+            answers[rid] = answer
+
+    failed = [(rid, text, stars) for rid, text, stars in pending if rid not in answers]
+    singles = await _gather_limited([
+        generate_ai_answer(text, stars, user_id=user_id, priority=BACKGROUND) for _, text, stars in failed
+    ], BATCH_CONCURRENCY)
+    for (rid, _, _), answer in zip(failed, singles):
+        if answer != AI_ANSWER_ERROR:
+            answers[rid] = answer
+    return answers
+
+
+async def analyze_reviews_summary(text: str, user_id: Optional[int] = None) -> str:
     """
     Анализирует отзывы и делает краткую выжимку
     Без генерации ответов покупателям!
@@ -67,68 +446,191 @@ async def analyze_reviews_summary(text: str) -> str:
 
 {text}
 
-СДЕЛАЙ КРАТКУЮ ВЫЖИМКУ (максимум 300 символов):
-1. На что чаще всего ХВАЛЯТ покупатели?
-2. На что чаще всего ЖАЛУЮТСЯ покупатели? 
-3. Основные выводы для продавца.
+{_ANALYSIS_FORMAT}"""
 
-Формат ответа ТОЛЬКО В ТАКОМ СТИЛЕ:
-👍 Хвалят: [кратко основные плюсы]
-👎 Жалуются: [кратко основные минусы]  
-💡 Вывод: [главная рекомендация]
+    payload = {
+        "model": MODEL,
+        "max_tokens": 300,
+        "messages": [
+            {"role": "system", "content": "Ты — аналитик отзывов. Только анализ, без ответов покупателям."},
+            {"role": "user", "content": prompt}
+        ]
+    }
 
-Будь кратким и конкретным! Не генерируй ответы покупателям, только анализ.
+    raw = ""
+    try:
+        status, data, raw = await _post_chat(payload, "chat.analysis", priority=ANALYTICS, user_id=user_id)
+        return _filter_analysis(_content(data))
+    except Exception as e:
+        print("AI ANALYSIS ERROR:", repr(e), raw)
+        return AI_ANALYSIS_ERROR
+
+
+# -------------------------
+# Map-reduce анализ всех отзывов товара
+# -------------------------
+# бюджет токенов отзывов на один map-запрос
+MAP_CHUNK_BUDGET = 3000
+# больше кусков не шлём: сверх этого берём самые информативные отзывы;
+# ai_scheduler пускает столько ANALYTICS-запросов пользователя разом —
+# анализ занимает два раунда (map + reduce)
+MAX_MAP_CHUNKS = 8
+
+
+async def _summarize_chunk(title: str, chunk: List[Tuple[int, str]],
+                           user_id: Optional[int]) -> Optional[str]:
+    reviews_text = format_reviews(chunk)
+    prompt = f"""
+Ты — профессиональный аналитик отзывов Wildberries.
+
+Это одна из групп отзывов на товар ({title}):
+
+{reviews_text}
+Коротко (до 400 символов) выпиши, что в этой группе ХВАЛЯТ и на что ЖАЛУЮТСЯ,
+с примерной частотой (часто / иногда / единично). Без выводов и без ответов покупателям.
 """
 
     payload = {
         "model": MODEL,
-        "max_tokens": 300,
+        "max_tokens": 250,
         "messages": [
             {"role": "system", "content": "Ты — аналитик отзывов. Только анализ, без ответов покупателям."},
             {"role": "user", "content": prompt}
         ]
     }
 
-    r = requests.post(
-        API_URL,
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {API_KEY}"
-        },
-        json=payload
+    raw = ""
+    try:
+        status, data, raw = await _post_chat(payload, "chat.analysis_map", priority=ANALYTICS, user_id=user_id)
+        return _content(data)
+    except Exception as e:
+        print("AI ANALYSIS MAP ERROR:", repr(e), raw)
+        return None
+
+
+async def _reduce_summaries(title: str, partials: List[str], counts: List[int],
+                            user_id: Optional[int]) -> str:
+    joined = "\n\n".join(
+        f"Группа {i} ({n} отзывов):\n{p}" for i, (p, n) in enumerate(zip(partials, counts), 1)
     )
+    prompt = f"""
+Ты — профессиональный аналитик отзывов Wildberries.
 
-    try:
-        response = r.json()
-        result = response["choices"][0]["message"]["content"].strip()
-
-        # 🔥 УБИРАЕМ ЛЮБЫЕ ФРАЗЫ, КОТОРЫЕ ВЫГЛЯДЯТ КАК ОТВЕТЫ ПОКУПАТЕЛЯМ
-        unwanted_patterns = [
-            "Рады, что вам понравилось",
-            "Спасибо за отзыв",
-            "Благодарим за обратную связь",
-            "Приятного использования",
-            "Желаем приятных покупок",
-            "Надеемся на дальнейшее сотрудничество"
-        ]
+Ниже частичные выжимки по группам отзывов на товар ({title}).
+Объедини их с учётом размера групп: одинаковые темы складывай, частые ставь первыми.
+
+{joined}
+
+{_ANALYSIS_FORMAT}"""
 
-        for pattern in unwanted_patterns:
-            if pattern in result:
-                # Оставляем только часть до нежелательной фразы
-                result = result.split(pattern)[0].strip()
-                break
+    payload = {
+        "model": MODEL,
+        "max_tokens": 300,
+        "messages": [
+            {"role": "system", "content": "Ты — аналитик отзывов. Только анализ, без ответов покупателям."},
+            {"role": "user", "content": prompt}
+        ]
+    }
 
-        return result
+    raw = ""
+    try:
+        status, data, raw = await _post_chat(payload, "chat.analysis_reduce", priority=ANALYTICS, user_id=user_id)
+        return _filter_analysis(_content(data))
     except Exception as e:
-        print("AI ANALYSIS ERROR:", e, r.text)
-        return "Не удалось выполнить анализ отзывов"
+        print("AI ANALYSIS REDUCE ERROR:", repr(e), raw)
+        return AI_ANALYSIS_ERROR
+
+
+async def analyze_all_reviews(title: str, reviews: List[Tuple[int, str]],
+                              user_id: Optional[int] = None) -> Tuple[str, int]:
+    """
+    Выжимка по ВСЕМ отзывам товара [(оценка, текст)]: отзывы режутся на куски
+    по MAP_CHUNK_BUDGET токенов, куски суммируются параллельно (в пределах
+    ai_scheduler), частичные выжимки сводятся в итог одним запросом.
+    Если кусков больше MAX_MAP_CHUNKS — в анализ идут самые информативные.
+    Возвращает (выжимка, сколько отзывов вошло в анализ).
+    """
+    chunks = chunk_reviews(reviews, MAP_CHUNK_BUDGET)
+    if len(chunks) > MAX_MAP_CHUNKS:
+        picked = select_reviews(reviews, MAX_MAP_CHUNKS * MAP_CHUNK_BUDGET)
+        # picked отсортированы по убыванию ценности — лишний хвост наименее важен
+        chunks = chunk_reviews(picked, MAP_CHUNK_BUDGET)[:MAX_MAP_CHUNKS]
+    used = sum(len(c) for c in chunks)
+    if not chunks:
+        return AI_ANALYSIS_ERROR, 0
+    if len(chunks) == 1:
+        # всё влезло в один промпт — обычный анализ, один запрос
+        text = f"{title}\n\n" + format_reviews(chunks[0])
+        return await analyze_reviews_summary(text, user_id=user_id), used
+
+    partials = await asyncio.gather(*(_summarize_chunk(title, c, user_id) for c in chunks))
+    ok = [(p, len(c)) for c, p in zip(chunks, partials) if p]
+    if not ok:
+        return AI_ANALYSIS_ERROR, 0
+    used = sum(n for _, n in ok)
+    return await _reduce_summaries(title, [p for p, _ in ok], [n for _, n in ok], user_id), used
+
+
+# в delta-анализе из старой выжимки должно остаться хотя бы столько отзывов
+# (окно «последних N отзывов» сдвигается — старые выпадают, новые добавляются)
+MIN_DELTA_OVERLAP = 0.5
+
+
+async def analyze_article_reviews(article: str, reviews: List[Tuple[str, int, str]],
+                                  user_id: Optional[int] = None,
+                                  scope: Optional[str] = None) -> Tuple[str, int]:
+    """
+    Выжимка по артикулу [(id отзыва, оценка, текст)] с кэшем (analysis_cache):
+    набор отзывов не изменился — ответ из кэша; добавились новые, а большая
+    часть старых осталась — анализируем только новые и сливаем со старой
+    выжимкой; иначе полный analyze_all_reviews.
+    scope — магазин (имя профиля): артикулы разных магазинов не смешиваются.
+    """
+    title = f"ОТЗЫВЫ НА ТОВАР {article}:"
+    version = f"{ANALYSIS_PROMPT_VERSION}:{MODEL}"
+    ids = {rid for rid, _, _ in reviews}
+    prev = analysis_cache.get(article, scope)
+
+    if prev and prev.fingerprint == analysis_cache.fingerprint(ids, version):
+        metrics.inc("ai_analysis_cache_total", {"result": "hit"})
+        return prev.summary, prev.used
+
+    overlap = len(prev.ids & ids) if prev and prev.version == version else 0
+    if overlap and overlap >= MIN_DELTA_OVERLAP * len(prev.ids):
+        # выпавшие из окна отзывы остаются в старой выжимке — их вес уже невелик
+        kept = min(prev.used, overlap)
+        delta = [(rating, text) for rid, rating, text in reviews if rid not in prev.ids]
+        if not chunk_reviews(delta, MAP_CHUNK_BUDGET):
+            # новых отзывов с текстом нет (выпали старые или пришли дубли) — выжимка прежняя
+            metrics.inc("ai_analysis_cache_total", {"result": "hit"})
+            analysis_cache.put(article, version, ids, prev.summary, kept, scope)
+            return prev.summary, kept
+        delta_summary, delta_used = await analyze_all_reviews(title, delta, user_id=user_id)
+        if delta_summary != AI_ANALYSIS_ERROR:
+            metrics.inc("ai_analysis_cache_total", {"result": "delta"})
+            summary = await _reduce_summaries(
+                title, [prev.summary, delta_summary], [kept, delta_used], user_id
+            )
+            used = kept + delta_used
+            if summary != AI_ANALYSIS_ERROR:
+                analysis_cache.put(article, version, ids, summary, used, scope)
+            return summary, used
+
+    metrics.inc("ai_analysis_cache_total", {"result": "miss"})
+    summary, used = await analyze_all_reviews(title, [(rating, text) for _, rating, text in reviews],
+                                              user_id=user_id)
+    if summary != AI_ANALYSIS_ERROR:
+        analysis_cache.put(article, version, ids, summary, used, scope)
+    return summary, used
 
 
 # Добавь в конец ai_1.py
 
-async def generate_ai_question_answer(question_text: str) -> str:
+async def generate_ai_question_answer(question_text: str, user_id: Optional[int] = None,
+                                     on_progress: Optional[ProgressCallback] = None) -> str:
     """
     Генерирует ответ на ВОПРОС покупателя (не отзыв!)
+    on_progress — получать ответ по кускам по мере генерации (стриминг)
     """
     prompt = f"""
 Ты — вежливый и профессиональный менеджер Wildberries.
@@ -153,18 +655,17 @@ async def generate_ai_question_answer(question_text: str) -> str:
         ]
     }
 
-    r = requests.post(
-        API_URL,
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {API_KEY}"
-        },
-        json=payload
-    )
-
+    raw = ""
     try:
-        response = r.json()
-        return response["choices"][0]["message"]["content"].strip()
+        if on_progress:
+            answer = await _stream_chat(payload, "chat.question_answer", _guarded_progress(on_progress),
+                                        user_id=user_id)
+        else:
+            status, data, raw = await _post_chat(payload, "chat.question_answer", user_id=user_id)
+            answer = _content(data)
+        answer = await _guarded_reply(answer, payload, "chat.question_answer", INTERACTIVE, user_id)
+        if answer is not None:
+            return answer
     except Exception as e:
-        print("AI QUESTION ERROR:", e, r.text)
-        return "К сожалению, не могу сгенерировать ответ. Попробуйте снова."
+        print("AI QUESTION ERROR:", repr(e), raw)
+    return "К сожалению, не могу сгенерировать ответ. Попробуйте снова."
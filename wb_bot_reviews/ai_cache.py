@@ -0,0 +1,170 @@
+# ai_cache.py
+"""
+Кэш AI-ответов на отзывы по содержимому промпта.
+
+Ключ — хэш нормализованных входов (текст, оценка, версия промпта, модель),
+поэтому все пустые 5⭐ и все «всё отлично» попадают в одну запись.
+На ключ храним до VARIANTS разных ответов: пока вариантов меньше — идём в
+AI и докладываем, потом отдаём их по кругу. Вытеснение LRU + TTL.
+Если задан AI_CACHE_FILE — кэш переживает перезапуск (JSON).
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import metrics
+
+MAX_ENTRIES = 5000
+VARIANTS = 3
+TTL = 7 * 24 * 3600  # сек
+# длинные отзывы почти не повторяются — не засоряем ими LRU
+MAX_TEXT_LEN = 200
+CACHE_FILE = os.getenv("AI_CACHE_FILE", "")
+
+_NON_WORD = re.compile(r"[^\w]+")
+
+metrics.describe("ai_cache_requests_total", "Обращения к кэшу AI-ответов (result=hit|miss|skip)")
+
+
+class _Entry:
+    __slots__ = ("variants", "created", "next")
+
+    def __init__(self, variants: List[str], created: float):
+        self.variants = variants
+        self.created = created
+        self.next = 0
+
+
+_lock = threading.Lock()
+_entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+
+def normalize(text: str) -> str:
+    """
+    Регистр, ё/е, пунктуация, эмодзи и лишние пробелы не влияют на ключ
+    """
+    text = (text or "").lower().replace("ё", "е")
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def make_key(text: str, stars: int, prompt_version: str, model: str) -> Optional[str]:
+    """
+    None — такой отзыв не кэшируем
+    """
+    norm = normalize(text)
+    if len(norm) > MAX_TEXT_LEN:
+        return None
+    raw = "\x1f".join((norm, str(stars), prompt_version, model))
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get(key: Optional[str]) -> Optional[str]:
+    """
+    Готовый вариант ответа или None, если пора спросить AI
+    """
+    if key is None:
+        metrics.inc("ai_cache_requests_total", {"result": "skip"})
+        return None
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and now - entry.created > TTL:
+            del _entries[key]
+            entry = None
+        if entry is None or len(entry.variants) < VARIANTS:
+            result = None
+        else:
+            _entries.move_to_end(key)
+            result = entry.variants[entry.next % len(entry.variants)]
+            entry.next += 1
+    metrics.inc("ai_cache_requests_total", {"result": "miss" if result is None else "hit"})
+    return result
+
+
+def ready(key: Optional[str]) -> bool:
+    """
+    get() отдаст ответ без AI (без ротации вариантов и метрик)
+    """
+    if key is None:
+        return False
+    with _lock:
+        entry = _entries.get(key)
+        return (entry is not None and time.time() - entry.created <= TTL
+                and len(entry.variants) >= VARIANTS)
+
+
+def put(key: Optional[str], answer: str):
+    if key is None or not answer:
+        return
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            entry = _entries[key] = _Entry([], time.time())
+        if answer not in entry.variants and len(entry.variants) < VARIANTS:
+            entry.variants.append(answer)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def discard(key: Optional[str], answer: str):
+    """
+    Убрать вариант ответа (например, больше не проходит фильтр) — место займёт новый
+    """
+    if key is None:
+        return
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and answer in entry.variants:
+            entry.variants.remove(answer)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        full = sum(1 for e in _entries.values() if len(e.variants) >= VARIANTS)
+        return {"entries": len(_entries), "full": full}
+
+
+# -------------------------
+# Сохранение на диск
+# -------------------------
+def load(path: Optional[str] = None):
+    path = path or CACHE_FILE
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        logging.exception(f"ai_cache: не удалось прочитать {path}")
+        return
+    now = time.time()
+    with _lock:
+        for key, item in data.items():
+            if now - item["created"] <= TTL:
+                _entries[key] = _Entry(item["variants"][:VARIANTS], item["created"])
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def save(path: Optional[str] = None):
+    path = path or CACHE_FILE
+    if not path:
+        return
+    with _lock:
+        data = {k: {"variants": e.variants, "created": e.created} for k, e in _entries.items()}
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
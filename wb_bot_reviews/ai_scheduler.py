@@ -0,0 +1,174 @@
+# ai_scheduler.py
+"""
+Очередь AI-запросов с приоритетами.
+
+Все вызовы OpenRouter (кнопки, аналитика, воркер) проходят через slot():
+одновременно выполняется не больше MAX_CONCURRENT запросов, из них
+INTERACTIVE_RESERVED — только для кнопок. Лимит на пользователя
+(PER_USER_CONCURRENT) считается отдельно по каждому приоритету: фоновые
+автоответы пользователя не занимают слоты его же кликов. Освободившийся
+слот получает самый приоритетный из ожидающих (при равном приоритете —
+кто раньше пришёл), поэтому клик по кнопке обгоняет тысячи фоновых автоответов.
+"""
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Set, Tuple
+
+import metrics
+
+# приоритеты: меньше — важнее
+INTERACTIVE = 0   # кнопки пользователя
+ANALYTICS = 1     # анализ отзывов
+BACKGROUND = 2    # автоответы воркера
+SPECULATIVE = 3   # черновики «на всякий случай» (prefetch.py)
+
+PRIORITY_NAMES = {
+    INTERACTIVE: "interactive", ANALYTICS: "analytics",
+    BACKGROUND: "background", SPECULATIVE: "speculative",
+}
+
+MAX_CONCURRENT = 12
+# столько слотов из MAX_CONCURRENT не отдаём ничему, кроме кнопок
+INTERACTIVE_RESERVED = 1
+# одновременных запросов от одного пользователя — на каждый приоритет отдельно;
+# аналитике — на все map-запросы одного анализа сразу (ai.MAX_MAP_CHUNKS)
+PER_USER_CONCURRENT = {INTERACTIVE: 2, ANALYTICS: 8, BACKGROUND: 2, SPECULATIVE: 2}
+
+metrics.describe("ai_scheduler_queue_depth", "AI-запросы в очереди по приоритетам")
+metrics.describe("ai_scheduler_running", "AI-запросы в работе")
+metrics.describe("ai_scheduler_wait_seconds", "Время ожидания слота AI")
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "user_id", "future")
+
+    def __init__(self, priority: int, seq: int, user_id: Optional[int], future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.user_id = user_id
+        self.future = future
+
+
+_seq = itertools.count()
+_queue: List[_Waiter] = []        # отсортирована по (priority, seq)
+_running = 0
+_per_user: Dict[Tuple[int, int], int] = {}   # (пользователь, приоритет) -> в работе
+_holders: Set[asyncio.Task] = set()          # задачи, которые сейчас держат слот
+
+
+def _can_run(priority: int, user_id: Optional[int]) -> bool:
+    limit = MAX_CONCURRENT if priority == INTERACTIVE else MAX_CONCURRENT - INTERACTIVE_RESERVED
+    if _running >= limit:
+        return False
+    return user_id is None or _per_user.get((user_id, priority), 0) < PER_USER_CONCURRENT.get(priority, 1)
+
+
+def _acquire(priority: int, user_id: Optional[int]):
+    global _running
+    _running += 1
+    if user_id is not None:
+        key = (user_id, priority)
+        _per_user[key] = _per_user.get(key, 0) + 1
+
+
+def _release(priority: int, user_id: Optional[int]):
+    global _running
+    _running -= 1
+    if user_id is not None:
+        key = (user_id, priority)
+        left = _per_user.get(key, 1) - 1
+        if left:
+            _per_user[key] = left
+        else:
+            _per_user.pop(key, None)
+    _dispatch()
+
+
+def _dispatch():
+    # раздаём свободные слоты по порядку очереди, пропуская упёршихся в лимиты
+    i = 0
+    while _running < MAX_CONCURRENT and i < len(_queue):
+        w = _queue[i]
+        if w.future.done() or not _can_run(w.priority, w.user_id):
+            i += 1
+            continue
+        del _queue[i]
+        _acquire(w.priority, w.user_id)
+        w.future.set_result(None)
+    _publish()
+
+
+def _publish():
+    depth = {name: 0 for name in PRIORITY_NAMES.values()}
+    for w in _queue:
+        depth[PRIORITY_NAMES.get(w.priority, str(w.priority))] += 1
+    for name, n in depth.items():
+        metrics.set_gauge("ai_scheduler_queue_depth", n, {"priority": name})
+    metrics.set_gauge("ai_scheduler_running", _running)
+
+
+def _enqueue(w: _Waiter):
+    # очередь короткая — вставка с сохранением порядка (priority, seq)
+    i = len(_queue)
+    while i and (_queue[i - 1].priority, _queue[i - 1].seq) > (w.priority, w.seq):
+        i -= 1
+    _queue.insert(i, w)
+
+
+@asynccontextmanager
+async def slot(priority: int = INTERACTIVE, user_id: Optional[int] = None):
+    """
+    async with slot(BACKGROUND, user_id): ...  — ждёт свой слот на AI-запрос
+    """
+    started = time.perf_counter()
+    if _can_run(priority, user_id) and not _queue:
+        _acquire(priority, user_id)
+        _publish()
+    else:
+        w = _Waiter(priority, next(_seq), user_id, asyncio.get_running_loop().create_future())
+        _enqueue(w)
+        # свободный слот мог ждать только потому, что очередь упёрлась в лимиты пользователей
+        _dispatch()
+        try:
+            await w.future
+        except asyncio.CancelledError:
+            if w.future.done() and not w.future.cancelled():
+                # слот уже выдали, а нас отменили — вернуть его
+                _release(priority, user_id)
+            else:
+                if w in _queue:
+                    _queue.remove(w)
+                _publish()
+            raise
+    metrics.observe("ai_scheduler_wait_seconds", time.perf_counter() - started,
+                    {"priority": PRIORITY_NAMES.get(priority, str(priority))})
+    task = asyncio.current_task()
+    _holders.add(task)
+    try:
+        yield
+    finally:
+        _holders.discard(task)
+        _release(priority, user_id)
+
+
+def holds_slot(task: asyncio.Task) -> bool:
+    """
+    Задача уже получила слот и выполняет запрос (а не ждёт в очереди)
+    """
+    return task in _holders
+
+
+def snapshot() -> Dict[str, object]:
+    """
+    Состояние очереди: в работе, ожидают по приоритетам, p95 ожидания (сек)
+    """
+    waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+    for w in _queue:
+        waiting[PRIORITY_NAMES.get(w.priority, str(w.priority))] += 1
+    wait_p95 = {
+        name: metrics.quantile("ai_scheduler_wait_seconds", 0.95, {"priority": name})
+        for name in PRIORITY_NAMES.values()
+    }
+    return {"running": _running, "limit": MAX_CONCURRENT, "waiting": waiting, "wait_p95": wait_p95}
@@ -0,0 +1,129 @@
+# analysis_cache.py
+"""
+Кэш AI-анализа по артикулам.
+
+На артикул магазина (ключ — профиль продавца + артикул) храним последнюю
+выжимку и набор id отзывов, по которым она сделана. Отпечаток
+(fingerprint) — хэш отсортированных id + версии промпта и модели: совпал —
+отдаём выжимку сразу. Если новый набор в основном пересекается со старым,
+анализировать нужно только новые отзывы (delta) и слить результат со
+старой выжимкой (см. ai.analyze_article_reviews).
+Если задан ANALYSIS_CACHE_FILE — кэш переживает перезапуск (JSON).
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import FrozenSet, Iterable, Optional
+
+MAX_ENTRIES = 1000
+TTL = 30 * 24 * 3600  # сек
+CACHE_FILE = os.getenv("ANALYSIS_CACHE_FILE", "")
+
+
+class Entry:
+    __slots__ = ("fingerprint", "version", "ids", "summary", "used", "created")
+
+    def __init__(self, fingerprint: str, version: str, ids: FrozenSet[str],
+                 summary: str, used: int, created: float):
+        self.fingerprint = fingerprint
+        self.version = version
+        self.ids = ids
+        self.summary = summary
+        self.used = used
+        self.created = created
+
+
+_lock = threading.Lock()
+_entries: "OrderedDict[str, Entry]" = OrderedDict()
+
+
+def fingerprint(ids: Iterable[str], version: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(version.encode("utf-8"))
+    for rid in sorted(ids):
+        h.update(b"\x1f")
+        h.update(rid.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _key(article: str, scope: Optional[str]) -> str:
+    # "unknown" и артикулы продавца совпадают у разных магазинов
+    return f"{scope}\x1f{article}" if scope else article
+
+
+def get(article: str, scope: Optional[str] = None) -> Optional[Entry]:
+    key = _key(article, scope)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.created > TTL:
+            del _entries[key]
+            return None
+        _entries.move_to_end(key)
+        return entry
+
+
+def put(article: str, version: str, ids: Iterable[str], summary: str, used: int,
+        scope: Optional[str] = None):
+    ids = frozenset(ids)
+    entry = Entry(fingerprint(ids, version), version, ids, summary, used, time.time())
+    key = _key(article, scope)
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+# -------------------------
+# Сохранение на диск
+# -------------------------
+def load(path: Optional[str] = None):
+    path = path or CACHE_FILE
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        logging.exception(f"analysis_cache: не удалось прочитать {path}")
+        return
+    now = time.time()
+    with _lock:
+        for article, item in data.items():
+            if now - item["created"] > TTL:
+                continue
+            _entries[article] = Entry(
+                item["fingerprint"], item["version"], frozenset(item["ids"]),
+                item["summary"], item["used"], item["created"]
+            )
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def save(path: Optional[str] = None):
+    path = path or CACHE_FILE
+    if not path:
+        return
+    with _lock:
+        data = {
+            article: {
+                "fingerprint": e.fingerprint, "version": e.version, "ids": sorted(e.ids),
+                "summary": e.summary, "used": e.used, "created": e.created,
+            }
+            for article, e in _entries.items()
+        }
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
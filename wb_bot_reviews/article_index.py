@@ -0,0 +1,112 @@
+# article_index.py
+"""
+Индекс отзывов по артикулам, который ведётся по мере загрузки страниц.
+
+На магазин (ключ — имя профиля продавца) храним только id: канонический
+артикул (nmId / wbArticle) -> множество id его отзывов, и два словаря
+псевдонимов — запись nmId (в т.ч. с ведущими нулями) и артикул продавца
+(supplierArticle) отдельно, чтобы числовой артикул продавца не перекрыл
+чужой nmId. Поиск артикула и группировка — словарь, а не проход по всем
+отзывам с попытками int(). Сами отзывы индекс не держит.
+"""
+import threading
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+# id отзывов на магазин не больше — давно не встречавшиеся вытесняются
+MAX_REVIEWS_PER_STORE = 50000
+
+
+def _nm_key(value: str) -> str:
+    value = value.strip()
+    # nmId вводят и как «00123», и как «123»
+    return str(int(value)) if value.isdigit() else value.lower()
+
+
+def _supplier_key(value: str) -> str:
+    return value.strip().lower()
+
+
+class ArticleIndex:
+    def __init__(self):
+        self.by_article: Dict[str, Set[str]] = {}
+        self.nm_aliases: Dict[str, str] = {}
+        self.supplier_aliases: Dict[str, str] = {}
+        # id отзыва -> канонический артикул; порядок — от давно встречавшихся к недавним
+        self.article_of: Dict[str, str] = {}
+        # артикул -> его ключи в nm_aliases / supplier_aliases (чтобы убрать вместе с ним)
+        self.alias_keys: Dict[str, Set[Tuple[bool, str]]] = {}
+
+    def add(self, r) -> None:
+        article = r.nm_id
+        if not article:
+            return
+        old = self.article_of.pop(r.id, None)
+        if old is not None and old != article:
+            self._discard(old, r.id)
+        self.article_of[r.id] = article
+        self.by_article.setdefault(article, set()).add(r.id)
+        self._alias(self.nm_aliases, False, _nm_key(article), article)
+        if r.supplier_article:
+            self._alias(self.supplier_aliases, True, _supplier_key(r.supplier_article), article)
+
+    def _alias(self, aliases: Dict[str, str], supplier: bool, key: str, article: str) -> None:
+        if aliases.setdefault(key, article) == article:
+            self.alias_keys.setdefault(article, set()).add((supplier, key))
+
+    def _discard(self, article: str, rid: str) -> None:
+        items = self.by_article.get(article)
+        if items is None:
+            return
+        items.discard(rid)
+        if items:
+            return
+        # последний отзыв артикула ушёл — артикул и его псевдонимы больше не нужны
+        del self.by_article[article]
+        for supplier, key in self.alias_keys.pop(article, ()):
+            aliases = self.supplier_aliases if supplier else self.nm_aliases
+            if aliases.get(key) == article:
+                del aliases[key]
+
+    def canonical(self, article: str) -> Optional[str]:
+        article = str(article)
+        if article in self.by_article:
+            return article
+        # сначала nmId, потом артикул продавца
+        return self.nm_aliases.get(_nm_key(article)) or self.supplier_aliases.get(_supplier_key(article))
+
+    def trim(self, limit: int) -> None:
+        while len(self.article_of) > limit:
+            rid = next(iter(self.article_of))
+            self._discard(self.article_of.pop(rid), rid)
+
+
+_lock = threading.Lock()
+_indexes: Dict[str, ArticleIndex] = {}
+
+
+def add(store: str, feedbacks: Iterable) -> None:
+    """
+    Учесть страницу загруженных отзывов магазина
+    """
+    with _lock:
+        index = _indexes.setdefault(store, ArticleIndex())
+        for r in feedbacks:
+            index.add(r)
+        index.trim(MAX_REVIEWS_PER_STORE)
+
+
+def canonical(store: str, article: str) -> Optional[str]:
+    """
+    Канонический артикул по nmId или артикулу продавца (None — такого не видели)
+    """
+    with _lock:
+        index = _indexes.get(store)
+        return index.canonical(article) if index else None
+
+
+def clear(store: Optional[str] = None) -> None:
+    with _lock:
+        if store is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(store, None)
@@ -0,0 +1,62 @@
+# bench_import.py
+"""
+Замер времени импорта «лёгких» модулей.
+
+Каждый модуль импортируется в отдельном чистом интерпретаторе, берётся
+медиана из нескольких запусков. Заодно проверяем, что модуль не тянет
+за собой aiogram/handlers. Код возврата 1 — есть регрессия:
+    python bench_import.py [--runs 7] [--budget-ms 150]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = ("feedback", "wb_api", "storage", "worker")
+# тяжёлые модули, которых не должно быть после импорта лёгких
+FORBIDDEN = ("aiogram", "handlers", "keyboards", "requests", "ai")
+
+_PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import {module}
+ms = (time.perf_counter() - t) * 1000
+print(json.dumps({{"ms": ms, "loaded": [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, runs: int):
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = _PROBE.format(module=module, forbidden=FORBIDDEN)
+    timings, loaded = [], set()
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", code], cwd=here,
+            capture_output=True, text=True, check=True
+        ).stdout
+        res = json.loads(out.strip().splitlines()[-1])
+        timings.append(res["ms"])
+        loaded.update(res["loaded"])
+    return statistics.median(timings), sorted(loaded)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Время импорта лёгких модулей бота")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    args = parser.parse_args()
+
+    failed = False
+    for module in MODULES:
+        ms, loaded = measure(module, args.runs)
+        bad = ms > args.budget_ms or loaded
+        failed |= bool(bad)
+        extra = f"  лишние импорты: {', '.join(loaded)}" if loaded else ""
+        print(f"{'FAIL' if bad else 'ok  '} {module:<10} {ms:7.1f} ms{extra}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,22 @@
 import asyncio
 import logging
+import os
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from handlers import router
-from handlers import _auto_worker_loop
+from keyboards import new_token_kb
+from worker import auto_worker_loop
+import ai
+import metrics
+import trends
 
 logging.basicConfig(level=logging.INFO)
 
 BOT_TOKEN = "токен"
+# порт для GET /metrics (Prometheus); 0 — не поднимать
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# 0 — автоответы крутит отдельный процесс (python worker.py)
+RUN_AUTO_WORKER = os.getenv("RUN_AUTO_WORKER", "1") != "0"
 
 bot = Bot(
     token=BOT_TOKEN,
@@ -18,18 +27,44 @@ dp = Dispatcher()
 dp.include_router(router)
 
 
+async def notify_token_expired(user_id: int):
+    try:
+        await bot.send_message(
+            user_id,
+            "❗ Ваш токен авторизации истёк.\n"
+            "Нажмите кнопку ниже, чтобы обновить его.",
+            reply_markup=new_token_kb()
+        )
+    except Exception:
+        logging.exception(f"Не удалось уведомить пользователя {user_id}")
+
+
 async def main():
     print("✅ Бот запущен!")
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+    # пул соединений к OpenRouter открываем один раз на процесс
+    await ai.start()
+    trends.load()
     stop_event = asyncio.Event()
     # старт фоновой задачи
-    auto_task = asyncio.create_task(_auto_worker_loop(stop_event))
+    auto_task = None
+    if RUN_AUTO_WORKER:
+        auto_task = asyncio.create_task(auto_worker_loop(stop_event, notify_token_expired))
+    # недельные сводки пишем на диск периодически, а не только при выходе
+    trends_task = asyncio.create_task(trends.autosave(stop_event)) if trends.TRENDS_FILE else None
 
     try:
         await dp.start_polling(bot)
     finally:
         # при завершении — остановим таск
         stop_event.set()
-        await auto_task
+        if auto_task:
+            await auto_task
+        if trends_task:
+            await trends_task
+        await ai.close()
+        trends.save()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+# breaker.py
+import threading
+import time
+from typing import Dict, Optional
+
+# после стольких ошибок подряд хост считается недоступным
+FAILURE_THRESHOLD = 5
+# сколько секунд не ходим на хост, прежде чем пустить пробный запрос
+RESET_TIMEOUT = 30
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Хост помечен как недоступный — запрос даже не отправлялся
+    """
+
+
+class CircuitBreaker:
+    """
+    Простой circuit breaker: closed -> open после серии ошибок,
+    через RESET_TIMEOUT пропускает один пробный запрос (half-open).
+    Успешная проба закрывает breaker, неуспешная — снова открывает.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD,
+                 reset_timeout: float = RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+            # half-open: пропускаем только один пробный запрос
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """
+        Запрос прерван без результата (отмена, ошибка не по вине хоста):
+        состояние не меняем, но пробный слот half-open освобождаем
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        """
+        Сколько секунд осталось до пробного запроса (0 — можно пробовать)
+        """
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+
+# ====== РЕЕСТР BREAKER'ОВ (по хосту) ======
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with _registry_lock:
+        br = _breakers.get(name)
+        if br is None:
+            br = CircuitBreaker(name)
+            _breakers[name] = br
+        return br
+
+
+def snapshot() -> Dict[str, Dict[str, Optional[float]]]:
+    """
+    Состояние всех breaker'ов: {host: {state, retry_after}}
+    """
+    with _registry_lock:
+        items = list(_breakers.items())
+    return {name: {"state": br.state, "retry_after": round(br.retry_after(), 1)} for name, br in items}
@@ -0,0 +1,125 @@
+# fastpath.py
+"""
+Быстрая локальная развилка «шаблон или AI» для отзывов.
+
+На 4–5⭐ без текста или с коротким дежурным «Все супер, спасибо!» AI не
+нужен: такие отзывы получают ответ из ротации готовых вариантов. В AI
+уходят только содержательные и негативные отзывы. Классификатор — правила
+и словари, без сети и моделей (микросекунды на отзыв).
+
+Пороги настраиваются на магазин (/fastpath): минимальная оценка и
+максимум слов. Сколько отзывов ушло в шаблоны, а сколько в AI, считается
+по магазину (report) и в метрике ai_fastpath_total.
+"""
+import threading
+from typing import Dict, Optional, Tuple
+
+import metrics
+from ai_cache import normalize
+
+ROUTE_TEMPLATE = "template"
+ROUTE_AI = "ai"
+
+DEFAULT_MIN_STARS = 4
+DEFAULT_MAX_WORDS = 6
+
+metrics.describe("ai_fastpath_total", "Отзывы, направленные в шаблон или в AI, по маршруту")
+
+# слова дежурной похвалы (после normalize: нижний регистр, ё -> е)
+_PRAISE = frozenset("""
+    спасибо спс благодарю благодарность огромное большое
+    все всё супер отлично отличный отличная отличное отличные класс классный классная классное
+    хорошо хороший хорошая хорошее хорошие прекрасно прекрасный шикарно шикарный шикарная
+    круто крутой крутая топ огонь бомба пушка идеально идеальный идеальная норм нормально
+    ок ok good nice top super
+    доволен довольна довольны рада рад рады восторге понравился понравилась понравилось понравились
+    нравится нравятся рекомендую советую красиво красивый красивая красивое удобно удобный удобная
+    качество качественный качественная качественно быстро быстрая доставка пришел пришла пришло
+    соответствует соответствуют описанию описание фото размер размеру подошел подошла подошло цвет
+    товар товаром вещь покупка покупкой заказ продавец продавцу магазин магазину цена цене
+    очень всем в во и на за по как с со то что это мне нам же просто всего вообще
+""".split())
+
+# «Недостатки: нет» — это не недостаток (слова-связки вроде «недостатков» отбрасываем:
+# «Недостатков нет», «минусов не обнаружено», «никаких»)
+_EMPTY_CONS = frozenset(("", "нет", "нету", "не обнаружено", "не нашла", "не нашел", "отсутствуют", "все хорошо"))
+_CONS_FILLER = frozenset("недостатков недостатки недостаток минусов минусы минус никаких пока".split())
+
+_lock = threading.Lock()
+_next_variant: Dict[Tuple[int, str], int] = {}
+# (user_id, магазин) -> {маршрут: число отзывов}
+_routed: Dict[Tuple[int, str], Dict[str, int]] = {}
+
+_VARIANTS = (
+    "Спасибо за высокую оценку! Рады, что покупка понравилась. Ждём вас снова!",
+    "Благодарим за отзыв и отличную оценку! Приятных покупок!",
+    "Спасибо, что выбрали нас! Нам очень приятно. Будем рады видеть вас снова.",
+    "Спасибо за ваш отзыв! Рады, что всё понравилось. Хороших покупок!",
+    "Благодарим за доверие и высокую оценку! Ждём вас за новыми покупками.",
+    "Спасибо за тёплый отзыв! Очень рады, что товар вам подошёл.",
+)
+
+
+def _empty_cons(cons: str) -> bool:
+    return " ".join(w for w in normalize(cons).split() if w not in _CONS_FILLER) in _EMPTY_CONS
+
+
+def classify(review, min_stars: int = DEFAULT_MIN_STARS, max_words: int = DEFAULT_MAX_WORDS) -> str:
+    """
+    ROUTE_TEMPLATE — дежурная похвала, ROUTE_AI — всё остальное
+    """
+    if (review.valuation or 0) < min_stars:
+        return ROUTE_AI
+    if not _empty_cons(review.cons):
+        return ROUTE_AI
+    raw = " ".join(t for t in (review.text, review.pros) if t)
+    if "?" in raw:
+        # вопрос покупателя — шаблоном не ответить
+        return ROUTE_AI
+    words = normalize(raw).split()
+    if len(words) > max_words:
+        return ROUTE_AI
+    # шаблон — только если каждое слово из словаря похвалы: незнакомое слово
+    # может оказаться «отвратительно» или «фуфло», такое решает AI
+    if all(w in _PRAISE for w in words):
+        return ROUTE_TEMPLATE
+    return ROUTE_AI
+
+
+def template_answer(user_id: int, store: str) -> str:
+    """
+    Следующий вариант ответа по кругу (свой счётчик на магазин)
+    """
+    key = (user_id, store)
+    with _lock:
+        i = _next_variant.get(key, 0)
+        _next_variant[key] = (i + 1) % len(_VARIANTS)
+    return _VARIANTS[i]
+
+
+def route(user_id: int, store: str, review, thresholds: Optional[Tuple[int, int]] = None) -> Optional[str]:
+    """
+    Текст шаблонного ответа или None — отзыв нужно отдать AI.
+    thresholds — (min_stars, max_words) магазина, см. storage.get_fastpath_thresholds
+    """
+    min_stars, max_words = thresholds or (DEFAULT_MIN_STARS, DEFAULT_MAX_WORDS)
+    decision = classify(review, min_stars, max_words)
+    with _lock:
+        counts = _routed.setdefault((user_id, store), {ROUTE_TEMPLATE: 0, ROUTE_AI: 0})
+        counts[decision] += 1
+    metrics.inc("ai_fastpath_total", {"route": decision})
+    if decision == ROUTE_AI:
+        return None
+    return template_answer(user_id, store)
+
+
+def report(user_id: int, store: str) -> Dict[str, float]:
+    """
+    {"template": n, "ai": n, "template_pct": %, "ai_pct": %} с момента запуска процесса
+    """
+    with _lock:
+        counts = dict(_routed.get((user_id, store), {ROUTE_TEMPLATE: 0, ROUTE_AI: 0}))
+    total = counts[ROUTE_TEMPLATE] + counts[ROUTE_AI]
+    for name in (ROUTE_TEMPLATE, ROUTE_AI):
+        counts[f"{name}_pct"] = 100.0 * counts[name] / total if total else 0.0
+    return counts
@@ -0,0 +1,136 @@
+# feedback.py
+"""
+Нормализованный отзыв WB.
+
+WB отдаёт отзывы в нескольких схемах (публичное API, seller-services v2,
+старые варианты с productDetails/nomenclature/...). Разбираем payload
+один раз в Feedback, дальше весь код работает с атрибутами.
+"""
+import sys
+from typing import Any, Dict, Optional
+
+# значения, которые покупатели/WB пишут вместо пустого поля
+_EMPTY_TEXTS = {"нет", "не указано", "null", "none", ""}
+
+
+class Feedback:
+    __slots__ = (
+        "id", "nm_id", "valuation", "created", "text", "pros", "cons",
+        "user_name", "answered", "supplier_article", "product_name",
+    )
+
+    def __init__(self, id: str, nm_id: Optional[str], valuation: int, created: str,
+                 text: str, pros: str, cons: str, user_name: str, answered: bool,
+                 supplier_article: Optional[str] = None, product_name: Optional[str] = None):
+        self.id = id
+        self.nm_id = nm_id
+        self.valuation = valuation
+        self.created = created
+        self.text = text
+        self.pros = pros
+        self.cons = cons
+        self.user_name = user_name
+        self.answered = answered
+        self.supplier_article = supplier_article
+        self.product_name = product_name
+
+    def __repr__(self):
+        return f"Feedback(id={self.id!r}, nm_id={self.nm_id!r}, valuation={self.valuation})"
+
+    @property
+    def has_text(self) -> bool:
+        return bool(self.text or self.pros or self.cons)
+
+    def full_text(self, sep: str = " | ") -> str:
+        """
+        Комментарий + достоинства + недостатки одной строкой (для AI-анализа)
+        """
+        return sep.join(t for t in (self.text, self.pros, self.cons) if t)
+
+
+def _clean_text(value: Any) -> str:
+    if not value:
+        return ""
+    value = str(value).strip()
+    return "" if value.lower() in _EMPTY_TEXTS else value
+
+
+def _intern(value: Any) -> Optional[str]:
+    # артикулы и названия повторяются в сотнях отзывов — храним одну копию строки
+    if value is None or value == "":
+        return None
+    return sys.intern(str(value))
+
+
+def _valuation(raw: Dict[str, Any]) -> int:
+    val = raw.get("productValuation") or raw.get("valuation") or 0
+    try:
+        return int(float(str(val).replace(",", ".")))
+    except (TypeError, ValueError):
+        return 0
+
+
+def resolve_article(r: Dict[str, Any]) -> Optional[str]:
+    """
+    Артикул WB из любой известной схемы отзыва (None — не нашли)
+    """
+    # 1. Прямые ключи (на случай если WB вернёт в разных схемах)
+    for key in ("nmId", "nmid", "nm", "offerId", "productNmId",
+                "product_id", "productId", "imtId", "nomenclatureArticle"):
+        if r.get(key):
+            return str(r[key])
+
+    # 2. productInfo — ТУТ ЛЕЖИТ ОСНОВНОЙ АРТИКУЛ WB
+    pi = r.get("productInfo")
+    if isinstance(pi, dict):
+        if pi.get("wbArticle"):
+            return str(pi.get("wbArticle"))
+
+        # иногда WB отдаёт supplierArticle как строковый артикул
+        if pi.get("supplierArticle"):
+            return str(pi.get("supplierArticle"))
+
+    # 3. вложенные объекты альтернативных схем WB
+    for container, keys in (
+        ("productDetails", ("nmId", "nmid", "id", "imtId")),
+        ("product", ("nmId", "id", "nmid", "imtId")),
+        ("nomenclature", ("nmId",)),
+        ("item", ("nmId", "nmid")),
+        ("details", ("nmId", "nmid")),
+        ("source", ("nmId",)),
+    ):
+        obj = r.get(container)
+        if isinstance(obj, dict):
+            for key in keys:
+                if obj.get(key):
+                    return str(obj[key])
+
+    return None
+
+
+def normalize_feedback(raw: Dict[str, Any]) -> Feedback:
+    """
+    Payload отзыва WB (любой схемы) -> Feedback
+    """
+    info = raw.get("feedbackInfo") or {}
+    product_info = raw.get("productInfo") or {}
+    details = raw.get("productDetails") or {}
+    user = raw.get("wbUserDetails") or {}
+
+    answered = raw.get("isAnswered")
+    if answered is None:
+        answered = bool(raw.get("answer") or raw.get("answerInfo"))
+
+    return Feedback(
+        id=str(raw.get("id")),
+        nm_id=_intern(resolve_article(raw)),
+        valuation=_valuation(raw),
+        created=str(raw.get("createdDate") or ""),
+        text=_clean_text(info.get("feedbackText") or raw.get("text")),
+        pros=_clean_text(info.get("feedbackTextPros") or raw.get("pros")),
+        cons=_clean_text(info.get("feedbackTextCons") or raw.get("cons")),
+        user_name=_intern(raw.get("userName") or user.get("name")) or "",
+        answered=bool(answered),
+        supplier_article=_intern(product_info.get("supplierArticle") or details.get("supplierArticle")),
+        product_name=_intern(product_info.get("name") or details.get("productName")),
+    )
@@ -0,0 +1,261 @@
+# guardrails.py
+"""
+Фильтр текста, который AI отдаёт наружу.
+
+Правила — наборы фраз с действием:
+  truncate — обрезать текст перед первой найденной фразой;
+  reject   — текст не годится, его нужно сгенерировать заново;
+  redact   — заменить фразу на replacement (по умолчанию — убрать).
+Фразы всех правил набора собираются в один автомат Ахо–Корасик при
+загрузке модуля, так что текст проверяется за один проход, сколько бы
+фраз ни было. Регистр и ё/е не важны; фраза ищется целыми словами.
+
+Наборы: "review" — ответы покупателям (отзывы и вопросы), "analysis" —
+аналитика для продавца. Свои правила — JSON-файл в GUARDRAILS_FILE
+(см. load). Срабатывания считаются по правилам: stats() и метрика
+ai_guardrail_hits_total. Недописанный текст (стриминг) — preview().
+"""
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import metrics
+
+TRUNCATE = "truncate"
+REJECT = "reject"
+REDACT = "redact"
+ACTIONS = (TRUNCATE, REJECT, REDACT)
+
+RULES_FILE = os.getenv("GUARDRAILS_FILE", "")
+
+metrics.describe("ai_guardrail_hits_total", "Срабатывания правил фильтра AI-текста")
+
+
+class Rule:
+    __slots__ = ("name", "action", "phrases", "replacement")
+
+    def __init__(self, name: str, action: str, phrases: Iterable[str], replacement: str = ""):
+        if action not in ACTIONS:
+            raise ValueError(f"guardrails: неизвестное действие {action!r} в правиле {name!r}")
+        self.name = name
+        self.action = action
+        self.phrases = tuple(p for p in phrases if p.strip())
+        self.replacement = replacement
+
+
+def _fold(text: str) -> str:
+    # посимвольно, чтобы позиции совпадали с исходным текстом
+    return "".join(c if len(low := c.lower()) != 1 else low for c in text).replace("ё", "е")
+
+
+def _is_word(c: str) -> bool:
+    return c.isalnum() or c == "_"
+
+
+class Automaton:
+    """
+    Ахо–Корасик по фразам всех правил: find(text) -> [(start, end, rule)]
+    """
+
+    def __init__(self, rules: List[Rule]):
+        self.rules = rules
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # в состоянии заканчиваются фразы: (длина, индекс правила)
+        self._out: List[List[Tuple[int, int]]] = [[]]
+        for idx, rule in enumerate(rules):
+            for phrase in rule.phrases:
+                self._add(_fold(phrase.strip()), idx)
+        self._build()
+
+    def _add(self, phrase: str, rule_idx: int):
+        state = 0
+        for c in phrase:
+            nxt = self._goto[state].get(c)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][c] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(phrase), rule_idx))
+
+    def _build(self):
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for c, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and c not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(c, 0) if self._goto[f].get(c) != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> List[Tuple[int, int, Rule]]:
+        folded = _fold(text)
+        n = len(folded)
+        goto, fail, out = self._goto, self._fail, self._out
+        found = []
+        state = 0
+        for i, c in enumerate(folded):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for length, idx in out[state]:
+                start, end = i - length + 1, i + 1
+                # только целые слова: «озон» не должен ловиться в «озоновый»
+                if start > 0 and _is_word(folded[start - 1]) and _is_word(folded[start]):
+                    continue
+                if end < n and _is_word(folded[end]) and _is_word(folded[end - 1]):
+                    continue
+                found.append((start, end, self.rules[idx]))
+        return found
+
+
+# -------------------------
+# Правила по умолчанию
+# -------------------------
+_DEFAULT_RULES: Dict[str, List[Rule]] = {
+    "review": [
+        Rule("contact_offer", REJECT, (
+            "напишите нам", "пишите нам", "свяжитесь с нами", "позвоните нам", "позвоните",
+            "по телефону", "в личные сообщения", "в личных сообщениях", "в личку", "в лс", "в директ",
+            "whatsapp", "ватсап", "вотсап", "telegram", "телеграм", "телеграмм", "viber", "вайбер",
+            "наш номер", "нашу почту", "e-mail", "email", "@gmail.com", "@mail.ru",
+            "@yandex.ru", "t.me",
+        )),
+        Rule("competitor", REJECT, (
+            "ozon", "озон", "озоне", "яндекс маркет", "яндекс.маркет", "яндекс маркете", "мегамаркет",
+            "aliexpress", "алиэкспресс", "lamoda", "ламода", "авито", "avito", "kazanexpress", "казаньэкспресс",
+        )),
+        Rule("link", REJECT, ("http://", "https://", "www.")),
+        Rule("placeholder", REDACT, (
+            "[имя]", "[имя покупателя]", "[имя клиента]", "<имя>", "{имя}", "{name}", "[name]",
+            "[название товара]", "[ваше имя]", "[название магазина]",
+        )),
+    ],
+    "analysis": [
+        # аналитика — для продавца: всё, что похоже на ответ покупателю, отрезаем
+        Rule("customer_phrase", TRUNCATE, (
+            "Рады, что вам понравилось", "Спасибо за отзыв", "Благодарим за обратную связь",
+            "Приятного использования", "Желаем приятных покупок", "Надеемся на дальнейшее сотрудничество",
+        )),
+    ],
+}
+
+_SPACES = re.compile(r"[ \t]{2,}")
+_SPACE_BEFORE_PUNCT = re.compile(r"[ \t]+([,.!?;:])")
+_COMMA_BEFORE_END = re.compile(r",([.!?])")
+
+_lock = threading.Lock()
+_automata: Dict[str, Automaton] = {}
+_hits: Dict[Tuple[str, str], int] = {}
+
+
+def _compile(rules: Dict[str, List[Rule]]):
+    global _automata
+    _automata = {profile: Automaton(items) for profile, items in rules.items()}
+
+
+_compile(_DEFAULT_RULES)
+
+
+def apply(profile: str, text: str) -> Tuple[str, Optional[str]]:
+    """
+    (текст после truncate/redact, имя сработавшего reject-правила или None).
+    Если вернулось имя правила — текст показывать нельзя, нужно генерировать заново.
+    """
+    automaton = _automata.get(profile)
+    if automaton is None or not text:
+        return text, None
+    matches = automaton.find(text)
+    if not matches:
+        return text, None
+
+    rejected = None
+    cut = len(text)
+    redact: List[Tuple[int, int, Rule]] = []
+    for start, end, rule in matches:
+        with _lock:
+            _hits[(profile, rule.name)] = _hits.get((profile, rule.name), 0) + 1
+        metrics.inc("ai_guardrail_hits_total", {"profile": profile, "rule": rule.name, "action": rule.action})
+        if rule.action == REJECT:
+            rejected = rejected or rule.name
+        elif rule.action == TRUNCATE:
+            cut = min(cut, start)
+        else:
+            redact.append((start, end, rule))
+    if rejected:
+        return text, rejected
+
+    parts = []
+    pos = 0
+    for start, end, rule in sorted(redact, key=lambda m: m[0]):
+        if start < pos or start >= cut:
+            continue  # пересекается с уже убранным или попадает в отрезанное
+        parts.append(text[pos:start])
+        parts.append(rule.replacement)
+        pos = end
+    parts.append(text[pos:cut])
+    result = "".join(parts)
+    if redact:
+        # «Спасибо, [Имя]!» -> «Спасибо!»
+        result = _SPACE_BEFORE_PUNCT.sub(r"\1", _SPACES.sub(" ", result))
+        result = _COMMA_BEFORE_END.sub(r"\1", result)
+    return result.strip(), None
+
+
+def preview(profile: str, text: str) -> Tuple[str, bool]:
+    """
+    Что можно показать из недописанного (стримингового) текста: часть до
+    первой найденной фразы, без последнего недописанного слова — оно ещё
+    может стать фразой («https:/…»). True — сработал reject, показ нужно
+    остановить. Срабатывания не считаются: их посчитает apply на готовом тексте.
+    """
+    automaton = _automata.get(profile)
+    if automaton is None or not text:
+        return text, False
+    cut = len(text)
+    for start, end, rule in automaton.find(text):
+        if rule.action == REJECT:
+            return "", True
+        cut = min(cut, start)
+    shown = text[:cut]
+    if cut == len(text) and not text[-1].isspace():
+        shown = shown[:max(shown.rfind(" "), shown.rfind("\n"), 0)]
+    return shown.rstrip(), False
+
+
+def stats() -> Dict[str, int]:
+    """
+    {"профиль:правило": срабатываний} с момента запуска
+    """
+    with _lock:
+        return {f"{profile}:{name}": n for (profile, name), n in _hits.items()}
+
+
+def load(path: Optional[str] = None):
+    """
+    Свои правила из JSON: {"review": [{"name": ..., "action": ..., "phrases": [...],
+    "replacement": ...}], ...}. Профиль из файла целиком заменяет встроенный.
+    """
+    path = path or RULES_FILE
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        rules = dict(_DEFAULT_RULES)
+        for profile, items in data.items():
+            rules[profile] = [
+                Rule(item["name"], item["action"], item["phrases"], item.get("replacement", ""))
+                for item in items
+            ]
+    except Exception:
+        logging.exception(f"guardrails: не удалось прочитать {path}")
+        return
+    _compile(rules)
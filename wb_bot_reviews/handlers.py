@@ -1,6 +1,8 @@
 # handlers.py
 
+import html
 import logging
+import time
 import uuid
 from aiogram import Router, F, types
 from aiogram.types import Message, CallbackQuery
@@ -8,9 +10,8 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InputMediaPhoto
-from aiogram.filters import Command, Filter
-import re
-from collections import Counter, defaultdict
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.filters import Command, CommandObject, Filter
 import asyncio
 import requests
 from aiogram.filters import StateFilter
@@ -50,18 +51,33 @@ from wb_api import (
     send_reply,  # legacy (через API) — fallback
     send_reply_with_profile,
     get_supplier_id_by_key,
-    get_last_reviews_with_profile,
+    iter_feedback_pages,
     get_unanswered_questions,
     send_question_answer,
-    mark_question_as_viewed
+    mark_question_as_viewed,
+    wb_health,
+    WB_UNAVAILABLE,
+    WB_UNAVAILABLE_STATUS
 )
 
 
-from ai import generate_ai_answer, analyze_reviews_summary, generate_ai_question_answer
+from ai import generate_ai_answer, analyze_article_reviews, generate_ai_question_answer
+import ai_scheduler
+import article_index
+import fastpath
+import keywords
+import prefetch
+from breaker import CircuitOpenError
+from stream_stats import StoreAggregator
+import trends
+from review_frame import ReviewFrame
+import similar
 
 router = Router()
 logging.basicConfig(level=logging.INFO)
 
+WB_UNAVAILABLE_TEXT = "⚠️ Wildberries сейчас недоступен. Попробуйте через пару минут."
+
 
 # -------------------------
 # FSM
@@ -106,10 +122,78 @@ async def start_cmd(msg: Message, state: FSMContext):
 
 @router.callback_query(F.data == "menu")
 async def cb_menu(call: CallbackQuery):
+    prefetch.cancel(call.from_user.id)
     await call.message.edit_text("<b>Главное меню:</b>\n"
                                  "Выберите действие", reply_markup=menu_kb())
 
 
+@router.message(Command("ai_prefetch"))
+async def ai_prefetch_cmd(msg: Message):
+    enabled = not storage.get_ai_prefetch(msg.from_user.id)
+    storage.set_ai_prefetch(msg.from_user.id, enabled)
+    if not enabled:
+        prefetch.cancel(msg.from_user.id)
+    await msg.answer(
+        "✅ AI-черновики для показанных отзывов будут готовиться заранее.\n"
+        f"Лимит — {prefetch.BUDGET_PER_HOUR} черновиков в час."
+        if enabled else
+        "⏸ Заблаговременная генерация AI-черновиков выключена."
+    )
+
+
+@router.message(Command("fastpath"))
+async def fastpath_cmd(msg: Message, command: CommandObject):
+    user_id = msg.from_user.id
+    store = storage.get_current_store(user_id)
+    if not store:
+        return await msg.answer("⚠️ Сначала выберите магазин.", reply_markup=menu_kb())
+
+    if command.args:
+        try:
+            min_stars, max_words = (int(x) for x in command.args.split())
+            if not (1 <= min_stars <= 5 and 0 <= max_words <= 50):
+                raise ValueError
+        except ValueError:
+            return await msg.answer("Формат: /fastpath &lt;мин. оценка 1–5&gt; &lt;макс. слов&gt;, например /fastpath 4 6")
+        storage.set_fastpath_thresholds(user_id, store, min_stars, max_words)
+
+    min_stars, max_words = (storage.get_fastpath_thresholds(user_id, store)
+                            or (fastpath.DEFAULT_MIN_STARS, fastpath.DEFAULT_MAX_WORDS))
+    stats = fastpath.report(user_id, store)
+    await msg.answer(
+        f"<b>Быстрые ответы без AI — {html.escape(store)}</b>\n"
+        f"Шаблон, если оценка ≥ {min_stars}⭐, не больше {max_words} слов и нет жалоб.\n\n"
+        f"Шаблоном: {stats['template']} ({stats['template_pct']:.0f}%)\n"
+        f"В AI: {stats['ai']} ({stats['ai_pct']:.0f}%)\n\n"
+        "Изменить пороги: /fastpath &lt;мин. оценка&gt; &lt;макс. слов&gt;"
+    )
+
+
+@router.message(Command("wb_status"))
+async def wb_status_cmd(msg: Message):
+    health = wb_health()
+    marks = {"closed": "✅", "half_open": "🟡", "open": "❌"}
+    lines = ["<b>Состояние WB:</b>"]
+    if not health:
+        lines.append("ℹ️ Запросов к WB ещё не было.")
+    for host, st in health.items():
+        line = f"{marks.get(st['state'], '?')} {host}"
+        if st["retry_after"]:
+            line += f" (повтор через {st['retry_after']:.0f} с)"
+        lines.append(line)
+
+    ai_queue = ai_scheduler.snapshot()
+    lines.append("")
+    lines.append(f"<b>Очередь AI:</b> в работе {ai_queue['running']}/{ai_queue['limit']}")
+    for name, title in (("interactive", "кнопки"), ("analytics", "аналитика"),
+                        ("background", "автоответы"), ("speculative", "черновики заранее")):
+        line = f"• {title}: ждут {ai_queue['waiting'][name]}"
+        if ai_queue["wait_p95"][name] is not None:
+            line += f", p95 ожидания {ai_queue['wait_p95'][name]:.1f} с"
+        lines.append(line)
+    await msg.answer("\n".join(lines))
+
+
 # -------------------------
 # Авторизация (WebApp) — оставляем как есть, веб окно может не использоваться
 # -------------------------
@@ -281,84 +365,6 @@ async def save_new_token(message: Message, state: FSMContext):
 
 
 # --- Анализ отзывов
-def _get_article_from_review(r):
-    # 1. Прямые ключи (на случай если WB вернёт в разных схемах)
-    for key in ("nmId", "nmid", "nm", "offerId", "productNmId",
-                "product_id", "imtId", "nomenclatureArticle"):
-        if key in r and r.get(key):
-            return str(r[key])
-
-    # 2. productInfo — ТУТ ЛЕЖИТ ОСНОВНОЙ АРТИКУЛ WB
-    pi = r.get("productInfo")
-    if isinstance(pi, dict):
-        if pi.get("wbArticle"):
-            return str(pi.get("wbArticle"))
-
-        # иногда WB отдаёт supplierArticle как строковый артикул
-        if pi.get("supplierArticle"):
-            return str(pi.get("supplierArticle"))
-
-    # 3. productDetails (альтернативная схема WB)
-    pd = r.get("productDetails")
-    if isinstance(pd, dict):
-        for key in ("nmId", "nmid", "id", "imtId"):
-            if key in pd and pd.get(key):
-                return str(pd[key])
-
-    # 4. product (альтернативная схема)
-    p = r.get("product")
-    if isinstance(p, dict):
-        for key in ("nmId", "id", "nmid", "imtId"):
-            if key in p and p.get(key):
-                return str(p[key])
-
-    # 5. nomenclature
-    nom = r.get("nomenclature")
-    if isinstance(nom, dict) and nom.get("nmId"):
-        return str(nom["nmId"])
-
-    # 6. item
-    item = r.get("item")
-    if isinstance(item, dict):
-        for key in ("nmId", "nmid"):
-            if item.get(key):
-                return str(item[key])
-
-    # 7. details
-    det = r.get("details")
-    if isinstance(det, dict):
-        for key in ("nmId", "nmid"):
-            if det.get(key):
-                return str(det[key])
-
-    return "unknown"
-
-
-# фильтр слов — убираем стоп-слова, цифры, короткие и пунктуацию
-_RU_STOPWORDS = {
-    "и","в","во","не","что","он","на","я","с","со","как","а","то","все","это","бы","но",
-    "за","так","от","себя","к","у","же","ну","вот","или","е","же","же","по","для","его",
-    "ее","ее","очень","такой","также","того","там","при","из","по","поэтому","свой","нам",
-    "вам","были","была","были","есть","быть","чтобы","уже","ещё","ещё","через","наш","может",
-    "что-то","что","очень"
-}
-_word_re = re.compile(r"[^\wа-яё]+", flags=re.IGNORECASE)
-
-
-def _extract_keywords(texts, top_n=5):
-    if not texts:
-        return []
-    joined = " ".join(texts).lower()
-    # убрать пунктуацию, заменить на пробелы
-    cleaned = _word_re.sub(" ", joined)
-    tokens = [t.strip() for t in cleaned.split() if t.strip()]
-    filtered = [
-        t for t in tokens
-        if t not in _RU_STOPWORDS and len(t) > 2 and not t.isdigit()
-    ]
-    cnt = Counter(filtered)
-    return cnt.most_common(top_n)
-
 
 def split_message(text, limit=4000):
     parts = []
@@ -372,120 +378,195 @@ def split_message(text, limit=4000):
     return parts
 
 
-async def analyze_reviews_logic(reviews, target_article=None):
+# сколько артикулов анализируем одновременно — столько AI-запросов аналитики
+# одного пользователя ai_scheduler и пускает разом, больше держать смысла нет
+ARTICLE_CONCURRENCY = ai_scheduler.PER_USER_CONCURRENT[ai_scheduler.ANALYTICS]
+# анализ одного артикула смотрит столько последних отзывов магазина, а не всю историю
+ARTICLE_SCAN_REVIEWS = 5000
+# недель в строке «Средняя по неделям»
+TREND_WEEKS = 8
+
+
+async def _analyze_article(article, items, stats, user_id=None, complaints=None, weeks=None, drop=None,
+                           profile=None):
     """
-    Анализ отзывов с использованием AI для качественной выжимки
+    Секция отчёта по одному артикулу: статистика (ReviewFrame.article_stats),
+    динамика по неделям (ReviewFrame.period_stats или trends.weekly; trends.drop), частые жалобы
+    (keywords.top_complaints) + AI-выжимка
+    """
+    out_lines = []
+    last = items
+    cnt = stats["count"]
+    avg = round(stats["avg"], 1)
+    spread = f" (±{stats['std']:.1f})" if stats.get("std") else ""
+    positive = stats["positive"]
+    negative = stats["negative"]
+    distribution = " · ".join(f"{s}⭐ {stats['distribution'][s]}" for s in range(5, 0, -1))
+
+    # 🔥 Собираем отзывы с текстом для AI анализа
+    reviews_for_ai = []
+
+    for r in last:
+        # Если есть хоть один текст - добавляем в анализ
+        if r.has_text:
+            reviews_for_ai.append({
+                "id": r.id,
+                "text": r.full_text(),
+                "rating": r.valuation
+            })
+
+    # Формируем базовую статистику
+    out_lines.append(
+        f"📦 Артикул: {article}\n"
+        f"📝 Кол-во отзывов: {cnt}\n"
+        f"⭐️ Средняя оценка: {avg}{spread}\n"
+        f"😊 Позитивных: {positive}\n"
+        f"😡 Негативных: {negative}\n"
+        f"📊 {distribution}\n"
+    )
+    rated_weeks = [w for w in weeks or () if w["count"]]
+    if len(rated_weeks) >= 2:
+        out_lines.append("📈 Средняя по неделям: " + " → ".join(f"{w['avg']:.1f}" for w in rated_weeks) + "\n")
+    if drop:
+        out_lines.append(f"⚠️ Резкое ухудшение за последнюю неделю: {drop}\n")
+    if complaints:
+        out_lines.append("🔑 Частые жалобы: " + ", ".join(t for t, _ in complaints) + "\n")
+
+    # 🔥 AI АНАЛИЗ если есть отзывы с текстом
+    if reviews_for_ai:
+        try:
+            # Map-reduce по всем отзывам; для уже анализированного артикула — кэш / только новые отзывы
+            ai_analysis, used = await analyze_article_reviews(
+                article,
+                [(d["id"], d["rating"], d["text"]) for d in reviews_for_ai],
+                user_id=user_id,
+                scope=profile
+            )
+            out_lines.append(
+                f"\n🔍 Проанализировано отзывов с текстом: {used} из {len(reviews_for_ai)}\n"
+            )
+            out_lines.append("🤖 AI-анализ отзывов:\n")
+            out_lines.append(ai_analysis + "\n")
+
+        except Exception as e:
+            print(f"Ошибка AI анализа для артикула {article}: {e}")
+            out_lines.append("🤖 AI-анализ: Не удалось выполнить анализ\n")
+    else:
+        out_lines.append("\n📊 Анализ текста: В отзывах нет текстового содержимого для анализа\n")
+
+    out_lines.append("\n" + "\n")
+    return "\n".join(out_lines)
+
+
+async def analyze_reviews_logic(reviews, target_article=None, user_id=None, on_section=None, store=None,
+                                profile=None):
+    """
+    Анализ отзывов с использованием AI для качественной выжимки.
+    Артикулы анализируются параллельно (не больше ARTICLE_CONCURRENCY сразу);
+    on_section(текст) — получать готовые секции по мере готовности, в порядке артикулов.
     """
     if not reviews:
         return "❌ Нет отзывов для анализа."
 
-    # подготовим список отзывов с определёнными артикулами
-    by_article = defaultdict(list)
-    for r in reviews:
-        art = _get_article_from_review(r)
-        by_article[art].append(r)
+    # колонки собираем один раз: статистика по артикулам — векторно
+    frame = ReviewFrame.from_feedbacks(reviews)
+    stats = frame.article_stats()
+    by_article = {a: frame.rows(idx) for a, idx in frame.groups().items()}
+    if store:
+        # словарь терминов магазина копится между анализами — считаем только новые отзывы;
+        # лемматизация — в отдельном потоке, чтобы не держать event loop
+        await asyncio.to_thread(keywords.update, user_id, store, reviews)
 
-    # если хотим анализ по одному артикулу — фильтруем
+    # если хотим анализ по одному артикулу — берём его группу (артикул канонический, см. article_index)
     if target_article:
         target_article = str(target_article)
-        matched = {a: lst for a, lst in by_article.items() if a == target_article}
-        if not matched:
-            try:
-                matched = {a: lst for a, lst in by_article.items()
-                           if str(int(a)) == str(int(target_article))}
-            except:
-                pass
-        if not matched:
+        if target_article not in by_article:
             return f"❌ Для артикула {target_article} нет отзывов."
-        by_article = matched
+        by_article = {target_article: by_article[target_article]}
 
-    # формируем отчёт по каждому артикулу
-    out_lines = []
-    for article, items in by_article.items():
-        last = items[:100]  # Ограничиваем для AI анализа
-        cnt = len(last)
-
-        # Статистика оценок
-        scores = []
-        for r in last:
-            val = r.get("productValuation") or r.get("valuation") or 0
-            try:
-                scores.append(float(str(val).replace(",", ".")))
-            except:
-                scores.append(0.0)
-
-        avg = round(sum(scores) / cnt, 1) if cnt else 0.0
-        positive = sum(1 for v in scores if v >= 4)
-        negative = sum(1 for v in scores if v <= 3)
-
-        # 🔥 Собираем отзывы с текстом для AI анализа
-        reviews_for_ai = []
-
-        for r in last:
-            # Получаем feedbackInfo
-            feedback_info = r.get("feedbackInfo", {})
-
-            # Основные текстовые поля
-            main_text = feedback_info.get("feedbackText", "")
-            pros_text = feedback_info.get("feedbackTextPros", "")
-            cons_text = feedback_info.get("feedbackTextCons", "")
-
-            # Объединяем все текстовые поля
-            all_text_parts = []
-            for text in [main_text, pros_text, cons_text]:
-                if text and str(text).strip() and str(text).strip().lower() not in ["нет", "не указано", "null", "none",
-                                                                                    ""]:
-                    all_text_parts.append(str(text).strip())
-
-            # Если есть хоть один текст - добавляем в анализ
-            if all_text_parts:
-                full_text = " | ".join(all_text_parts)
-                rating = r.get("productValuation") or r.get("valuation") or 0
-                try:
-                    rating = int(rating)
-                except:
-                    rating = 5
-
-                reviews_for_ai.append({
-                    "text": full_text,
-                    "rating": rating
-                })
-
-        # Формируем базовую статистику
-        out_lines.append(
-            f"📦 Артикул: {article}\n"
-            f"📝 Кол-во отзывов: {cnt}\n"
-            f"⭐️ Средняя оценка: {avg}\n"
-            f"😊 Позитивных: {positive}\n"
-            f"😡 Негативных: {negative}\n"
-        )
+    async def make_section(article):
+        complaints = keywords.top_complaints(user_id, store, article) if store else None
+        # отзывы артикула здесь все под рукой — недели считаем по ним же, векторно
+        weeks = frame.period_stats(7, article, last=TREND_WEEKS)
+        drop = _article_trend(profile, article)[1]
+        return await _analyze_article(article, by_article[article], stats[article], user_id,
+                                      complaints, weeks, drop, profile=profile)
 
-        # 🔥 AI АНАЛИЗ если есть отзывы с текстом
-        if reviews_for_ai:
-            out_lines.append(f"\n🔍 Проанализировано отзывов с текстом: {len(reviews_for_ai)}\n")
+    return await _run_sections(list(by_article), make_section, on_section)
 
-            try:
-                # Создаем промпт для AI анализа
-                ai_prompt = f"ОТЗЫВЫ НА ТОВАР {article}:\n\n"
 
-                # Добавляем отзывы в промпт
-                for i, review_data in enumerate(reviews_for_ai[:15]):  # Ограничиваем количество
-                    ai_prompt += f'⭐ {review_data["rating"]}/5: {review_data["text"]}\n\n'
+def _article_trend(profile, article):
+    # недельные сводки копятся при чтении отзывов магазина (_stream_store_pages, trends.py)
+    if not profile:
+        return None, None
+    return trends.weekly(profile, article, weeks=TREND_WEEKS), trends.drop(profile, article)
 
-                # 🔥 ИСПОЛЬЗУЕМ НОВУЮ ФУНКЦИЮ ДЛЯ АНАЛИЗА
-                ai_analysis = await analyze_reviews_summary(ai_prompt)
-                out_lines.append("🤖 AI-анализ отзывов:\n")
-                out_lines.append(ai_analysis + "\n")
 
-            except Exception as e:
-                print(f"Ошибка AI анализа для артикула {article}: {e}")
-                out_lines.append("🤖 AI-анализ: Не удалось выполнить анализ\n")
-        else:
-            out_lines.append("\n📊 Анализ текста: В отзывах нет текстового содержимого для анализа\n")
+async def _run_sections(articles, make_section, on_section=None):
+    """
+    Секции по артикулам параллельно (не больше ARTICLE_CONCURRENCY сразу);
+    on_section получает готовые секции по порядку articles
+    """
+    sections = [None] * len(articles)
+    sem = asyncio.Semaphore(ARTICLE_CONCURRENCY)
+    flush_lock = asyncio.Lock()
+    flushed = 0
+
+    async def run(i, article):
+        nonlocal flushed
+        async with sem:
+            sections[i] = await make_section(article)
+        if not on_section:
+            return
+        # отдаём готовые секции, сохраняя порядок артикулов
+        async with flush_lock:
+            while flushed < len(sections) and sections[flushed] is not None:
+                await on_section(sections[flushed])
+                flushed += 1
 
-        out_lines.append("\n" + "\n")
+    await asyncio.gather(*(run(i, a) for i, a in enumerate(articles)))
+    return "\n".join(sections)
 
-    return "\n".join(out_lines)
+
+async def analyze_store_stream(agg, user_id=None, on_section=None, profile=None):
+    """
+    Отчёт по агрегатам однопроходного чтения всех отзывов магазина
+    (stream_stats.StoreAggregator): статистика — по всем отзывам,
+    AI-выжимка — по последним отзывам с текстом каждого артикула.
+    """
+    if not agg.reviews:
+        return "❌ Нет отзывов для анализа."
+
+    async def make_section(article):
+        return await _analyze_article(article, agg.sample(article), agg.stats(article), user_id,
+                                      agg.complaints(article), *_article_trend(profile, article),
+                                      profile=profile)
+
+    return await _run_sections(list(agg.articles), make_section, on_section)
+
+
+async def _stream_store_pages(profile_name, on_page, max_reviews=None):
+    """
+    Отзывы магазина страницами. Весь проход — запросы, индекс по артикулам
+    (article_index), недельные сводки (trends) и on_page(страница) — идёт в
+    отдельном потоке, event loop свободен; on_page вызывается из него.
+    Возвращает (WB доступен, прочитано до конца)
+    """
+    def fold():
+        pages = iter_feedback_pages(profile_name, max_reviews=max_reviews)
+        while True:
+            try:
+                page = next(pages)
+            except StopIteration as stop:
+                return True, stop.value is not False
+            article_index.add(profile_name, page)
+            trends.add(profile_name, page)
+            on_page(page)
+
+    try:
+        return await asyncio.to_thread(fold)
+    except CircuitOpenError:
+        return False, False
 
 
 # Главное меню анализа
@@ -501,7 +582,7 @@ async def analyze_menu(call: CallbackQuery):
 @router.callback_query(F.data == "full_analyze")
 async def full_analyze_start(call: CallbackQuery, state: FSMContext):
     await call.message.answer("🔍 Собираю последние отзывы... \n"
-                              "Анализ может занять до 2х минут ")
+                              "Результаты по артикулам будут приходить по мере готовности")
 
     user_id = call.from_user.id
     data = await state.get_data()
@@ -523,19 +604,32 @@ async def full_analyze_start(call: CallbackQuery, state: FSMContext):
     if not profile_name:
         return await call.message.answer("❌ Профиль не найден. Перезагрузите магазин.")
 
-    status, resp = get_last_reviews_with_profile(profile_name, max_reviews=1000)
+    # все отзывы магазина одним проходом: страница учитывается в агрегатах и забывается
+    agg = StoreAggregator()
+    available, complete = await _stream_store_pages(profile_name, agg.add_page)
+    if not available or (not complete and not agg.reviews):
+        return await call.message.answer(WB_UNAVAILABLE_TEXT, reply_markup=menu_kb())
 
-    if status != 200 or resp.get("error"):
-        return await call.message.answer("❌ Не удалось получить отзывы.")
-
-    reviews = resp.get("data", {}).get("feedbacks", [])
-    if not reviews:
+    if not agg.reviews:
         return await call.message.answer("❌ Нет отзывов для анализа.")
-
-    result = await analyze_reviews_logic(reviews)
-
-    for part in split_message(result):
-        await call.message.answer(part, reply_markup=menu_kb())
+    if not complete:
+        await call.message.answer(f"⚠️ WB перестал отвечать на середине загрузки: анализ по последним "
+                                  f"{agg.reviews} отзывам, а не по всей истории магазина.")
+
+    async def send_section(section):
+        for part in split_message(section):
+            await call.message.answer(part)
+
+    result = await analyze_store_stream(agg, user_id=user_id, on_section=send_section, profile=profile_name)
+    if result.startswith("❌"):
+        return await call.message.answer(result, reply_markup=menu_kb())
+    drops = trends.drops(profile_name)
+    if drops:
+        await call.message.answer(
+            "⚠️ <b>Резкое ухудшение за последнюю неделю:</b>\n"
+            + "\n".join(f"• {html.escape(a)}: {reason}" for a, reason in sorted(drops.items()))
+        )
+    await call.message.answer("✅ Анализ завершён.", reply_markup=menu_kb())
 
 
 # Анализ по артикулу
@@ -564,21 +658,33 @@ async def analyze_by_article_result(message: types.Message, state: FSMContext):
     if not profile_name:
         return await message.answer("❌ Профиль не найден.")
 
-    status, resp = get_last_reviews_with_profile(profile_name, max_reviews=1000)
-    if status != 200 or resp.get("error"):
-        return await message.answer("❌ Не удалось получить отзывы.")
+    # последние ARTICLE_SCAN_REVIEWS отзывов магазина одним проходом: база для TF-IDF —
+    # магазин, а не только этот артикул; всю историю ради одного артикула не качаем
+    filtered = []
 
-    all_reviews = resp.get("data", {}).get("feedbacks", [])
-    if not all_reviews:
-        return await message.answer("❌ Нет отзывов для анализа.")
+    def on_page(page):
+        keywords.update(user_id, store, page)
+        # страница уже разложена по артикулам (article_index): nmId или артикул продавца
+        canonical = article_index.canonical(profile_name, article)
+        if canonical:
+            filtered.extend(r for r in page if r.nm_id == canonical)
 
-    filtered = [r for r in all_reviews if str(_get_article_from_review(r)) == str(article)]
-    if not filtered:
-        return await message.answer(f"❌ Для артикула {article} нет отзывов.")
-
-    filtered = filtered[:500]
+    available, complete = await _stream_store_pages(profile_name, on_page, max_reviews=ARTICLE_SCAN_REVIEWS)
+    if not available:
+        return await message.answer(WB_UNAVAILABLE_TEXT, reply_markup=menu_kb())
 
-    result = await analyze_reviews_logic(filtered, target_article=article)
+    if not filtered:
+        if not complete:
+            return await message.answer(WB_UNAVAILABLE_TEXT, reply_markup=menu_kb())
+        return await message.answer(f"❌ Для артикула {html.escape(article)} нет отзывов "
+                                    f"среди последних {ARTICLE_SCAN_REVIEWS} отзывов магазина.")
+    article = filtered[0].nm_id
+    if not complete:
+        await message.answer(f"⚠️ WB перестал отвечать на середине загрузки: в анализе "
+                             f"{len(filtered)} отзывов артикула, возможно, не все.")
+
+    result = await analyze_reviews_logic(filtered, target_article=article, user_id=user_id, store=store,
+                                         profile=profile_name)
 
     for part in split_message(result):
         await message.answer(part, reply_markup=menu_kb())
@@ -661,6 +767,7 @@ async def select_autotpl(call: CallbackQuery):
 
 @router.callback_query(F.data == "switch_store")
 async def switch_store(call: CallbackQuery):
+    prefetch.cancel(call.from_user.id)
     stores = storage.get_store_tokens(call.from_user.id)
     if not stores:
         return await call.message.answer("⚠️ У вас нет магазинов. Добавьте через меню.", reply_markup=menu_kb())
@@ -711,11 +818,14 @@ async def store_selected(call: CallbackQuery, state: FSMContext):
 # Получить отзывы — основной обработчик (вытягиваем через API-key)
 @router.callback_query(F.data == "get_reviews")
 async def get_reviews_menu(call: CallbackQuery):
+    prefetch.cancel(call.from_user.id)
     token = storage.get_current_token(call.from_user.id)
     if not token:
         return await call.message.answer("⚠️ Сначала добавьте магазин.", reply_markup=menu_kb())
 
     status, data = get_reviews(token)
+    if status == WB_UNAVAILABLE_STATUS:
+        return await call.message.answer(WB_UNAVAILABLE_TEXT, reply_markup=menu_kb())
     if status != 200:
         return await call.message.answer(f"Ошибка WB:\n{data}", reply_markup=menu_kb())
 
@@ -726,9 +836,8 @@ async def get_reviews_menu(call: CallbackQuery):
     # считаем по звёздам
     counts = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
     for r in fb:
-        s = r.get("productValuation") or 0
-        if s in counts:
-            counts[s] += 1
+        if r.valuation in counts:
+            counts[r.valuation] += 1
 
     # сохраняем все отзывы в кэш (под user_id, store, stars)
     store = storage.get_current_store(call.from_user.id)
@@ -748,6 +857,8 @@ async def show_star_reviews(call: CallbackQuery):
     store = storage.get_current_store(call.from_user.id)
 
     status, reviews = get_reviews_by_stars(token, stars)
+    if status == WB_UNAVAILABLE_STATUS:
+        return await call.message.answer(WB_UNAVAILABLE_TEXT, reply_markup=menu_kb())
     if status != 200:
         return await call.message.answer(f"Ошибка:\n{reviews}")
 
@@ -757,44 +868,25 @@ async def show_star_reviews(call: CallbackQuery):
     # сохраняем страницу 0 (первые 10)
     storage.set_user_page(call.from_user.id, store, stars, 0, reviews)
 
-    await send_reviews_page(call.message, reviews, 0, store, stars)
+    await send_reviews_page(call.message, reviews, 0, store, stars, call.from_user.id)
 
 
-async def send_reviews_page(message: Message, reviews, page, store, stars):
+async def send_reviews_page(message: Message, reviews, page, store, stars, user_id=None):
     start = page * 10
     end = start + 10
     chunk = reviews[start:end]
+    user_id = user_id or message.chat.id
 
     for r in chunk:
-        # ⭐ Оценка
-        stars = r.get("productValuation", "?")
-
-        # 👤 Имя покупателя
-        name = (
-            r.get("userName")
-            or r.get("wbUserDetails", {}).get("name")
-            or "Покупатель"
-        )
-
-        # 🔢 Артикул товара
-        article = (
-            r.get("nmId")
-            or r.get("productId")
-            or r.get("source", {}).get("nmId")
-            or r.get("productDetails", {}).get("nmId")
-            or "—"
-        )
-
-        # Текстовые поля
-        pros = r.get("pros") or ""
-        cons = r.get("cons") or ""
-        comment = r.get("text") or ""
+        pros = r.pros
+        cons = r.cons
+        comment = r.text
 
         # Формирование текста сообщения
         text_parts = [
-            f"🔢 <b>Артикул:</b> {article}",
-            f"⭐️ <b>{stars}</b>",
-            f"👤 <b>{name}</b>",
+            f"🔢 <b>Артикул:</b> {r.nm_id or '—'}",
+            f"⭐️ <b>{r.valuation or '?'}</b>",
+            f"👤 <b>{r.user_name or 'Покупатель'}</b>",
         ]
 
         if pros:
@@ -809,7 +901,7 @@ async def send_reviews_page(message: Message, reviews, page, store, stars):
 
         text = "\n".join(text_parts)
 
-        await message.answer(text, reply_markup=review_answer_kb(str(r.get('id'))))
+        await message.answer(text, reply_markup=review_answer_kb(r.id))
 
     if end < len(reviews):
         await message.answer(
@@ -817,6 +909,9 @@ async def send_reviews_page(message: Message, reviews, page, store, stars):
             reply_markup=next_page_kb(store, stars, page + 1)
         )
 
+    # режим /ai_prefetch: пока пользователь читает страницу, готовим черновики
+    prefetch.start(user_id, chunk)
+
 
 @router.callback_query(F.data.startswith("next_"))
 async def next_page(call: CallbackQuery):
@@ -834,7 +929,26 @@ async def next_page(call: CallbackQuery):
     reviews = page_data["reviews"]
     storage.set_user_page(call.from_user.id, store, stars, page, reviews)
 
-    await send_reviews_page(call.message, reviews, page, store, stars)
+    await send_reviews_page(call.message, reviews, page, store, stars, call.from_user.id)
+
+
+def _find_page_review(user_id, store, review_id):
+    """
+    Отзыв из RAM-кэша показанных страниц (None — не нашли)
+    """
+    pages = storage._user_pages.get(user_id, {}).get(store, {})
+    for stars, page in pages.items():
+        for r in page["reviews"]:
+            if r.id == review_id:
+                return r
+    return None
+
+
+def _remember_answer(user_id, store, review_id, answer):
+    # отправленный ответ пригодится для почти таких же отзывов (similar.py)
+    r = _find_page_review(user_id, store, review_id)
+    if r is not None:
+        similar.remember(user_id, store, r.full_text(), r.valuation or 5, answer)
 
 
 # Ручной ответ (начало)
@@ -880,7 +994,10 @@ async def manual_send(msg: Message, state: FSMContext):
 
     await state.clear()
 
-    if status in (200, 201):
+    if status == WB_UNAVAILABLE_STATUS:
+        await msg.answer(WB_UNAVAILABLE_TEXT, reply_markup=menu_kb())
+    elif status in (200, 201):
+        _remember_answer(user_id, store, review_id, msg.text.strip())
         await msg.answer("✅ Ответ отправлен!", reply_markup=menu_kb())
     else:
         await msg.answer(f"Ошибка при отправке: {res}", reply_markup=menu_kb())
@@ -915,9 +1032,14 @@ async def ai_send(call: CallbackQuery):
         token = storage.get_current_token(user_id)
         status, res = send_reply(token, draft["review_id"], text)
 
+    if status == WB_UNAVAILABLE_STATUS:
+        # черновик не удаляем — можно будет отправить, когда WB оживёт
+        return await call.message.answer(WB_UNAVAILABLE_TEXT, reply_markup=ai_result_kb(draft["review_id"], draft_id))
+
     storage.delete_ai_draft(draft_id)
 
     if status in (200, 201):
+        _remember_answer(user_id, store, draft["review_id"], text)
         await call.message.answer("✅ Ответ отправлен!", reply_markup=menu_kb())
     else:
         await call.message.answer(f"Ошибка при отправке: {res}", reply_markup=menu_kb())
@@ -1104,7 +1226,9 @@ async def send_template(call: CallbackQuery):
             token = storage.get_current_token(user_id)
             status, res = send_reply(token, review_id, text)
 
-        if status in (200, 201):
+        if status == WB_UNAVAILABLE_STATUS:
+            await call.message.answer(WB_UNAVAILABLE_TEXT, reply_markup=menu_kb())
+        elif status in (200, 201):
             await call.message.answer("✅ Ответ отправлен!", reply_markup=menu_kb())
         else:
             await call.message.answer(f"Ошибка при отправке: {res}", reply_markup=menu_kb())
@@ -1150,6 +1274,53 @@ async def ai_edit_text(msg: Message, state: FSMContext):
 
 # AI: GENERATE
 
+# Telegram режет частые правки одного сообщения — не чаще раза в секунду
+STREAM_EDIT_INTERVAL = 1.0
+
+
+class StreamingReply:
+    """
+    Сообщение-заглушка, которое дописывается по мере генерации AI-ответа
+    """
+
+    def __init__(self, message: Message, header: str):
+        self._message = message
+        self._header = header
+        self._sent = None
+        self._shown = ""
+        self._next_edit = 0.0
+
+    async def start(self):
+        self._sent = await self._message.answer(f"{self._header}⏳ Генерирую…")
+
+    async def update(self, text: str):
+        now = time.monotonic()
+        if self._sent is None or now < self._next_edit or text == self._shown:
+            return
+        self._next_edit = now + STREAM_EDIT_INTERVAL
+        try:
+            await self._sent.edit_text(f"{self._header}<b>{html.escape(text)}</b> ▌")
+            self._shown = text
+        except TelegramRetryAfter as e:
+            self._next_edit = now + e.retry_after
+        except TelegramBadRequest:
+            pass
+
+    async def finish(self, text: str, reply_markup=None):
+        final = f"{self._header}<b>{html.escape(text)}</b>"
+        if self._sent is not None:
+            for _ in range(2):
+                try:
+                    await self._sent.edit_text(final, reply_markup=reply_markup)
+                    return
+                except TelegramRetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                except TelegramBadRequest:
+                    break
+        # заглушку не удалось отредактировать — шлём ответ новым сообщением
+        await self._message.answer(final, reply_markup=reply_markup)
+
+
 @router.callback_query(F.data.startswith("ai_GEN_"))
 async def ai_generate(call: CallbackQuery):
     review_id = call.data.replace("ai_GEN_", "")
@@ -1157,32 +1328,50 @@ async def ai_generate(call: CallbackQuery):
     store = storage.get_current_store(user_id)
 
     # --- ищем отзыв только в RAM-кэше ---
-    found = None
-    pages = storage._user_pages.get(user_id, {}).get(store, {})
-
-    for stars, page in pages.items():
-        for r in page["reviews"]:
-            if str(r["id"]) == review_id:
-                found = r
-                break
-        if found:
-            break
+    found = _find_page_review(user_id, store, review_id)
 
     if not found:
         return await call.message.answer("⚠️ Отзыв не найден.")
 
-    text = found.get("text") or ""
-    stars = found.get("productValuation") or 5
+    # дежурная похвала — шаблон из ротации, без AI (/fastpath)
+    quick = fastpath.route(user_id, store, found, storage.get_fastpath_thresholds(user_id, store))
+    if quick:
+        draft_id = str(uuid.uuid4())
+        storage.save_ai_draft(draft_id, user_id, review_id, quick)
+        return await call.message.answer(
+            f"🤖 Предложенный ответ (шаблон):\n\n<b>{html.escape(quick)}</b>",
+            reply_markup=ai_result_kb(review_id, draft_id)
+        )
+
+    # черновик уже сгенерирован заранее (/ai_prefetch)
+    draft_id = await prefetch.take(user_id, review_id)
+    if draft_id:
+        ai_text = storage.get_ai_draft(draft_id)["text"]
+        return await call.message.answer(
+            f"🤖 Предложенный ответ:\n\n<b>{html.escape(ai_text)}</b>",
+            reply_markup=ai_result_kb(review_id, draft_id)
+        )
+
+    # на почти такой же отзыв уже отвечали — берём тот ответ, без AI
+    reused = similar.find(user_id, store, found.full_text(), found.valuation or 5)
+    if reused:
+        ai_text = similar.vary(reused, review_id)
+        draft_id = str(uuid.uuid4())
+        storage.save_ai_draft(draft_id, user_id, review_id, ai_text)
+        return await call.message.answer(
+            f"🤖 Предложенный ответ (как на похожий отзыв):\n\n<b>{html.escape(ai_text)}</b>",
+            reply_markup=ai_result_kb(review_id, draft_id)
+        )
 
-    ai_text = await generate_ai_answer(text, stars)
+    reply = StreamingReply(call.message, "🤖 Предложенный ответ:\n\n")
+    await reply.start()
+    ai_text = await generate_ai_answer(found.text, found.valuation or 5, user_id=user_id,
+                                       on_progress=reply.update)
 
     draft_id = str(uuid.uuid4())
     storage.save_ai_draft(draft_id, user_id, review_id, ai_text)
 
-    await call.message.answer(
-        f"🤖 Предложенный ответ:\n\n<b>{ai_text}</b>",
-        reply_markup=ai_result_kb(review_id, draft_id)
-    )
+    await reply.finish(ai_text, reply_markup=ai_result_kb(review_id, draft_id))
 
 
 # Удаление магазина (через меню)
@@ -1230,6 +1419,8 @@ async def get_questions_menu(call: CallbackQuery):
 
     status, data = get_unanswered_questions(profile_name)
 
+    if not status and data == WB_UNAVAILABLE:
+        return await call.message.answer(WB_UNAVAILABLE_TEXT, reply_markup=menu_kb())
     if not status:
         return await call.message.answer(f"❌ Ошибка получения вопросов:\n{data}", reply_markup=menu_kb())
 
@@ -1369,7 +1560,9 @@ async def manual_question_send(msg: Message, state: FSMContext):
         )
         return
 
-    if status in (200, 201):
+    if status == WB_UNAVAILABLE_STATUS:
+        await msg.answer(WB_UNAVAILABLE_TEXT, reply_markup=menu_kb())
+    elif status in (200, 201):
         await msg.answer("✅ Ответ на вопрос отправлен!", reply_markup=menu_kb())
     else:
         await msg.answer(f"❌ Ошибка при отправке: {res}", reply_markup=menu_kb())
@@ -1402,15 +1595,14 @@ async def ai_generate_question(call: CallbackQuery):
     question_text = found.get("text")
 
     # Генерируем ответ через AI
-    ai_text = await generate_ai_question_answer(question_text)  # используем 5 звёзд для вопросов
+    reply = StreamingReply(call.message, "🤖 Предложенный ответ на вопрос:\n\n")
+    await reply.start()
+    ai_text = await generate_ai_question_answer(question_text, user_id=user_id, on_progress=reply.update)
 
     draft_id = str(uuid.uuid4())
     storage.save_ai_question_draft(draft_id, user_id, question_id, ai_text)
 
-    await call.message.answer(
-        f"🤖 Предложенный ответ на вопрос:\n\n<b>{ai_text}</b>",
-        reply_markup=ai_result_kb_question(question_id, draft_id)
-    )
+    await reply.finish(ai_text, reply_markup=ai_result_kb_question(question_id, draft_id))
 
 
 @router.callback_query(F.data.startswith("ai_q_send_"))
@@ -1431,6 +1623,12 @@ async def ai_send_question(call: CallbackQuery):
 
     status, res = send_question_answer(profile_name, draft["question_id"], text)
 
+    if status == WB_UNAVAILABLE_STATUS:
+        return await call.message.answer(
+            WB_UNAVAILABLE_TEXT,
+            reply_markup=ai_result_kb_question(draft["question_id"], draft_id)
+        )
+
     storage.delete_ai_question_draft(draft_id)
 
     if status == -1:
@@ -1563,90 +1761,10 @@ async def send_template_question(call: CallbackQuery):
         )
         return
 
-    if status in (200, 201):
+    if status == WB_UNAVAILABLE_STATUS:
+        await call.message.answer(WB_UNAVAILABLE_TEXT, reply_markup=menu_kb())
+    elif status in (200, 201):
         await call.message.answer("✅ Ответ на вопрос отправлен!", reply_markup=menu_kb())
     else:
         await call.message.answer(f"❌ Ошибка при отправке: {res}", reply_markup=menu_kb())
 
-
-async def _auto_worker_loop(stop_event: asyncio.Event):
-    """
-    Фоновая петля: каждые 60 минут проверяет для всех пользователей их настройки
-    и отвечает на новые отзывы по заданным правилам.
-    """
-    INTERVAL = 20 * 60  # сек (60 минут)
-    while not stop_event.is_set():
-        # перебираем всех пользователей, у которых есть автонстройки
-        users = list(storage.get_auto_settings_for_user.__self__._auto_settings.keys()) if False else None
-        # простая реализация: проходим по всем юзерам, которые есть в БД
-        try:
-            db = storage._load_file()
-            user_ids = [k for k in db.keys() if k.isdigit()]
-        except Exception:
-            user_ids = []
-
-        for uid in user_ids:
-            try:
-                uid_i = int(uid)
-            except:
-                continue
-            auto = storage.get_auto_settings_for_user(uid_i)
-            if not auto:
-                continue
-            # для каждого магазина в настройках
-            for store_name, stars_map in auto.items():
-                token = storage.get_store_tokens(uid_i).get(store_name)
-                if not token:
-                    continue
-                for stars, cfg in stars_map.items():
-                    if not cfg.get("enabled"):
-                        continue
-                    # получить отзывы по звезде
-                    status, reviews = get_reviews_by_stars(token, int(stars))
-                    if status != 200 or not reviews:
-                        continue
-                    for r in reviews:
-                        rid = str(r.get("id"))
-                        # пропускаем, если уже обработан
-                        if storage.is_review_processed(uid_i, store_name, rid):
-                            continue
-                        # формируем ответ
-                        if cfg.get("method") == "template":
-                            tpl = storage.get_template(uid_i, cfg.get("template_id") or "")
-                            if not tpl:
-                                # не найден шаблон — пропустить
-                                continue
-                            answer_text = tpl["text"]
-                        else:
-                            # AI
-                            text = r.get("text") or ""
-                            stars_val = r.get("productValuation") or 5
-                            answer_text = await generate_ai_answer(text, stars_val)
-
-                        # отправляем через профиль если есть
-                        profile = storage.get_store_profile_for_user(uid_i, store_name)
-                        if profile:
-                            status_send, res = send_reply_with_profile(profile, rid, answer_text)
-                            if status == -1:  # токен истёк
-                                await stop_event.message.answer(
-                                    "❗ Ваш токен авторизации истёк.\n"
-                                    "Нажмите кнопку ниже, чтобы обновить его.",
-                                    reply_markup=new_token_kb()
-                                )
-                                return
-
-                        else:
-                            # fallback to token send via legacy API (оставляем send_reply)
-                            status_send, res = send_reply(token, rid, answer_text)
-
-                        if status_send in (200, 201):
-                            # пометить как отправленное
-                            storage.mark_review_processed(uid_i, store_name, rid)
-                            # убрать из RAM-кэша, если он там есть
-                            pages = storage.get_all_pages_for(uid_i, store_name)
-                            for s_key, page in (pages or {}).items():
-                                page_reviews = page.get("reviews", [])
-                                page["reviews"] = [x for x in page_reviews if str(x.get("id")) != rid]
-                        # иначе — оставляем на следующую итерацию
-        # ждем интервал или стоп
-        await asyncio.wait([asyncio.create_task(asyncio.sleep(INTERVAL)) , stop_event.wait()], return_when=asyncio.FIRST_COMPLETED)
@@ -0,0 +1,307 @@
+# keywords.py
+"""
+Ключевые слова и фразы отзывов без AI.
+
+Текст -> леммы (pymorphy3, если установлен; иначе — отсечение окончаний)
+без стоп-слов; «не» приклеивается к следующему слову («не_подойти»).
+Термины — леммы и 2–3-граммы из них (наружу — как написано в отзыве);
+фраза не переходит через конец предложения и из поля в поле отзыва.
+На магазин держим словарь терминов (термин -> id) и частоты по
+документам (отзывам): на весь магазин, на артикул и отдельно по
+негативным отзывам артикула. Обновляется инкрементально — уже учтённые
+отзывы пропускаются; в словаре — последние MAX_DOCS отзывов магазина.
+
+Ключевые термины артикула — TF-IDF против базы магазина: часто в отзывах
+артикула, но редко в магазине в целом. «Топ жалоб» — то же по отзывам
+с оценкой <= 3, причём только по комментарию и недостаткам: в
+достоинствах негативного отзыва жалоб нет («удобно сидит»).
+"""
+import math
+import re
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from ai_cache import normalize
+
+try:
+    import pymorphy3
+except ImportError:  # без pymorphy3 — грубый стеммер ниже
+    pymorphy3 = None
+
+NGRAMS = (1, 2, 3)
+# фраза из 2–3 слов должна встретиться хотя бы в стольких отзывах артикула
+MIN_PHRASE_DOCS = 2
+NEGATIVE_MAX = 3
+# отзывов на магазин в словаре — по последним столько, старые вытесняются
+MAX_DOCS = 20000
+
+STOPWORDS = frozenset("""
+    и в во что он она оно они на я с со как а то все всё это бы но за так от себя к у же ну вот или
+    е по для его ее её очень такой также того там при из поэтому свой нам вам мне мы вы был была были
+    было есть быть чтобы уже еще ещё через наш ваш может что-то весь этот тот который когда если даже
+    только просто совсем вообще сам сама самый тоже ли бы да нет ни до после без про над под о об
+    товар товара вещь покупка спасибо продавец продавцу wb вб
+""".split())
+
+_morph = None
+_morph_lock = threading.Lock()
+
+# окончания для грубого стемминга (длинные — первыми)
+_ENDINGS = sorted("""
+    ившись ывшись ующая ующий ующее ующие ейший ейшая ейшее ейшие ость ости остью
+    ого его ому ему ыми ими ого ая яя ое ее ые ие ый ий ой ем им ым ом ах ях ам ям ами ями
+    ала ило ыла ила ено ена ены ешь ете ите ить ать ять уть ет ит ут ют ат ят ла ло ли ся сь
+    ов ев ей ию ья ье ьи ь а я о е и ы у ю
+""".split(), key=len, reverse=True)
+
+
+def _get_morph():
+    global _morph
+    if _morph is None and pymorphy3 is not None:
+        with _morph_lock:
+            if _morph is None:
+                _morph = pymorphy3.MorphAnalyzer()
+    return _morph
+
+
+@lru_cache(maxsize=50000)
+def lemma(word: str) -> str:
+    """
+    Нормальная форма слова (кэшируется)
+    """
+    morph = _get_morph()
+    if morph is not None:
+        return morph.parse(word)[0].normal_form.replace("ё", "е")
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def lemmas(text: str) -> List[Tuple[str, str]]:
+    """
+    [(лемма, слово как в тексте)] содержательных слов; «не X» -> «не_X»
+    """
+    result = []
+    negate = False
+    for word in normalize(text).split():
+        if word in ("не", "ни"):
+            negate = True
+            continue
+        if word.isdigit() or (len(word) < 3 and not negate) or word in STOPWORDS:
+            # «не то, что ожидала» — отрицание относится к «то», а не к «ожидала»
+            negate = False
+            continue
+        base = lemma(word)
+        if base in STOPWORDS:
+            negate = False
+            continue
+        if negate:
+            result.append((f"не_{base}", f"не {word}"))
+        else:
+            result.append((base, word))
+        negate = False
+    return result
+
+
+# конец предложения: normalize() пунктуацию выкидывает, поэтому режем до него
+_SENTENCE_END = re.compile(r"[.!?;…\n]+")
+
+
+def terms(*texts: str) -> Dict[str, str]:
+    """
+    Термины текстов: {леммы через пробел: как написано} для слов и 2–3-грамм.
+    Фразы собираются внутри одного предложения одного текста
+    """
+    found = {}
+    for text in texts:
+        for sentence in _SENTENCE_END.split(text or ""):
+            words = lemmas(sentence)
+            for n in NGRAMS:
+                for i in range(len(words) - n + 1):
+                    gram = words[i:i + n]
+                    found.setdefault(" ".join(w for w, _ in gram), " ".join(s for _, s in gram))
+    return found
+
+
+def review_terms(review) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    (термины всего отзыва, термины жалобы — комментарий и недостатки, без достоинств)
+    """
+    complaint = terms(review.text, review.cons)
+    found = dict(complaint)
+    for term, surface in terms(review.pros).items():
+        found.setdefault(term, surface)
+    return found, complaint
+
+
+def rank(candidates: Iterable[Tuple[str, int]], docs: int, store_docs: int,
+         store_df: Callable[[str], int], n: int) -> List[Tuple[str, float]]:
+    """
+    TF-IDF отбор: candidates — (термин, в скольких отзывах группы), docs — отзывов
+    в группе, store_docs / store_df(термин) — база магазина. Лучшие n терминов
+    [(термин, вес)] без вложенных друг в друга («швы» при уже выбранных «кривых швах»)
+    """
+    if not docs:
+        return []
+    scored = []
+    for term, count in candidates:
+        if count < MIN_PHRASE_DOCS and " " in term:
+            continue
+        idf = math.log((store_docs + 1) / (store_df(term) + 1)) + 1
+        # фраза информативнее отдельного слова
+        scored.append((count / docs * idf * (1 + 0.5 * term.count(" ")), term))
+    scored.sort(reverse=True)
+    picked: List[Tuple[str, float]] = []
+    for score, term in scored:
+        words = set(term.split())
+        if any(words <= set(p.split()) or set(p.split()) <= words for p, _ in picked):
+            continue
+        picked.append((term, round(score, 3)))
+        if len(picked) >= n:
+            break
+    return picked
+
+
+class StoreVocab:
+    """
+    Словарь и документные частоты терминов одного магазина по последним
+    MAX_DOCS отзывам: при переполнении самый старый учтённый отзыв
+    вычитается из частот, термины без отзывов удаляются
+    """
+
+    def __init__(self, max_docs: int = None):
+        self.max_docs = max_docs or MAX_DOCS
+        self.ids: Dict[str, int] = {}
+        self.names: Dict[int, str] = {}
+        self.surface: Dict[int, str] = {}                 # как термин впервые встретился в тексте
+        self._next_id = 0
+        self.docs = 0
+        self.df: Counter = Counter()                      # id термина -> отзывов магазина
+        self.article_docs: Counter = Counter()            # артикул -> отзывов
+        self.article_df: Dict[str, Counter] = {}
+        self.negative_docs: Counter = Counter()
+        self.negative_df: Dict[str, Counter] = {}
+        # id отзыва -> (артикул, id терминов, id терминов жалобы или None) в порядке учёта
+        self.seen: "OrderedDict[str, Tuple[str, array, Optional[array]]]" = OrderedDict()
+
+    def _term_ids(self, found: Dict[str, str]) -> array:
+        ids = array("I")
+        for term, surface in found.items():
+            tid = self.ids.get(term)
+            if tid is None:
+                tid = self.ids[term] = self._next_id
+                self._next_id += 1
+                self.names[tid] = term
+                self.surface[tid] = surface
+            ids.append(tid)
+        return ids
+
+    def add(self, review, found: Optional[Tuple[Dict[str, str], Dict[str, str]]] = None) -> bool:
+        """
+        found — уже посчитанные review_terms() отзыва (лемматизация вне блокировки)
+        """
+        if review.id in self.seen:
+            return False
+        found, complaint = found or review_terms(review)
+        article = review.nm_id or "unknown"
+        ids = self._term_ids(found)
+        complaint_ids = None
+        if 0 < (review.valuation or 0) <= NEGATIVE_MAX:
+            complaint_ids = self._term_ids(complaint)
+        self.seen[review.id] = (article, ids, complaint_ids)
+        self.docs += 1
+        self.df.update(ids)
+        self.article_docs[article] += 1
+        self.article_df.setdefault(article, Counter()).update(ids)
+        if complaint_ids is not None:
+            self.negative_docs[article] += 1
+            self.negative_df.setdefault(article, Counter()).update(complaint_ids)
+        while len(self.seen) > self.max_docs:
+            self._evict()
+        return True
+
+    def _evict(self):
+        _, (article, ids, complaint_ids) = self.seen.popitem(last=False)
+        self.docs -= 1
+        self.df.subtract(ids)
+        _decrement(self.article_docs, article)
+        self.article_df[article].subtract(ids)
+        if complaint_ids is not None:
+            _decrement(self.negative_docs, article)
+            self.negative_df[article].subtract(complaint_ids)
+        for tid in ids:
+            if self.df[tid] <= 0:
+                del self.df[tid]
+                del self.ids[self.names.pop(tid)]
+                del self.surface[tid]
+        for df in (self.article_df, self.negative_df):
+            counter = df.get(article)
+            if counter is None:
+                continue
+            for tid in ids:
+                if counter.get(tid, 1) <= 0:
+                    del counter[tid]
+            if not counter:
+                del df[article]
+
+    def has(self, review_id: str) -> bool:
+        return review_id in self.seen
+
+    def _top(self, df: Optional[Counter], docs: int, n: int) -> List[Tuple[str, float]]:
+        if not df:
+            return []
+        picked = rank(((self.names[tid], count) for tid, count in df.items()), docs,
+                      self.docs, lambda term: self.df[self.ids[term]], n)
+        return [(self.surface[self.ids[term]], score) for term, score in picked]
+
+    def top_keywords(self, article: str, n: int = 5) -> List[Tuple[str, float]]:
+        return self._top(self.article_df.get(article), self.article_docs[article], n)
+
+    def top_complaints(self, article: str, n: int = 5) -> List[Tuple[str, float]]:
+        return self._top(self.negative_df.get(article), self.negative_docs[article], n)
+
+
+def _decrement(counter: Counter, key: str):
+    counter[key] -= 1
+    if counter[key] <= 0:
+        del counter[key]
+
+
+_lock = threading.Lock()
+_vocabs: Dict[Tuple[int, str], StoreVocab] = {}
+
+
+def update(user_id: int, store: str, reviews: Iterable) -> int:
+    """
+    Учесть новые отзывы магазина; возвращает, сколько добавлено.
+    Лемматизация — вне блокировки; из async-кода звать через asyncio.to_thread.
+    """
+    reviews = list(reviews)
+    with _lock:
+        vocab = _vocabs.setdefault((user_id, store), StoreVocab())
+        fresh = [r for r in reviews if not vocab.has(r.id)]
+    docs = [(r, review_terms(r)) for r in fresh]
+    with _lock:
+        return sum(1 for r, found in docs if vocab.add(r, found))
+
+
+def top_keywords(user_id: int, store: str, article: str, n: int = 5) -> List[Tuple[str, float]]:
+    """
+    [(фраза, вес)] — чем артикул выделяется в отзывах на фоне магазина
+    """
+    with _lock:
+        vocab = _vocabs.get((user_id, store))
+        return vocab.top_keywords(article, n) if vocab else []
+
+
+def top_complaints(user_id: int, store: str, article: str, n: int = 5) -> List[Tuple[str, float]]:
+    """
+    [(фраза, вес)] — о чём пишут в негативных отзывах артикула
+    """
+    with _lock:
+        vocab = _vocabs.get((user_id, store))
+        return vocab.top_complaints(article, n) if vocab else []
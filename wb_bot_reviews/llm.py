@@ -0,0 +1,370 @@
+# llm.py
+"""
+Провайдеры LLM для ai.py.
+
+Список провайдеров упорядочен: первый — основной, остальные — запасные
+(другая модель / другой API). Запрос идёт к первому доступному; таймаут,
+сетевая ошибка, 429 или 5xx — переходим к следующему. У каждого провайдера
+свой таймаут и свой circuit breaker (breaker.py), упавший провайдер не
+тормозит запросы, пока не оживёт.
+
+HEDGE=True включает «подстраховочные» запросы: если основной провайдер не
+ответил за свой p90 латентности, параллельно отправляем запрос запасному и
+берём первый успешный ответ — хвост латентности ограничен.
+
+FakeProvider — детерминированный локальный провайдер для офлайн-проверок
+и бенчмарков (AI_PROVIDER=fake).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import metrics
+from breaker import CircuitBreaker
+
+if TYPE_CHECKING:
+    import aiohttp
+
+MAX_CONNECTIONS = 20
+CONNECT_TIMEOUT = 5      # сек
+REQUEST_TIMEOUT = 60     # сек, таймаут провайдера по умолчанию
+KEEPALIVE_TIMEOUT = 60   # сек, сколько держим простаивающее соединение
+
+HEDGE = os.getenv("AI_HEDGE", "0") == "1"
+HEDGE_QUANTILE = 0.9
+HEDGE_MIN_DELAY = 0.5    # сек, раньше подстраховку не шлём
+# коды, при которых имеет смысл спросить другого провайдера
+RETRY_STATUSES = {408, 409, 425, 429}
+
+# (status, json или None, сырой текст ответа)
+ChatResult = Tuple[int, Optional[Dict[str, Any]], str]
+# (кусок текста, usage) — usage приходит только в последнем событии
+StreamEvent = Tuple[str, Optional[Dict[str, Any]]]
+
+metrics.describe("ai_provider_fallbacks_total", "Переходы на запасного LLM-провайдера")
+metrics.describe("ai_hedged_requests_total", "Подстраховочные запросы (result=primary|backup)")
+
+_session: Optional["aiohttp.ClientSession"] = None
+
+
+class ProviderError(Exception):
+    """
+    Провайдер не ответил / ответил ошибкой, после которой стоит попробовать следующего
+    """
+
+
+async def start():
+    """
+    Общий пул соединений (один на процесс)
+    """
+    # ленивый импорт: процессы без AI не тянут aiohttp
+    import aiohttp
+
+    global _session
+    if _session is not None and not _session.closed:
+        return
+    _session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS, keepalive_timeout=KEEPALIVE_TIMEOUT),
+    )
+
+
+async def close():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+async def _get_session() -> "aiohttp.ClientSession":
+    if _session is None or _session.closed:
+        # не открыли при старте — открываем при первом вызове
+        await start()
+    return _session
+
+
+class Provider:
+    """
+    OpenAI-совместимый chat/completions (OpenRouter и т.п.)
+    """
+
+    def __init__(self, name: str, url: str, model: str, api_key: str = "",
+                 timeout: float = REQUEST_TIMEOUT):
+        self.name = name
+        self.url = url
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(f"llm:{name}")
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name!r}, model={self.model!r})"
+
+    def _request(self, payload: dict, stream: bool = False) -> Tuple[bytes, Dict[str, str]]:
+        body = {**payload, "model": self.model}
+        if stream:
+            body["stream"] = True
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return json.dumps(body, ensure_ascii=False).encode("utf-8"), headers
+
+    def _timeout(self, timeout: Optional[float]):
+        import aiohttp
+        return aiohttp.ClientTimeout(total=timeout or self.timeout, connect=CONNECT_TIMEOUT)
+
+    async def complete(self, payload: dict, endpoint: str, timeout: Optional[float] = None) -> ChatResult:
+        session = await _get_session()
+        body, headers = self._request(payload)
+        started = time.perf_counter()
+        try:
+            async with session.post(self.url, data=body, headers=headers, timeout=self._timeout(timeout)) as r:
+                status = r.status
+                raw = await r.read()
+        except Exception:
+            metrics.observe_http("ai", endpoint, self.name, 0, time.perf_counter() - started,
+                                 request_bytes=len(body))
+            raise
+        metrics.observe_http("ai", endpoint, self.name, status, time.perf_counter() - started,
+                             request_bytes=len(body), response_bytes=len(raw))
+
+        text = raw.decode("utf-8", errors="replace")
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        return status, data, text
+
+    async def stream(self, payload: dict, endpoint: str,
+                     timeout: Optional[float] = None) -> AsyncIterator[StreamEvent]:
+        """
+        SSE ("stream": true): куски текста по мере генерации
+        """
+        session = await _get_session()
+        body, headers = self._request(payload, stream=True)
+        started = time.perf_counter()
+        status = 0
+        received = 0
+        try:
+            async with session.post(self.url, data=body, headers=headers, timeout=self._timeout(timeout)) as r:
+                status = r.status
+                if status != 200:
+                    raw = await r.read()
+                    received = len(raw)
+                    raise ProviderError(f"{self.name}: HTTP {status}: {raw.decode('utf-8', errors='replace')}")
+                async for line in r.content:
+                    received += len(line)
+                    line = line.strip()
+                    # ": OPENROUTER PROCESSING" и пустые строки — служебные
+                    if not line.startswith(b"data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                        # usage приходит в последнем куске
+                        usage = chunk.get("usage")
+                        choices = chunk.get("choices") or [{}]
+                        delta = (choices[0].get("delta") or {}).get("content") or ""
+                    except (ValueError, AttributeError):
+                        continue
+                    if delta or usage:
+                        yield delta, usage
+        finally:
+            metrics.observe_http("ai", endpoint, self.name, status, time.perf_counter() - started,
+                                 request_bytes=len(body), response_bytes=received)
+
+
+class FakeProvider(Provider):
+    """
+    Локальный провайдер без сети: ответ и задержка зависят только от промпта
+    """
+
+    _IDS = re.compile(r'"id":\s*"([^"]+)"')
+
+    def __init__(self, name: str = "fake", latency: float = 0.05, jitter: float = 0.0,
+                 model: str = "fake-model"):
+        super().__init__(name, url="fake://", model=model, timeout=REQUEST_TIMEOUT)
+        self.latency = latency
+        self.jitter = jitter
+
+    @staticmethod
+    def _digest(payload: dict) -> int:
+        prompt = "\n".join(m.get("content", "") for m in payload.get("messages", []))
+        return int.from_bytes(hashlib.blake2b(prompt.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def _answer(self, payload: dict) -> str:
+        prompt = payload.get("messages", [{}])[-1].get("content", "")
+        n = self._digest(payload) % 1000
+        if payload.get("response_format", {}).get("type") == "json_object":
+            # пакетная генерация: ответ на каждый id из промпта
+            return json.dumps({rid: f"Спасибо за отзыв! Вариант {n}." for rid in self._IDS.findall(prompt)},
+                              ensure_ascii=False)
+        if "ВЫЖИМК" in prompt or "выжимки" in prompt:
+            return (f"👍 Хвалят: качество (fake {n})\n"
+                    f"👎 Жалуются: размер\n"
+                    f"💡 Вывод: проверить размерную сетку")
+        return f"Спасибо за обратную связь! Ответ {n}."
+
+    async def _sleep(self, payload: dict):
+        delay = self.latency + (self._digest(payload) % 1000) / 1000 * self.jitter
+        await asyncio.sleep(delay)
+        return delay
+
+    async def complete(self, payload: dict, endpoint: str, timeout: Optional[float] = None) -> ChatResult:
+        delay = await self._sleep(payload)
+        content = self._answer(payload)
+        data = {"choices": [{"message": {"content": content}}], "model": self.model}
+        text = json.dumps(data, ensure_ascii=False)
+        metrics.observe_http("ai", endpoint, self.name, 200, delay, response_bytes=len(text))
+        return 200, data, text
+
+    async def stream(self, payload: dict, endpoint: str,
+                     timeout: Optional[float] = None) -> AsyncIterator[StreamEvent]:
+        words = self._answer(payload).split(" ")
+        delay = await self._sleep(payload)
+        for i, word in enumerate(words):
+            yield (word if i == 0 else " " + word), None
+            await asyncio.sleep(0)
+        metrics.observe_http("ai", endpoint, self.name, 200, delay)
+
+
+# -------------------------
+# Выбор провайдера
+# -------------------------
+_providers: List[Provider] = []
+
+
+def set_providers(providers: List[Provider]):
+    _providers[:] = providers
+
+
+def get_providers() -> List[Provider]:
+    return list(_providers)
+
+
+async def _attempt(p: Provider, payload: dict, endpoint: str, timeout: Optional[float]) -> ChatResult:
+    if not p.breaker.allow():
+        raise ProviderError(f"{p.name}: провайдер временно отключён")
+    try:
+        status, data, text = await p.complete(payload, endpoint, timeout)
+    except Exception as e:
+        # таймаут, сеть, кривой ответ — провайдер не справился
+        p.breaker.record_failure()
+        raise ProviderError(f"{p.name}: {e!r}") from e
+    except BaseException:
+        # отмена (проиграли гонку подстраховки, пользователь ушёл) — итога нет,
+        # но пробный запрос half-open отпускаем, иначе провайдер выключен до перезапуска
+        p.breaker.release()
+        raise
+    if status in RETRY_STATUSES or status >= 500:
+        p.breaker.record_failure()
+        raise ProviderError(f"{p.name}: HTTP {status}")
+    p.breaker.record_success()
+    return status, data, text
+
+
+def _hedge_delay(p: Provider, endpoint: str) -> Optional[float]:
+    q = metrics.quantile("http_client_request_seconds", HEDGE_QUANTILE,
+                         {"service": "ai", "endpoint": endpoint, "profile": p.name})
+    if q is None:
+        # замеров ещё нет — не с чем сравнивать
+        return None
+    return max(q, HEDGE_MIN_DELAY)
+
+
+async def _hedged(primary: Provider, backup: Provider, delay: float,
+                  payload: dict, endpoint: str, timeout: Optional[float]) -> ChatResult:
+    first = asyncio.ensure_future(_attempt(primary, payload, endpoint, timeout))
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if first in done:
+            if first.exception() is None:
+                return first.result()
+            # основной уже упал — обычный переход к запасному
+            metrics.inc("ai_provider_fallbacks_total", {"from": primary.name, "to": backup.name})
+            return await _attempt(backup, payload, endpoint, timeout)
+
+        second = asyncio.ensure_future(_attempt(backup, payload, endpoint, timeout))
+        tasks.add(second)
+        error: Optional[BaseException] = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    metrics.inc("ai_hedged_requests_total", {"result": "primary" if t is first else "backup"})
+                    return t.result()
+                error = t.exception()
+        raise error
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+
+async def complete(payload: dict, endpoint: str, timeout: Optional[float] = None) -> ChatResult:
+    """
+    Запрос к первому провайдеру, который ответит; ProviderError — не ответил никто
+    """
+    providers = get_providers()
+    last_error: Optional[ProviderError] = None
+    i = 0
+    while i < len(providers):
+        p = providers[i]
+        backup = providers[i + 1] if HEDGE and i + 1 < len(providers) else None
+        delay = _hedge_delay(p, endpoint) if backup else None
+        try:
+            if delay is None:
+                return await _attempt(p, payload, endpoint, timeout)
+            return await _hedged(p, backup, delay, payload, endpoint, timeout)
+        except ProviderError as e:
+            last_error = e
+        i += 1 if delay is None else 2
+        if i < len(providers):
+            metrics.inc("ai_provider_fallbacks_total", {"from": p.name, "to": providers[i].name})
+    raise last_error or ProviderError("нет доступных LLM-провайдеров")
+
+
+async def stream(payload: dict, endpoint: str, timeout: Optional[float] = None) -> AsyncIterator[StreamEvent]:
+    """
+    Стриминг от первого ответившего провайдера. Переключиться можно только
+    до первого куска — дальше ошибка уходит вызывающему.
+    """
+    providers = get_providers()
+    last_error: Optional[BaseException] = None
+    for i, p in enumerate(providers):
+        if i:
+            metrics.inc("ai_provider_fallbacks_total", {"from": providers[i - 1].name, "to": p.name})
+        if not p.breaker.allow():
+            last_error = ProviderError(f"{p.name}: провайдер временно отключён")
+            continue
+        started = False
+        try:
+            async for event in p.stream(payload, endpoint, timeout):
+                started = True
+                yield event
+        except (GeneratorExit, asyncio.CancelledError):
+            # стрим бросили на середине: куски шли — провайдер жив, иначе итога нет
+            if started:
+                p.breaker.record_success()
+            else:
+                p.breaker.release()
+            raise
+        except Exception as e:
+            p.breaker.record_failure()
+            if started:
+                raise
+            last_error = e
+            continue
+        except BaseException:
+            p.breaker.release()
+            raise
+        p.breaker.record_success()
+        return
+    raise ProviderError(f"нет доступных LLM-провайдеров: {last_error!r}")
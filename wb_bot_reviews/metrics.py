@@ -0,0 +1,183 @@
+# metrics.py
+"""
+Метрики исходящих HTTP-вызовов (WB и AI) в памяти процесса.
+
+Латентность хранится скользящим окном последних RESERVOIR_SIZE замеров
+на каждую серию — по нему считаются p50/p95/p99. Отдаём всё в текстовом
+формате Prometheus: GET /metrics на порту из METRICS_PORT.
+"""
+import logging
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+RESERVOIR_SIZE = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[Labels, float]] = {}
+_gauges: Dict[str, Dict[Labels, float]] = {}
+_summaries: Dict[str, Dict[Labels, "_Summary"]] = {}
+_help: Dict[str, str] = {}
+
+
+class _Summary:
+    __slots__ = ("count", "total", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples: Deque[float] = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantiles(self, qs: Iterable[float] = QUANTILES) -> Dict[float, float]:
+        data = sorted(self.samples)
+        if not data:
+            return {q: 0.0 for q in qs}
+        last = len(data) - 1
+        return {q: data[min(last, int(round(q * last)))] for q in qs}
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+def describe(name: str, text: str):
+    _help[name] = text
+
+
+def inc(name: str, labels: Optional[Dict[str, str]] = None, value: float = 1):
+    key = _labels(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, labels: Optional[Dict[str, str]] = None):
+    with _lock:
+        _gauges.setdefault(name, {})[_labels(labels)] = value
+
+
+def observe(name: str, value: float, labels: Optional[Dict[str, str]] = None):
+    key = _labels(labels)
+    with _lock:
+        series = _summaries.setdefault(name, {})
+        s = series.get(key)
+        if s is None:
+            s = series[key] = _Summary()
+        s.observe(value)
+
+
+def quantile(name: str, q: float, labels: Optional[Dict[str, str]] = None) -> Optional[float]:
+    """
+    Текущая оценка квантиля по окну (None — замеров ещё нет)
+    """
+    with _lock:
+        s = _summaries.get(name, {}).get(_labels(labels))
+        if s is None or not s.samples:
+            return None
+        return s.quantiles((q,))[q]
+
+
+# -------------------------
+# HTTP-вызовы
+# -------------------------
+describe("http_client_request_seconds", "Латентность исходящих HTTP-запросов")
+describe("http_client_requests_total", "Исходящие HTTP-запросы по кодам ответа")
+describe("http_client_request_bytes_total", "Отправлено байт (тело запроса)")
+describe("http_client_response_bytes_total", "Получено байт (тело ответа)")
+describe("http_client_retries_total", "Повторные попытки запросов")
+
+
+def observe_http(service: str, endpoint: str, profile: Optional[str], status: int,
+                 seconds: float, request_bytes: int = 0, response_bytes: int = 0):
+    """
+    status=0 — сетевая ошибка / таймаут, ответа не было
+    """
+    labels = {"service": service, "endpoint": endpoint, "profile": profile or "-"}
+    observe("http_client_request_seconds", seconds, labels)
+    inc("http_client_requests_total", {**labels, "status": str(status)})
+    if request_bytes:
+        inc("http_client_request_bytes_total", labels, request_bytes)
+    if response_bytes:
+        inc("http_client_response_bytes_total", labels, response_bytes)
+
+
+def record_retry(service: str, endpoint: str, profile: Optional[str] = None):
+    inc("http_client_retries_total", {"service": service, "endpoint": endpoint, "profile": profile or "-"})
+
+
+# -------------------------
+# Экспорт
+# -------------------------
+def _fmt_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{v}"' for k, v in items)
+    return "{" + body + "}"
+
+
+def render() -> str:
+    """
+    Все метрики в текстовом формате Prometheus
+    """
+    lines: List[str] = []
+    with _lock:
+        for name, series in sorted(_counters.items()):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_fmt_labels(labels)} {value:g}")
+        for name, series in sorted(_gauges.items()):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in series.items():
+                lines.append(f"{name}{_fmt_labels(labels)} {value:g}")
+        for name, series in sorted(_summaries.items()):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} summary")
+            for labels, s in series.items():
+                for q, v in s.quantiles().items():
+                    lines.append(f"{name}{_fmt_labels(labels, (('quantile', f'{q:g}'),))} {v:.6f}")
+                lines.append(f"{name}_sum{_fmt_labels(labels)} {s.total:.6f}")
+                lines.append(f"{name}_count{_fmt_labels(labels)} {s.count}")
+    return "\n".join(lines) + "\n"
+
+
+def start_http_server(port: int, host: str = "0.0.0.0"):
+    """
+    Поднимает /metrics в фоновом потоке
+    """
+    # http.server тянет email/html/mimetypes — импортируем только когда сервер реально нужен
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info("metrics: http://%s:%s/metrics", host, server.server_address[1])
+    return server
@@ -0,0 +1,134 @@
+# prefetch.py
+"""
+Заранее сгенерированные AI-черновики для показанной страницы отзывов.
+
+Включается пользователем (/ai_prefetch). После показа страницы по её
+отзывам по одному генерируются черновики с самым низким приоритетом
+(ai_scheduler.SPECULATIVE) — кнопка «AI» на таком отзыве отвечает сразу.
+По одному — чтобы не занимать оба пользовательских слота очереди и не
+тормозить его же клики. Ушёл со страницы — генерация отменяется.
+Клик по отзыву, черновик которого ещё стоит в очереди, не ждёт его:
+такая генерация отменяется, и клик идёт со своим приоритетом INTERACTIVE.
+На пользователя не больше BUDGET_PER_HOUR обращений к модели в час
+(черновики из ai_cache бюджет не тратят).
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+import ai_scheduler
+import fastpath
+import storage
+from ai_scheduler import SPECULATIVE
+
+BUDGET_PER_HOUR = 60
+
+_tasks: Dict[int, asyncio.Task] = {}
+# (user_id, review_id) -> генерация, которая идёт прямо сейчас
+_inflight: Dict[Tuple[int, str], asyncio.Task] = {}
+_spent: Dict[int, Deque[float]] = {}
+
+
+def _budget_left(user_id: int) -> int:
+    spent = _spent.setdefault(user_id, deque())
+    hour_ago = time.monotonic() - 3600
+    while spent and spent[0] < hour_ago:
+        spent.popleft()
+    return BUDGET_PER_HOUR - len(spent)
+
+
+async def _run(user_id: int, reviews: list):
+    from ai import AI_ANSWER_ERROR, generate_ai_answer, is_answer_cached
+
+    store = storage.get_current_store(user_id)
+    thresholds = storage.get_fastpath_thresholds(user_id, store) or ()
+    for r in reviews:
+        if storage.has_prefetched_draft(user_id, r.id):
+            continue
+        # дежурной похвале хватит шаблона (fastpath.py) — бюджет не тратим
+        if fastpath.classify(r, *thresholds) == fastpath.ROUTE_TEMPLATE:
+            continue
+        stars = r.valuation or 5
+        # бюджет — на запросы к модели; ответ из ai_cache бесплатный
+        if not is_answer_cached(r.text, stars):
+            if _budget_left(user_id) <= 0:
+                logging.info(f"prefetch: бюджет пользователя {user_id} исчерпан")
+                return
+            _spent[user_id].append(time.monotonic())
+        job = asyncio.ensure_future(
+            generate_ai_answer(r.text, stars, user_id=user_id, priority=SPECULATIVE)
+        )
+        key = (user_id, r.id)
+        _inflight[key] = job
+        try:
+            text = await job
+        except asyncio.CancelledError:
+            if _inflight.get(key) is job:
+                raise  # отменили весь prefetch
+            # генерацию забрал клик (take) — он ответит сам
+            continue
+        finally:
+            if _inflight.get(key) is job:
+                del _inflight[key]
+        if text and text != AI_ANSWER_ERROR:
+            storage.save_prefetched_draft(str(uuid.uuid4()), user_id, r.id, text)
+
+
+def start(user_id: int, reviews: list):
+    """
+    Начать генерацию черновиков для показанных отзывов (если пользователь включил режим)
+    """
+    cancel(user_id)
+    if not reviews or not storage.get_ai_prefetch(user_id):
+        return
+    task = asyncio.create_task(_run(user_id, list(reviews)))
+    _tasks[user_id] = task
+
+    def _forget(t: asyncio.Task):
+        if _tasks.get(user_id) is t:
+            del _tasks[user_id]
+
+    task.add_done_callback(_forget)
+
+
+def cancel(user_id: int):
+    """
+    Пользователь ушёл со страницы: остановить генерацию и выбросить невостребованные черновики
+    """
+    task = _tasks.pop(user_id, None)
+    if task and not task.done():
+        task.cancel()
+    storage.drop_prefetched_drafts(user_id)
+
+
+async def take(user_id: int, review_id: str) -> Optional[str]:
+    """
+    draft_id готового черновика. Если запрос за ним уже выполняется — дождаться
+    (это быстрее, чем ставить второй). Если он ещё ждёт слот в очереди на
+    SPECULATIVE, ждать его — значит ждать всю фоновую очередь: отменяем,
+    клик сгенерирует ответ сам (None).
+    """
+    draft_id = storage.pop_prefetched_draft(user_id, review_id)
+    if draft_id:
+        return draft_id
+    job = _inflight.get((user_id, review_id))
+    if job is None:
+        return None
+    if not ai_scheduler.holds_slot(job):
+        del _inflight[(user_id, review_id)]
+        job.cancel()
+        return None
+    try:
+        # shield: сам клик не должен отменять фоновую генерацию
+        await asyncio.shield(job)
+    except asyncio.CancelledError:
+        if not job.cancelled():
+            raise
+        # генерацию отменили (ушли со страницы) — пусть клик сгенерирует заново
+        return None
+    except Exception:
+        return None
+    return storage.pop_prefetched_draft(user_id, review_id)
@@ -0,0 +1,117 @@
+# prompt_budget.py
+"""
+Сборка промптов анализа в рамках бюджета токенов.
+
+Настоящий токенайзер модели не тянем — оценка по словам: кириллическое
+слово ~ len/3 токенов, латиница/цифры ~ len/4, знак препинания — токен.
+Для бюджета этого достаточно: ошибка в пределах 10–20%, а длинный отзыв
+больше не может раздуть промпт (и латентность) в разы.
+"""
+import re
+from typing import Iterable, List, Tuple
+
+from ai_cache import normalize
+
+# бюджет на отзывы в одном промпте анализа (без инструкции)
+PROMPT_BUDGET = 1500
+# один отзыв не длиннее — остальное обрезаем
+MAX_REVIEW_TOKENS = 120
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def _word_tokens(word: str) -> int:
+    if not word[0].isalnum() and word[0] != "_":
+        return 1
+    per = 4 if word.isascii() else 3
+    return max(1, -(-len(word) // per))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов текста
+    """
+    return sum(_word_tokens(m.group()) for m in _TOKEN_RE.finditer(text or ""))
+
+
+def truncate_tokens(text: str, limit: int) -> str:
+    """
+    Обрезает текст до ~limit токенов по границе слова
+    """
+    used = 0
+    for m in _TOKEN_RE.finditer(text):
+        used += _word_tokens(m.group())
+        if used > limit:
+            return text[:m.start()].rstrip() + "…"
+    return text
+
+
+def _informativeness(rating: int, text: str) -> float:
+    # больше разных содержательных слов — больше сигнала; жалобы ценнее похвал
+    words = {w for w in normalize(text).split() if len(w) > 2}
+    score = min(len(words), 40)
+    if rating and rating <= 3:
+        score += 10
+    return score
+
+
+def select_reviews(reviews: Iterable[Tuple[int, str]], budget: int = PROMPT_BUDGET,
+                   max_review_tokens: int = MAX_REVIEW_TOKENS) -> List[Tuple[int, str]]:
+    """
+    [(оценка, текст)] -> самые информативные уникальные отзывы,
+    обрезанные и уложенные в budget токенов
+    """
+    seen = set()
+    candidates = []
+    for rating, text in reviews:
+        key = normalize(text)
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        candidates.append((_informativeness(rating, text), rating, text))
+    # сортировка устойчивая — при равной ценности сохраняем исходный порядок (свежие раньше)
+    candidates.sort(key=lambda c: -c[0])
+
+    picked = []
+    used = 0
+    for _, rating, text in candidates:
+        text = truncate_tokens(text, max_review_tokens)
+        cost = estimate_tokens(text) + 6  # "⭐ 5/5: " и переводы строк
+        if used + cost > budget:
+            continue
+        picked.append((rating, text))
+        used += cost
+    return picked
+
+
+def format_reviews(reviews: Iterable[Tuple[int, str]]) -> str:
+    """
+    Отзывы в виде блока для промпта анализа
+    """
+    return "".join(f"⭐ {rating}/5: {text}\n\n" for rating, text in reviews)
+
+
+def chunk_reviews(reviews: Iterable[Tuple[int, str]], budget: int = PROMPT_BUDGET,
+                  max_review_tokens: int = MAX_REVIEW_TOKENS) -> List[List[Tuple[int, str]]]:
+    """
+    Все уникальные отзывы (обрезанные), разложенные по кускам не больше budget токенов
+    """
+    seen = set()
+    chunks: List[List[Tuple[int, str]]] = []
+    current: List[Tuple[int, str]] = []
+    used = 0
+    for rating, text in reviews:
+        key = normalize(text)
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        text = truncate_tokens(text, max_review_tokens)
+        cost = estimate_tokens(text) + 6
+        if current and used + cost > budget:
+            chunks.append(current)
+            current, used = [], 0
+        current.append((rating, text))
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
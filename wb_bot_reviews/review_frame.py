@@ -0,0 +1,187 @@
+# review_frame.py
+"""
+Колоночное представление отзывов магазина для аналитики.
+
+Из списка Feedback один раз (после загрузки) собираются numpy-колонки:
+оценка, код артикула, время создания, длина текста, отвечен ли отзыв.
+Группировки — распределение оценок, средняя, доля негатива по артикулам
+и по периодам — считаются через bincount без циклов по отзывам: 100k
+отзывов агрегируются за единицы миллисекунд.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# оценка <= NEGATIVE_MAX — негатив (как в отчётах анализа)
+NEGATIVE_MAX = 3
+UNKNOWN_ARTICLE = "unknown"
+DAY = 24 * 3600
+# 1970-01-05 — понедельник: недели считаем с понедельника
+_WEEK_ORIGIN = 4 * DAY
+
+
+def _timestamps(created: List[str]) -> np.ndarray:
+    """
+    createdDate (ISO-строка или миллисекунды) -> секунды UTC, -1 — нет даты
+    """
+    ts = np.full(len(created), -1, dtype=np.int64)
+    iso_idx, iso = [], []
+    for i, value in enumerate(created):
+        if not value:
+            continue
+        if value.isdigit():
+            n = int(value)
+            ts[i] = n // 1000 if n > 10 ** 11 else n
+        else:
+            iso_idx.append(i)
+            iso.append(value[:19])  # без долей секунды и зоны — WB отдаёт UTC
+    if iso:
+        try:
+            parsed = np.array(iso, dtype="datetime64[s]")
+        except ValueError:
+            parsed = np.array([_parse_one(v) for v in iso], dtype="datetime64[s]")
+        ok = ~np.isnat(parsed)
+        ts[np.asarray(iso_idx)[ok]] = parsed[ok].astype(np.int64)
+    return ts
+
+
+def _parse_one(value: str) -> str:
+    try:
+        np.datetime64(value, "s")
+        return value
+    except ValueError:
+        return "NaT"
+
+
+class ReviewFrame:
+    """
+    Колонки отзывов; items[i] — исходный Feedback строки i
+    """
+
+    __slots__ = ("items", "articles", "codes", "valuation", "created", "text_len", "answered")
+
+    def __init__(self, items: list, articles: List[str], codes: np.ndarray, valuation: np.ndarray,
+                 created: np.ndarray, text_len: np.ndarray, answered: np.ndarray):
+        self.items = items
+        self.articles = articles      # код -> артикул
+        self.codes = codes            # int32, код артикула строки
+        self.valuation = valuation    # int8, 0 — без оценки
+        self.created = created        # int64, секунды UTC, -1 — нет даты
+        self.text_len = text_len      # int32
+        self.answered = answered      # bool
+
+    @classmethod
+    def from_feedbacks(cls, feedbacks: list) -> "ReviewFrame":
+        items = list(feedbacks)
+        n = len(items)
+        article_codes: Dict[str, int] = {}
+        codes = np.empty(n, dtype=np.int32)
+        valuation = np.empty(n, dtype=np.int8)
+        text_len = np.empty(n, dtype=np.int32)
+        answered = np.empty(n, dtype=bool)
+        created = []
+        for i, r in enumerate(items):
+            article = r.nm_id or UNKNOWN_ARTICLE
+            code = article_codes.get(article)
+            if code is None:
+                code = article_codes[article] = len(article_codes)
+            codes[i] = code
+            valuation[i] = r.valuation if 0 < (r.valuation or 0) <= 5 else 0
+            text_len[i] = len(r.text) + len(r.pros) + len(r.cons)
+            answered[i] = bool(r.answered)
+            created.append(r.created)
+        return cls(items, list(article_codes), codes, valuation, _timestamps(created), text_len, answered)
+
+    def __len__(self):
+        return len(self.items)
+
+    # -------------------------
+    # Группировки
+    # -------------------------
+    def _distribution(self, groups: np.ndarray, n_groups: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        # [группа, оценка 1..5] -> число отзывов
+        rated = self.valuation > 0
+        if mask is not None:
+            rated &= mask
+        keys = groups[rated].astype(np.int64) * 5 + self.valuation[rated] - 1
+        return np.bincount(keys, minlength=n_groups * 5).reshape(n_groups, 5)
+
+    @staticmethod
+    def _summary(dist: np.ndarray, counts: np.ndarray) -> Dict[str, np.ndarray]:
+        rated = dist.sum(axis=1)
+        total = dist @ np.arange(1, 6)
+        negative = dist[:, :NEGATIVE_MAX].sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            avg = np.where(rated > 0, total / np.maximum(rated, 1), 0.0)
+            neg_share = np.where(rated > 0, negative / np.maximum(rated, 1), 0.0)
+        return {"count": counts, "rated": rated, "avg": avg, "positive": rated - negative,
+                "negative": negative, "negative_share": neg_share}
+
+    @staticmethod
+    def _row(summary: Dict[str, np.ndarray], dist: np.ndarray, i: int) -> Dict[str, Any]:
+        return {
+            "count": int(summary["count"][i]),
+            "avg": round(float(summary["avg"][i]), 2),
+            "positive": int(summary["positive"][i]),
+            "negative": int(summary["negative"][i]),
+            "negative_share": float(summary["negative_share"][i]),
+            "distribution": {stars: int(dist[i, stars - 1]) for stars in range(1, 6)},
+        }
+
+    def article_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        {артикул: {count, avg, positive, negative, negative_share, distribution{1..5}}}
+        """
+        n = len(self.articles)
+        dist = self._distribution(self.codes, n)
+        summary = self._summary(dist, np.bincount(self.codes, minlength=n))
+        return {article: self._row(summary, dist, i) for i, article in enumerate(self.articles)}
+
+    def period_stats(self, days: int = 7, article: Optional[str] = None,
+                     last: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        По периодам в days дней (недели — с понедельника), старые раньше:
+        [{start: date, count, avg, positive, negative, negative_share, distribution}].
+        Периоды без отзывов пропускаются; last — только последние last периодов
+        (считая от последнего с отзывами)
+        """
+        mask = self.created >= 0
+        if article is not None:
+            if article not in self.articles:
+                return []
+            mask &= self.codes == self.articles.index(article)
+        if not mask.any():
+            return []
+        width = days * DAY
+        origin = _WEEK_ORIGIN if days == 7 else 0
+        periods = (self.created - origin) // width
+        uniq, inverse = np.unique(periods[mask], return_inverse=True)
+        groups = np.zeros(len(self), dtype=np.int64)
+        groups[mask] = inverse
+        dist = self._distribution(groups, len(uniq), mask)
+        summary = self._summary(dist, np.bincount(inverse, minlength=len(uniq)))
+        result = []
+        for i, p in enumerate(uniq):
+            if last is not None and p <= uniq[-1] - last:
+                continue
+            row = self._row(summary, dist, i)
+            row["start"] = datetime.fromtimestamp(int(p) * width + origin, tz=timezone.utc).date()
+            result.append(row)
+        return result
+
+    def groups(self) -> Dict[str, np.ndarray]:
+        """
+        {артикул: индексы строк} в порядке появления артикулов, строки — в исходном порядке
+        """
+        order = np.argsort(self.codes, kind="stable")
+        bounds = np.cumsum(np.bincount(self.codes, minlength=len(self.articles)))
+        starts = np.concatenate(([0], bounds[:-1]))
+        return {article: order[starts[i]:bounds[i]] for i, article in enumerate(self.articles)}
+
+    def rows(self, idx: np.ndarray) -> list:
+        """
+        Исходные отзывы по индексам строк
+        """
+        items = self.items
+        return [items[i] for i in idx.tolist()]
@@ -0,0 +1,194 @@
+# similar.py
+"""
+Поиск почти одинаковых отзывов среди уже отвеченных.
+
+«Все супер, спасибо!», «Всё супер. Спасибо» и «все супер спасибо большое»
+в рамках магазина получают один и тот же по смыслу ответ. Для каждого
+отправленного ответа запоминаем MinHash-подпись отзыва (шинглы из слов),
+а новый отзыв ищем через LSH-корзины: кандидаты — совпавшие хотя бы в
+одной полосе подписи, дальше проверка оценки сходства Жаккара.
+Найденный ответ слегка варьируется (vary), чтобы не повторяться дословно.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from ai_cache import normalize
+
+NUM_PERM = 32
+BANDS = 8                 # 8 полос по 4 значения
+ROWS = NUM_PERM // BANDS
+THRESHOLD = 0.7           # минимальное оценочное сходство Жаккара
+MAX_PER_STORE = 5000
+INDEX_FILE = os.getenv("SIMILAR_INDEX_FILE", "")
+
+_MASK = (1 << 61) - 1     # простое Мерсенна для универсального хэширования
+_rng = random.Random(20240501)
+_PERMS = [(_rng.randrange(1, _MASK), _rng.randrange(0, _MASK)) for _ in range(NUM_PERM)]
+
+
+def _shingles(norm: str) -> List[str]:
+    words = norm.split()
+    if len(words) < 3:
+        # короткие отзывы сравниваем по словам, длинные — по парам слов
+        return words
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _h(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") & _MASK
+
+
+def signature(text: str) -> Optional[Tuple[int, ...]]:
+    """
+    MinHash-подпись текста (None — текста нет)
+    """
+    shingles = _shingles(normalize(text))
+    if not shingles:
+        return None
+    hashes = [_h(s) for s in set(shingles)]
+    return tuple(min((a * x + b) % _MASK for x in hashes) for a, b in _PERMS)
+
+
+def similarity(sig1: Tuple[int, ...], sig2: Tuple[int, ...]) -> float:
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / NUM_PERM
+
+
+def _bands(sig: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+    return [(i, sig[i * ROWS:(i + 1) * ROWS]) for i in range(BANDS)]
+
+
+def _same_mood(stars1: int, stars2: int) -> bool:
+    # ответ на 5⭐ не годится для 3⭐: сравниваем только внутри «похвала» / «жалоба»
+    return (stars1 >= 4) == (stars2 >= 4) and abs(stars1 - stars2) <= 1
+
+
+class _StoreIndex:
+    def __init__(self):
+        # id записи -> (подпись, оценка, текст отзыва, ответ)
+        self.entries: "OrderedDict[int, Tuple[Tuple[int, ...], int, str, str]]" = OrderedDict()
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+        self.next_id = 0
+
+    def add(self, sig, stars: int, text: str, answer: str):
+        eid = self.next_id
+        self.next_id += 1
+        self.entries[eid] = (sig, stars, text, answer)
+        for band in _bands(sig):
+            self.buckets.setdefault(band, []).append(eid)
+        while len(self.entries) > MAX_PER_STORE:
+            old_id, (old_sig, _, _, _) = self.entries.popitem(last=False)
+            for band in _bands(old_sig):
+                ids = self.buckets.get(band)
+                if ids:
+                    ids.remove(old_id)
+                    if not ids:
+                        del self.buckets[band]
+
+    def find(self, sig, stars: int) -> Optional[Tuple[float, str]]:
+        best: Optional[Tuple[float, str]] = None
+        seen = set()
+        for band in _bands(sig):
+            for eid in self.buckets.get(band, ()):
+                if eid in seen:
+                    continue
+                seen.add(eid)
+                e_sig, e_stars, _, answer = self.entries[eid]
+                if not _same_mood(stars, e_stars):
+                    continue
+                score = similarity(sig, e_sig)
+                if score >= THRESHOLD and (best is None or score > best[0]):
+                    best = (score, answer)
+        return best
+
+
+_lock = threading.Lock()
+_indexes: Dict[Tuple[int, str], _StoreIndex] = {}
+
+
+def remember(user_id: int, store: str, text: str, stars: int, answer: str):
+    """
+    Запомнить отправленный ответ на отзыв
+    """
+    sig = signature(text)
+    if sig is None or not answer:
+        return
+    with _lock:
+        _indexes.setdefault((user_id, store), _StoreIndex()).add(sig, stars, text, answer)
+
+
+def find(user_id: int, store: str, text: str, stars: int) -> Optional[str]:
+    """
+    Ответ на почти такой же отзыв этого магазина (или None)
+    """
+    sig = signature(text)
+    if sig is None:
+        return None
+    with _lock:
+        index = _indexes.get((user_id, store))
+        hit = index.find(sig, stars) if index else None
+    return hit[1] if hit else None
+
+
+# -------------------------
+# Вариативность
+# -------------------------
+_SYNONYMS = [
+    ("Спасибо за отзыв", "Благодарим за отзыв", "Спасибо за ваш отзыв", "Благодарим вас за отзыв"),
+    ("Спасибо за обратную связь", "Благодарим за обратную связь", "Спасибо, что поделились впечатлениями"),
+    ("Желаем приятных покупок", "Приятных вам покупок", "Хороших покупок", "Ждём вас снова"),
+    ("Нам очень приятно", "Нам очень радостно", "Мы очень рады"),
+]
+
+
+def vary(answer: str, seed: str) -> str:
+    """
+    Та же мысль другими словами: меняем устойчивые фразы на синонимы
+    (детерминированно по seed, например id отзыва)
+    """
+    rnd = random.Random(seed)
+    for group in _SYNONYMS:
+        for phrase in group:
+            if phrase in answer:
+                answer = answer.replace(phrase, rnd.choice(group), 1)
+                break
+    return answer
+
+
+# -------------------------
+# Сохранение на диск
+# -------------------------
+def load(path: Optional[str] = None):
+    path = path or INDEX_FILE
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        logging.exception(f"similar: не удалось прочитать {path}")
+        return
+    for key, items in data.items():
+        user_id, store = key.split(":", 1)
+        for stars, text, answer in items:
+            remember(int(user_id), store, text, stars, answer)
+
+
+def save(path: Optional[str] = None):
+    path = path or INDEX_FILE
+    if not path:
+        return
+    with _lock:
+        data = {
+            f"{uid}:{store}": [[stars, text, answer] for _, stars, text, answer in index.entries.values()]
+            for (uid, store), index in _indexes.items()
+        }
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
@@ -119,6 +119,7 @@ def set_active_store(user_id: int, store_name: str):
 
 
 # ====== CACHE ДЛЯ ОТЗЫВОВ (ТОЛЬКО RAM, БЕЗ JSON) ======
+# reviews внутри страниц — список feedback.Feedback
 _user_pages: Dict[int, Dict[str, Dict[int, Dict[str, Any]]]] = {}
 
 
@@ -205,6 +206,60 @@ def delete_ai_draft(draft_id):
     _ai_drafts.pop(draft_id, None)
 
 
+# ====== ЗАРАНЕЕ СГЕНЕРИРОВАННЫЕ ЧЕРНОВИКИ (prefetch.py) ======
+# user_id -> {review_id: draft_id}
+_prefetched_drafts: Dict[int, Dict[str, str]] = {}
+
+
+def save_prefetched_draft(draft_id, user_id, review_id, text):
+    save_ai_draft(draft_id, user_id, review_id, text)
+    _prefetched_drafts.setdefault(user_id, {})[review_id] = draft_id
+
+
+def has_prefetched_draft(user_id, review_id) -> bool:
+    return review_id in _prefetched_drafts.get(user_id, {})
+
+
+def pop_prefetched_draft(user_id, review_id) -> Optional[str]:
+    """
+    draft_id готового черновика (черновик остаётся в _ai_drafts до отправки)
+    """
+    draft_id = _prefetched_drafts.get(user_id, {}).pop(review_id, None)
+    if draft_id and draft_id in _ai_drafts:
+        return draft_id
+    return None
+
+
+def drop_prefetched_drafts(user_id):
+    # невостребованные черновики ушедшей страницы
+    for draft_id in _prefetched_drafts.pop(user_id, {}).values():
+        _ai_drafts.pop(draft_id, None)
+
+
+def set_ai_prefetch(user_id: int, enabled: bool):
+    db = _load_file()
+    user = db.setdefault(str(user_id), {})
+    user["ai_prefetch"] = bool(enabled)
+    _save_file(db)
+
+
+def get_ai_prefetch(user_id: int) -> bool:
+    return bool(_load_file().get(str(user_id), {}).get("ai_prefetch"))
+
+
+# пороги fastpath.py на магазин: fastpath: { store_name: [min_stars, max_words] }
+def set_fastpath_thresholds(user_id: int, store_name: str, min_stars: int, max_words: int):
+    db = _load_file()
+    user = db.setdefault(str(user_id), {})
+    user.setdefault("fastpath", {})[store_name] = [int(min_stars), int(max_words)]
+    _save_file(db)
+
+
+def get_fastpath_thresholds(user_id: int, store_name: str) -> Optional[Tuple[int, int]]:
+    value = _load_file().get(str(user_id), {}).get("fastpath", {}).get(store_name)
+    return tuple(value) if value else None
+
+
 def delete_store(user_id: int, store_name: str):
     db = _load_file()
     uid = str(user_id)
@@ -391,34 +446,42 @@ def delete_template(user_id: int, template_id: str) -> bool:
 # ---------------------------
 # Автоматизация ответов
 # ---------------------------
+# хранятся в db.json под ключом "auto_settings", чтобы их видел и отдельный процесс worker.py
 # структура: auto_settings: { user_id: { store_name: {stars: {enabled:bool, method: "ai"|"template", template_id: Optional[str]}}}}
-_auto_settings: Dict[str, Dict[str, Dict[int, Dict[str, Any]]]] = {}
+# (в JSON ключ stars — строка, наружу отдаём int)
 # отмеченные как уже обработанные отзывы, чтобы не отвечать дважды:
 _processed_reviews: Dict[str, Dict[str, set]] = {}  # user_id -> store -> set(review_id)
 
 
+def _auto_cfg(db: Dict[str, Any], user_id: int, store: str, stars: int) -> Dict[str, Any]:
+    settings = db.setdefault("auto_settings", {})
+    return settings.setdefault(str(user_id), {}).setdefault(store, {}).setdefault(
+        str(stars), {"enabled": False, "method": "ai", "template_id": None}
+    )
+
+
 def set_auto_toggle(user_id: int, store: str, stars: int, enabled: bool):
-    uid = str(user_id)
-    _auto_settings.setdefault(uid, {}).setdefault(store, {})
-    _auto_settings[uid][store].setdefault(stars, {"enabled": False, "method": "ai", "template_id": None})
-    _auto_settings[uid][store][stars]["enabled"] = bool(enabled)
+    db = _load_file()
+    _auto_cfg(db, user_id, store, stars)["enabled"] = bool(enabled)
+    _save_file(db)
 
 
 def set_auto_method(user_id: int, store: str, stars: int, method: str, template_id: Optional[str] = None):
     # method: "ai" or "template"
-    uid = str(user_id)
-    _auto_settings.setdefault(uid, {}).setdefault(store, {})
-    _auto_settings[uid][store].setdefault(stars, {"enabled": False, "method": "ai", "template_id": None})
-    _auto_settings[uid][store][stars]["method"] = method
-    _auto_settings[uid][store][stars]["template_id"] = template_id
+    db = _load_file()
+    cfg = _auto_cfg(db, user_id, store, stars)
+    cfg["method"] = method
+    cfg["template_id"] = template_id
+    _save_file(db)
 
 
 def get_auto_settings_for_user(user_id: int) -> Dict[str, Dict[int, Dict[str, Any]]]:
-    return _auto_settings.get(str(user_id), {})
+    stores = _load_file().get("auto_settings", {}).get(str(user_id), {})
+    return {store: {int(s): cfg for s, cfg in stars_map.items()} for store, stars_map in stores.items()}
 
 
 def get_auto_setting(user_id: int, store: str, stars: int) -> Optional[Dict[str, Any]]:
-    return _auto_settings.get(str(user_id), {}).get(store, {}).get(stars)
+    return get_auto_settings_for_user(user_id).get(store, {}).get(stars)
 
 
 def mark_review_processed(user_id: int, store: str, review_id: str):
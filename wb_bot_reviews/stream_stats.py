@@ -0,0 +1,210 @@
+# stream_stats.py
+"""
+Агрегаты по отзывам магазина за один проход с ограниченной памятью.
+
+Отзывы приходят страницами и сразу забываются — в памяти только сводки:
+  RunningStats  — число, средняя и дисперсия оценок (Уэлфорд);
+  CountMin      — оценка частот терминов по всему магазину (база для IDF);
+  SpaceSaving   — top-k терминов жалоб (комментарий и недостатки
+                  негативных отзывов) артикула;
+на артикул — распределение оценок и последние SAMPLE_PER_ARTICLE отзывов
+с текстом для AI. Память зависит от числа артикулов, а не отзывов:
+магазин со 100k+ отзывов анализируется целиком без лимита в 1000.
+"""
+import hashlib
+import heapq
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import keywords
+
+NEGATIVE_MAX = 3
+# отзывов с текстом на артикул для AI-выжимки (map-reduce всё равно берёт не больше MAX_MAP_CHUNKS кусков)
+SAMPLE_PER_ARTICLE = 200
+TOP_K = 100
+CMS_WIDTH = 4096
+CMS_DEPTH = 4
+
+
+class RunningStats:
+    __slots__ = ("count", "mean", "_m2")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self) -> float:
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+
+class CountMin:
+    """
+    Count-Min sketch: estimate(x) >= настоящей частоты, ошибка ~ total / width
+    """
+
+    __slots__ = ("width", "depth", "rows", "total")
+
+    def __init__(self, width: int = CMS_WIDTH, depth: int = CMS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+        self.total = 0
+
+    def _cells(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=8 * self.depth).digest()
+        for d in range(self.depth):
+            yield d, int.from_bytes(digest[d * 8:(d + 1) * 8], "little") % self.width
+
+    def add(self, item: str, n: int = 1):
+        self.total += n
+        for d, i in self._cells(item):
+            self.rows[d][i] += n
+
+    def estimate(self, item: str) -> int:
+        return min(self.rows[d][i] for d, i in self._cells(item))
+
+
+class SpaceSaving:
+    """
+    Top-k частых элементов потока (Metwally и др.): не больше k счётчиков,
+    вытесняется минимальный. Для каждого хранится и «как написано».
+    Минимальный ищется по куче, где у каждого элемента одна запись — его
+    счётчик на момент записи (не больше текущего): устаревшую запись с
+    вершины перекладываем с текущим счётчиком, совпавшая — и есть минимум.
+    Инкремент кучу не трогает, вытеснение — O(log k) в среднем.
+    """
+
+    __slots__ = ("k", "counts", "errors", "labels", "_heap")
+
+    def __init__(self, k: int = TOP_K):
+        self.k = k
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.labels: Dict[str, str] = {}
+        self._heap: List[Tuple[int, str]] = []
+
+    def _pop_min(self) -> str:
+        heap, counts = self._heap, self.counts
+        while True:
+            count, item = heap[0]
+            current = counts[item]
+            if count == current:
+                heapq.heappop(heap)
+                return item
+            heapq.heapreplace(heap, (current, item))
+
+    def add(self, item: str, label: Optional[str] = None):
+        if item in self.counts:
+            self.counts[item] += 1
+            return
+        if len(self.counts) < self.k:
+            self.counts[item] = 1
+            self.errors[item] = 0
+        else:
+            victim = self._pop_min()
+            floor = self.counts.pop(victim)
+            self.errors.pop(victim)
+            self.labels.pop(victim, None)
+            self.counts[item] = floor + 1
+            self.errors[item] = floor
+        heapq.heappush(self._heap, (self.counts[item], item))
+        self.labels[item] = label or item
+
+    def top(self, n: int) -> List[Tuple[str, int]]:
+        # гарантированная нижняя оценка частоты: count - error
+        ranked = sorted(self.counts, key=lambda x: self.counts[x] - self.errors[x], reverse=True)
+        return [(x, self.counts[x] - self.errors[x]) for x in ranked[:n]]
+
+
+class ArticleAgg:
+    __slots__ = ("count", "ratings", "distribution", "negative_docs", "complaints", "sample")
+
+    def __init__(self):
+        self.count = 0
+        self.ratings = RunningStats()
+        self.distribution = [0] * 5
+        self.negative_docs = 0
+        self.complaints = SpaceSaving()
+        self.sample: List[Any] = []
+
+
+class StoreAggregator:
+    """
+    add_page(отзывы) по мере загрузки; потом stats() / complaints() / sample()
+    """
+
+    def __init__(self):
+        self.reviews = 0
+        self.ratings = RunningStats()
+        self.terms = CountMin()
+        self.articles: Dict[str, ArticleAgg] = {}
+
+    def add(self, r):
+        self.reviews += 1
+        agg = self.articles.get(r.nm_id or "unknown")
+        if agg is None:
+            agg = self.articles[r.nm_id or "unknown"] = ArticleAgg()
+        agg.count += 1
+        stars = r.valuation or 0
+        if 1 <= stars <= 5:
+            self.ratings.add(stars)
+            agg.ratings.add(stars)
+            agg.distribution[stars - 1] += 1
+        if not r.has_text:
+            return
+        # выборка для AI: отзывы идут от новых к старым — оставляем первые
+        if len(agg.sample) < SAMPLE_PER_ARTICLE:
+            agg.sample.append(r)
+        # фразы — внутри предложения; жалобы — без достоинств (keywords.review_terms)
+        found, complaint = keywords.review_terms(r)
+        for term in found:
+            self.terms.add(term)
+        if 1 <= stars <= NEGATIVE_MAX:
+            agg.negative_docs += 1
+            for term, surface in complaint.items():
+                agg.complaints.add(term, surface)
+
+    def add_page(self, feedbacks):
+        for r in feedbacks:
+            self.add(r)
+
+    def stats(self, article: str) -> Dict[str, Any]:
+        """
+        Та же форма, что у ReviewFrame.article_stats, плюс std
+        """
+        agg = self.articles[article]
+        rated = agg.ratings.count
+        negative = sum(agg.distribution[:NEGATIVE_MAX])
+        return {
+            "count": agg.count,
+            "avg": round(agg.ratings.mean, 2),
+            "std": round(agg.ratings.std, 2),
+            "positive": rated - negative,
+            "negative": negative,
+            "negative_share": negative / rated if rated else 0.0,
+            "distribution": {stars: agg.distribution[stars - 1] for stars in range(1, 6)},
+        }
+
+    def complaints(self, article: str, n: int = 5) -> List[Tuple[str, float]]:
+        """
+        [(фраза, вес)] — частое в негативе артикула и редкое в магазине (оценка IDF по CountMin)
+        """
+        agg = self.articles[article]
+        picked = keywords.rank(agg.complaints.top(TOP_K), agg.negative_docs,
+                               self.reviews, self.terms.estimate, n)
+        return [(agg.complaints.labels[t], s) for t, s in picked]
+
+    def sample(self, article: str) -> list:
+        return list(self.articles[article].sample)
@@ -0,0 +1,262 @@
+# trends.py
+"""
+Динамика оценок по артикулам.
+
+На магазин (ключ — имя профиля продавца) копим дневные сводки:
+(артикул, день) -> число отзывов с оценкой 1..5. Пополняются по мере
+загрузки страниц отзывов (wb_api), каждый отзыв учитывается один раз.
+Храним только последние HORIZON_DAYS дней: старые сводки и id
+учтённых отзывов выбрасываются, так что память зависит от потока
+отзывов за этот срок, а не от всей истории магазина.
+Недельная динамика (средняя, доля негатива) собирается из сводок,
+а не из сырых отзывов. Резкое падение — последняя неделя заметно хуже
+нескольких предыдущих: сравниваются последние 7 дней (до сегодня) с
+BASELINE_WEEKS семидневками перед ними; артикул без отзывов за последние
+7 дней не сравнивается. Если задан TRENDS_FILE — сводки переживают
+перезапуск (JSON) и сохраняются раз в SAVE_INTERVAL секунд (autosave).
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+NEGATIVE_MAX = 3
+# неделя в сравнении, только если в ней хотя бы столько отзывов
+MIN_WEEK_REVIEWS = 5
+# база для сравнения — столько недель перед последней
+BASELINE_WEEKS = 4
+AVG_DROP = 0.5          # падение средней на столько звёзд — тревога
+NEGATIVE_RISE = 0.15    # рост доли негатива на 15 п.п. — тревога
+# сводки и id отзывов старше стольких дней не храним (недельная динамика — 8 недель)
+HORIZON_DAYS = 12 * 7
+TRENDS_FILE = os.getenv("TRENDS_FILE", "")
+SAVE_INTERVAL = 5 * 60  # сек
+
+_EPOCH = date(1970, 1, 1)
+# 1970-01-05 — понедельник: недели считаем с понедельника
+_MONDAY = 4
+
+_lock = threading.Lock()
+# магазин -> артикул -> день (от 1970-01-01) -> [кол-во 1⭐, ..., 5⭐]
+_rollups: Dict[str, Dict[str, Dict[int, List[int]]]] = {}
+# магазин -> id учтённого отзыва -> его день (для вытеснения по HORIZON_DAYS)
+_seen: Dict[str, Dict[str, int]] = {}
+# магазин -> день, на который уже выброшено старое
+_pruned: Dict[str, int] = {}
+_dirty = False
+
+
+def _day(created: str) -> Optional[int]:
+    if not created:
+        return None
+    try:
+        if created.isdigit():
+            n = int(created)
+            seconds = n // 1000 if n > 10 ** 11 else n
+            return seconds // 86400
+        return (date.fromisoformat(created[:10]) - _EPOCH).days
+    except ValueError:
+        return None
+
+
+def _prune(store: str, today: int):
+    # раз в день на магазин: выбросить всё старше HORIZON_DAYS
+    if _pruned.get(store) == today:
+        return
+    _pruned[store] = today
+    oldest = today - HORIZON_DAYS
+    seen = _seen.get(store, {})
+    for rid in [rid for rid, day in seen.items() if day < oldest]:
+        del seen[rid]
+    articles = _rollups.get(store, {})
+    for article in list(articles):
+        days = articles[article]
+        for day in [day for day in days if day < oldest]:
+            del days[day]
+        if not days:
+            del articles[article]
+
+
+def add(store: str, feedbacks, today: Optional[int] = None) -> int:
+    """
+    Учесть новые отзывы магазина; возвращает, сколько добавлено.
+    Отзывы старше HORIZON_DAYS не учитываются
+    """
+    global _dirty
+    today = _today() if today is None else today
+    oldest = today - HORIZON_DAYS
+    added = 0
+    with _lock:
+        _prune(store, today)
+        seen = _seen.setdefault(store, {})
+        articles = _rollups.setdefault(store, {})
+        for r in feedbacks:
+            stars = r.valuation or 0
+            if r.id in seen or not r.nm_id or not 1 <= stars <= 5:
+                continue
+            day = _day(r.created)
+            if day is None or day < oldest:
+                continue
+            seen[r.id] = day
+            articles.setdefault(r.nm_id, {}).setdefault(day, [0] * 5)[stars - 1] += 1
+            added += 1
+        if added:
+            _dirty = True
+    return added
+
+
+def _week_stats(counts: List[int]) -> Dict[str, Any]:
+    total = sum(counts)
+    if not total:
+        return {"count": 0, "avg": None, "negative_share": None}
+    return {
+        "count": total,
+        "avg": sum(c * s for s, c in enumerate(counts, 1)) / total,
+        "negative_share": sum(counts[:NEGATIVE_MAX]) / total,
+    }
+
+
+def weekly(store: str, article: str, weeks: int = 8) -> List[Dict[str, Any]]:
+    """
+    Последние weeks недель с отзывами на артикул (старые раньше):
+    [{start: date, count, avg, negative_share}]; пустая неделя — avg/negative_share None
+    """
+    with _lock:
+        days = dict(_rollups.get(store, {}).get(article, {}))
+    if not days:
+        return []
+    by_week: Dict[int, List[int]] = {}
+    for day, counts in days.items():
+        acc = by_week.setdefault((day - _MONDAY) // 7, [0] * 5)
+        for i in range(5):
+            acc[i] += counts[i]
+    last = max(by_week)
+    result = []
+    for week in range(last - weeks + 1, last + 1):
+        row = _week_stats(by_week.get(week, [0] * 5))
+        row["start"] = _EPOCH + timedelta(days=week * 7 + _MONDAY)
+        result.append(row)
+    # ведущие пустые недели не нужны
+    while result and not result[0]["count"]:
+        result.pop(0)
+    return result
+
+
+def _today() -> int:
+    return (date.today() - _EPOCH).days
+
+
+def drop(store: str, article: str, today: Optional[int] = None) -> Optional[str]:
+    """
+    Описание резкого ухудшения за последние 7 дней или None.
+    today — номер дня от 1970-01-01 (по умолчанию — сегодня)
+    """
+    today = _today() if today is None else today
+    with _lock:
+        days = dict(_rollups.get(store, {}).get(article, {}))
+    # давно нет отзывов — сравнивать нечего, старые данные не тревожат
+    if not days or max(days) <= today - 7:
+        return None
+
+    def window(k: int) -> Dict[str, Any]:
+        # k-я семидневка назад: k=0 — последние 7 дней включая сегодня
+        acc = [0] * 5
+        for day in range(today - 7 * k - 6, today - 7 * k + 1):
+            counts = days.get(day)
+            if counts:
+                for i in range(5):
+                    acc[i] += counts[i]
+        return _week_stats(acc)
+
+    current = window(0)
+    base_rows = [row for row in (window(k) for k in range(1, BASELINE_WEEKS + 1)) if row["count"]]
+    base_count = sum(r["count"] for r in base_rows)
+    if current["count"] < MIN_WEEK_REVIEWS or base_count < MIN_WEEK_REVIEWS:
+        return None
+    base_avg = sum(r["avg"] * r["count"] for r in base_rows) / base_count
+    base_neg = sum(r["negative_share"] * r["count"] for r in base_rows) / base_count
+    if base_avg - current["avg"] >= AVG_DROP:
+        return f"средняя упала с {base_avg:.1f} до {current['avg']:.1f}"
+    if current["negative_share"] - base_neg >= NEGATIVE_RISE:
+        return f"доля негатива выросла с {base_neg:.0%} до {current['negative_share']:.0%}"
+    return None
+
+
+def drops(store: str) -> Dict[str, str]:
+    """
+    {артикул: что случилось} по всем артикулам магазина с резким ухудшением
+    """
+    with _lock:
+        articles = list(_rollups.get(store, {}))
+    result = {}
+    for article in articles:
+        reason = drop(store, article)
+        if reason:
+            result[article] = reason
+    return result
+
+
+# -------------------------
+# Сохранение на диск
+# -------------------------
+def load(path: Optional[str] = None):
+    path = path or TRENDS_FILE
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        logging.exception(f"trends: не удалось прочитать {path}")
+        return
+    with _lock:
+        for store, item in data.items():
+            seen = item["seen"]
+            # старый формат — список id без дней: считаем их сегодняшними, уйдут через HORIZON_DAYS
+            if isinstance(seen, list):
+                seen = dict.fromkeys(seen, _today())
+            _seen.setdefault(store, {}).update(seen)
+            _pruned.pop(store, None)
+            articles = _rollups.setdefault(store, {})
+            for article, days in item["rollups"].items():
+                for day, counts in days.items():
+                    acc = articles.setdefault(article, {}).setdefault(int(day), [0] * 5)
+                    for i in range(5):
+                        acc[i] += counts[i]
+
+
+def save(path: Optional[str] = None):
+    global _dirty
+    path = path or TRENDS_FILE
+    if not path:
+        return
+    with _lock:
+        _dirty = False
+        data = {
+            store: {"seen": _seen.get(store, {}), "rollups": articles}
+            for store, articles in _rollups.items()
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+async def autosave(stop_event: asyncio.Event, interval: float = SAVE_INTERVAL):
+    """
+    Сохранять сводки раз в interval секунд, пока не выставлен stop_event:
+    без этого всё накопленное после старта теряется, если процесс упадёт
+    """
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+        if _dirty:
+            try:
+                await asyncio.to_thread(save)
+            except Exception:
+                logging.exception("trends: не удалось сохранить сводки")
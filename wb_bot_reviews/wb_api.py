@@ -1,15 +1,142 @@
 # wb_api.py
-import requests
-from typing import Tuple, Any, List, Optional
-import json
+# Модуль не тянет aiogram/handlers: его можно импортировать из воркера или CLI.
+# requests импортируется лениво — при первом запросе (_requests()).
+from typing import Tuple, Any, List, Optional, TYPE_CHECKING
+import os
 from storage import get_profile_data, SELLER_PROFILES
 import storage
-import handlers
 import logging
+import time
+from urllib.parse import urlsplit
+from breaker import get_breaker, CircuitOpenError
+import breaker
+import metrics
+import article_index
+from wb_json import parse_feedbacks_page, iter_response
+from feedback import Feedback
+
+if TYPE_CHECKING:
+    import requests
+
+
+# WB_STUB_URL=http://127.0.0.1:8080 — все запросы уходят на локальный стенд (wb_stub.py)
+_STUB = os.getenv("WB_STUB_URL", "").rstrip("/")
+FEEDBACKS_HOST = _STUB or "https://feedbacks-api.wildberries.ru"
+SUPPLIERS_HOST = _STUB or "https://suppliers-api.wildberries.ru"
+SELLER_SERVICES_HOST = _STUB or "https://seller-services.wildberries.ru"
+PORTAL_API = f"{SELLER_SERVICES_HOST}/ns/fa-seller-api/reviews-ext-seller-portal/api"
+
+BASE = f"{FEEDBACKS_HOST}/api/v1/feedbacks"
+TIMEOUT = 30
+# на установку соединения даём меньше — мёртвый хост должен отваливаться быстро
+CONNECT_TIMEOUT = 5
+
+# спец-метка: WB недоступен (breaker открыт), запрос не отправлялся
+WB_UNAVAILABLE = "WB_UNAVAILABLE"
+WB_UNAVAILABLE_STATUS = -2
+
+
+def _requests():
+    import requests
+    return requests
+
+
+def _accept_encoding() -> str:
+    # urllib3 сам знает, что умеет распаковать: gzip/deflate + br при установленном brotli
+    from urllib3.util.request import ACCEPT_ENCODING
+    return ACCEPT_ENCODING
+
+
+def _request(method: str, url: str, endpoint: str, profile: Optional[str] = None,
+             **kwargs) -> "requests.Response":
+    """
+    Единая точка выхода в WB: таймауты по умолчанию + circuit breaker по хосту.
+    5xx и сетевые ошибки считаются отказом хоста, при открытом breaker
+    сразу кидаем CircuitOpenError без похода в сеть.
+    endpoint/profile — метки для метрик (metrics.py). Потоковый ответ
+    (stream=True) в метрики пишет вызывающий, дочитав тело (_observe).
+    """
+    host = urlsplit(url).netloc
+    br = get_breaker(host)
+    if not br.allow():
+        metrics.inc("wb_circuit_rejected_total", {"endpoint": endpoint, "profile": profile or "-"})
+        raise CircuitOpenError(host)
+
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, TIMEOUT))
+    requests = _requests()
+    kwargs["headers"] = {"Accept-Encoding": _accept_encoding(), **(kwargs.get("headers") or {})}
+    started = time.perf_counter()
+    try:
+        r = requests.request(method, url, **kwargs)
+    except requests.RequestException:
+        br.record_failure()
+        metrics.observe_http("wb", endpoint, profile, 0, time.perf_counter() - started)
+        raise
+    except BaseException:
+        # не сетевая ошибка (параметры, прерывание) — хост ни при чём, но проба не должна зависнуть
+        br.release()
+        raise
+
+    if r.status_code >= 500:
+        br.record_failure()
+    else:
+        br.record_success()
+
+    if not kwargs.get("stream"):
+        _observe(r, endpoint, profile, started)
+    return r
+
+
+def _observe(r: "requests.Response", endpoint: str, profile: Optional[str], started: float):
+    """
+    Метрики ответа WB. Для потокового ответа — после того, как тело прочитано:
+    иначе в задержку не попадёт скачивание, а размер будет неизвестен
+    """
+    # Content-Length — размер на проводе (со сжатием); без него — сколько
+    # прочитано из сокета (urllib3 tell()), в крайнем случае — длина тела
+    resp_bytes = r.headers.get("Content-Length")
+    if resp_bytes and resp_bytes.isdigit():
+        resp_bytes = int(resp_bytes)
+    elif hasattr(r.raw, "tell"):
+        resp_bytes = r.raw.tell()
+    else:
+        resp_bytes = len(r.content)
+    metrics.observe_http(
+        "wb", endpoint, profile, r.status_code, time.perf_counter() - started,
+        request_bytes=len(r.request.body or b""),
+        response_bytes=resp_bytes,
+    )
+
+
+def _get_feedbacks_page(url: str, endpoint: str, profile: Optional[str] = None,
+                        **kwargs) -> Tuple[int, List[Any], dict]:
+    """
+    GET страницы отзывов с потоковым разбором (wb_json.py): отзывы урезаются
+    до нужных полей по мере чтения, полный JSON страницы в памяти не собирается.
+    Возвращает (status, список Feedback, остальные поля data — cursor и т.п.).
+    """
+    started = time.perf_counter()
+    r = _request("GET", url, endpoint, profile, stream=True, **kwargs)
+    try:
+        if r.status_code != 200:
+            return r.status_code, [], {"text": r.text}
+        items, meta = parse_feedbacks_page(iter_response(r))
+        return 200, items, meta
+    finally:
+        # тело прочитано (или брошено) — теперь задержка и размер честные
+        _observe(r, endpoint, profile, started)
+        r.close()
 
 
-BASE = "https://feedbacks-api.wildberries.ru/api/v1/feedbacks"
-TIMEOUT = 30
+def is_wb_available() -> bool:
+    """
+    False, если хоть один хост WB сейчас в состоянии open
+    """
+    return all(st["state"] != breaker.OPEN for st in breaker.snapshot().values())
+
+
+def wb_health():
+    return breaker.snapshot()
 
 
 def _headers(token: str):
@@ -22,30 +149,30 @@ def _headers(token: str):
 
 def get_reviews(token: str):
     try:
-        r = requests.get(
+        status, feedbacks, meta = _get_feedbacks_page(
             BASE,
+            "feedbacks.list",
             headers=_headers(token),
             params={"isAnswered": "false", "take": 200, "skip": 0},
-            timeout=TIMEOUT
         )
+    except CircuitOpenError:
+        return WB_UNAVAILABLE_STATUS, WB_UNAVAILABLE
     except Exception as e:
         return 0, str(e)
 
-    try:
-        data = r.json()
-    except:
-        return r.status_code, r.text
+    if status != 200:
+        return status, meta.get("text")
 
-    return r.status_code, data
+    return status, {"data": {**meta, "feedbacks": feedbacks}}
 
 
-def get_reviews_by_stars(token: str, stars: int) -> Tuple[int, List[Any]]:
+def get_reviews_by_stars(token: str, stars: int) -> Tuple[int, List[Feedback]]:
     status, data = get_reviews(token)
     if status != 200:
         return status, data
 
     arr = data.get("data", {}).get("feedbacks", [])
-    filtered = [r for r in arr if (r.get("productValuation") or 0) == stars]
+    filtered = [r for r in arr if r.valuation == stars]
     return 200, filtered
 
 
@@ -59,9 +186,11 @@ def send_reply(token: str, review_id: str, text: str):
         f"{BASE}/{review_id}/reply"
     ]
 
-    for url in urls:
+    for attempt, url in enumerate(urls):
+        if attempt:
+            metrics.record_retry("wb", "feedbacks.answer")
         try:
-            r = requests.post(url, headers=headers, json=body, timeout=TIMEOUT)
+            r = _request("POST", url, "feedbacks.answer", headers=headers, json=body)
             try:
                 data = r.json()
             except:
@@ -71,6 +200,8 @@ def send_reply(token: str, review_id: str, text: str):
                 return r.status_code, data
             return r.status_code, data
 
+        except CircuitOpenError:
+            return WB_UNAVAILABLE_STATUS, WB_UNAVAILABLE
         except Exception as e:
             last = str(e)
 
@@ -79,14 +210,16 @@ def send_reply(token: str, review_id: str, text: str):
 
 # Получить supplier_id по API-ключу
 def get_supplier_id_by_key(token: str) -> Tuple[int, Optional[str]]:
-    url = "https://suppliers-api.wildberries.ru/api/v3/suppliers"
+    url = f"{SUPPLIERS_HOST}/api/v3/suppliers"
 
     try:
-        r = requests.get(url, headers=_headers(token), timeout=TIMEOUT)
+        r = _request("GET", url, "suppliers", headers=_headers(token))
+    except CircuitOpenError:
+        return WB_UNAVAILABLE_STATUS, None
     except Exception as e:
         return 0, str(e)
 
-    print("SUPPLIER DEBUG:", r.status_code, r.text)   # ← лог
+    logging.debug("SUPPLIER DEBUG: %s %s", r.status_code, r.text)
 
     if r.status_code != 200:
         return r.status_code, None
@@ -116,7 +249,7 @@ def send_reply_with_profile(profile_name: str, review_id: str, answer_text: str)
     authorize_v3 = profile.get("authorize_v3")
     cookies = profile.get("cookies", {})
 
-    url = "https://seller-services.wildberries.ru/ns/fa-seller-api/reviews-ext-seller-portal/api/v2/feedbacks/answer"
+    url = f"{PORTAL_API}/v2/feedbacks/answer"
 
     headers = {
         "Accept": "application/json, text/plain, */*",
@@ -135,7 +268,8 @@ def send_reply_with_profile(profile_name: str, review_id: str, answer_text: str)
     }
 
     try:
-        resp = requests.post(url, headers=headers, cookies=cookies, json=data, timeout=TIMEOUT)
+        resp = _request("POST", url, "portal.feedbacks.answer", profile_name,
+                        headers=headers, cookies=cookies, json=data)
         try:
             body = resp.json()
         except Exception:
@@ -146,6 +280,8 @@ def send_reply_with_profile(profile_name: str, review_id: str, answer_text: str)
 
         return resp.status_code, body
 
+    except CircuitOpenError:
+        return WB_UNAVAILABLE_STATUS, WB_UNAVAILABLE
     except Exception as e:
         return 0, str(e)
 
@@ -164,7 +300,7 @@ def get_last_reviews_with_profile(profile_name: str, max_reviews: int = 1000):
     if not cookies or not auth:
         return 0, {"error": "no cookies or authorize_v3"}
 
-    url = "https://seller-services.wildberries.ru/ns/fa-seller-api/reviews-ext-seller-portal/api/v2/feedbacks"
+    url = f"{PORTAL_API}/v2/feedbacks"
 
     headers = {
         "accept": "*/*",
@@ -185,12 +321,13 @@ def get_last_reviews_with_profile(profile_name: str, max_reviews: int = 1000):
                 "valuations": [1, 2, 3, 4, 5],
             }
             try:
-                r = requests.get(url, headers=headers, cookies=cookies, params=params)
-                if r.status_code != 200:
+                status, batch_items, data = _get_feedbacks_page(
+                    url, "portal.feedbacks", profile_name,
+                    headers=headers, cookies=cookies, params=params
+                )
+                if status != 200:
                     break
 
-                data = r.json().get("data", {})
-                batch_items = data.get("feedbacks", [])
                 if not batch_items:
                     break
 
@@ -207,25 +344,102 @@ def get_last_reviews_with_profile(profile_name: str, max_reviews: int = 1000):
                     items = items[:max_count]
                     break
 
+            except CircuitOpenError:
+                # WB лежит: если ничего не успели получить — отдаём наверх
+                if not items:
+                    raise
+                break
             except Exception as e:
                 logging.exception(f"Ошибка при запросе WB API для is_answered={is_answered}")
                 break
         return items
 
     # Получаем отзывы обоих типов с пагинацией
-    not_answered = fetch_all("false", max_reviews)
-    answered = fetch_all("true", max_reviews - len(not_answered))
+    try:
+        not_answered = fetch_all("false", max_reviews)
+    except CircuitOpenError:
+        return WB_UNAVAILABLE_STATUS, {"error": WB_UNAVAILABLE}
+    try:
+        answered = fetch_all("true", max_reviews - len(not_answered))
+    except CircuitOpenError:
+        # WB лёг между запросами — уже полученные неотвеченные не выбрасываем
+        if not not_answered:
+            return WB_UNAVAILABLE_STATUS, {"error": WB_UNAVAILABLE}
+        answered = []
     all_reviews = not_answered + answered
 
     # Сортируем по дате (новые сначала)
     try:
-        all_reviews.sort(key=lambda r: r.get("createdDate") or "", reverse=True)
+        all_reviews.sort(key=lambda r: r.created, reverse=True)
     except:
         pass
 
     return 200, {"data": {"feedbacks": all_reviews}}
 
 
+def iter_feedback_pages(profile_name: str, is_answered: str = "all", max_reviews: Optional[int] = None):
+    """
+    Отзывы магазина страницами по 100, новые первыми, без общего списка в памяти:
+    страница отдаётся и забывается. max_reviews=None — все отзывы.
+    CircuitOpenError — WB недоступен ещё до первой страницы.
+    Значение генератора (StopIteration.value): True — прочитано до конца
+    (или до max_reviews), False — WB перестал отвечать на середине и
+    отзывы прочитаны не все.
+    """
+    profile = storage.get_profile_data(profile_name)
+    cookies = (profile or {}).get("cookies", {})
+    auth = (profile or {}).get("authorize_v3")
+    if not cookies or not auth:
+        return
+
+    url = f"{PORTAL_API}/v2/feedbacks"
+    headers = {
+        "accept": "*/*",
+        "content-type": "application/json",
+        "authorizev3": auth,
+        "user-agent": "Mozilla/5.0"
+    }
+
+    seen = 0
+    cursor = ""
+    while max_reviews is None or seen < max_reviews:
+        params = {
+            "cursor": cursor,
+            "isAnswered": is_answered,
+            "limit": "100",
+            "sortOrder": "dateDesc",
+            "valuations": [1, 2, 3, 4, 5],
+        }
+        try:
+            status, items, data = _get_feedbacks_page(
+                url, "portal.feedbacks", profile_name,
+                headers=headers, cookies=cookies, params=params
+            )
+        except CircuitOpenError:
+            if not seen:
+                raise
+            logging.warning(f"WB недоступен после {seen} отзывов профиля {profile_name}")
+            return False
+        except Exception:
+            logging.exception("Ошибка при запросе WB API")
+            return False
+        if status != 200:
+            logging.warning(f"WB вернул {status} после {seen} отзывов профиля {profile_name}")
+            return False
+        if not items:
+            return True
+        if max_reviews is not None:
+            items = items[:max_reviews - seen]
+        seen += len(items)
+        yield items
+
+        new_cursor = data.get("cursor")
+        if not new_cursor or new_cursor == cursor:
+            return True
+        cursor = new_cursor
+    return True
+
+
 def get_all_reviews_by_article(profile_name: str, article: str = None, max_reviews: int = 1000):
     profile = storage.get_profile_data(profile_name)
     if not profile:
@@ -236,7 +450,7 @@ def get_all_reviews_by_article(profile_name: str, article: str = None, max_revie
     if not cookies or not auth:
         return 0, {"error": "no cookies or authorize_v3"}
 
-    url = "https://seller-services.wildberries.ru/ns/fa-seller-api/reviews-ext-seller-portal/api/v2/feedbacks"
+    url = f"{PORTAL_API}/v2/feedbacks"
     headers = {
         "accept": "*/*",
         "content-type": "application/json",
@@ -255,15 +469,13 @@ def get_all_reviews_by_article(profile_name: str, article: str = None, max_revie
             "valuations": [1,2,3,4,5],
         }
         try:
-            r = requests.get(url, headers=headers, cookies=cookies, params=params)
-            if r.status_code != 200:
-                break
-
-            data = r.json().get("data")
-            if not data:
+            status, items, data = _get_feedbacks_page(
+                url, "portal.feedbacks", profile_name,
+                headers=headers, cookies=cookies, params=params
+            )
+            if status != 200:
                 break
 
-            items = data.get("feedbacks", [])
             if not items:
                 break
 
@@ -276,14 +488,21 @@ def get_all_reviews_by_article(profile_name: str, article: str = None, max_revie
             if not new_cursor or new_cursor == cursor:
                 break
             cursor = new_cursor
+        except CircuitOpenError:
+            if not all_items:
+                return WB_UNAVAILABLE_STATUS, {"error": WB_UNAVAILABLE}
+            break
         except Exception as e:
             logging.exception("Ошибка при запросе WB API")
             break
 
-    # Фильтруем по артикулу, если указан
+    # Фильтруем по артикулу (nmId или артикул продавца), если указан
     if article:
-        filtered = [r for r in all_items if str(handlers._get_article_from_review(r)) == str(article)]
-        all_items = filtered[:max_reviews]
+        index = article_index.ArticleIndex()
+        for r in all_items:
+            index.add(r)
+        canonical = index.canonical(str(article))
+        all_items = [r for r in all_items if r.nm_id == canonical] if canonical else []
 
     return 200, {"data": {"feedbacks": all_items}}
 
@@ -298,7 +517,7 @@ def get_unanswered_questions(profile_name):
     if not authorize or not cookies:
         return False, "missing_credentials"
 
-    url = "https://seller-services.wildberries.ru/ns/fa-seller-api/reviews-ext-seller-portal/api/v1/questions"
+    url = f"{PORTAL_API}/v1/questions"
 
     headers = {
         "authorizev3": authorize,
@@ -314,7 +533,8 @@ def get_unanswered_questions(profile_name):
     }
 
     try:
-        r = requests.get(url, headers=headers, cookies=cookies, params=params, timeout=30)
+        r = _request("GET", url, "portal.questions", profile_name,
+                     headers=headers, cookies=cookies, params=params)
         j = r.json()
 
         data = j.get("data", {})
@@ -326,6 +546,8 @@ def get_unanswered_questions(profile_name):
             "total_unanswered": total_unanswered
         }
 
+    except CircuitOpenError:
+        return False, WB_UNAVAILABLE
     except Exception as e:
         return False, str(e)
 
@@ -337,7 +559,7 @@ def send_question_answer(profile_name: str, question_id: str, answer_text: str)
 
     authorize_v3 = profile.get("authorize_v3")
     cookies = profile.get("cookies", {})
-    url = "https://seller-services.wildberries.ru/ns/fa-seller-api/reviews-ext-seller-portal/api/v1/questions/answer"
+    url = f"{PORTAL_API}/v1/questions/answer"
 
     headers = {
         "Accept": "application/json, text/plain, */*",
@@ -355,12 +577,13 @@ def send_question_answer(profile_name: str, question_id: str, answer_text: str)
     }
 
     try:
-        resp = requests.patch(url, headers=headers, cookies=cookies, json=data, timeout=TIMEOUT)
+        resp = _request("PATCH", url, "portal.questions.answer", profile_name,
+                        headers=headers, cookies=cookies, json=data)
 
         # Логи для отладки
-        print(f"[QUESTION ANSWER] Status: {resp.status_code}")
-        print(f"[QUESTION ANSWER] Request data: {data}")
-        print(f"[QUESTION ANSWER] Response: {resp.text[:500]}")
+        logging.debug("[QUESTION ANSWER] Status: %s", resp.status_code)
+        logging.debug("[QUESTION ANSWER] Request data: %s", data)
+        logging.debug("[QUESTION ANSWER] Response: %s", resp.text[:500])
 
         try:
             body = resp.json()
@@ -372,8 +595,10 @@ def send_question_answer(profile_name: str, question_id: str, answer_text: str)
 
         return resp.status_code, body
 
+    except CircuitOpenError:
+        return WB_UNAVAILABLE_STATUS, WB_UNAVAILABLE
     except Exception as e:
-        print(f"[QUESTION ANSWER] Exception: {e}")
+        logging.warning("[QUESTION ANSWER] Exception: %s", e)
         return 0, str(e)
 
 
@@ -385,7 +610,7 @@ def mark_question_as_viewed(profile_name: str, question_id: str) -> Tuple[int, A
     authorize_v3 = profile.get("authorize_v3")
     cookies = profile.get("cookies", {})
 
-    url = "https://seller-services.wildberries.ru/ns/fa-seller-api/reviews-ext-seller-portal/api/v1/questions/viewed"
+    url = f"{PORTAL_API}/v1/questions/viewed"
 
     headers = {
         "Accept": "application/json",
@@ -397,7 +622,10 @@ def mark_question_as_viewed(profile_name: str, question_id: str) -> Tuple[int, A
     data = {"id": question_id}
 
     try:
-        resp = requests.patch(url, headers=headers, cookies=cookies, json=data, timeout=TIMEOUT)
+        resp = _request("PATCH", url, "portal.questions.viewed", profile_name,
+                        headers=headers, cookies=cookies, json=data)
         return resp.status_code, resp.text
+    except CircuitOpenError:
+        return WB_UNAVAILABLE_STATUS, WB_UNAVAILABLE
     except Exception as e:
         return 0, str(e)
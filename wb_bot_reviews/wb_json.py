@@ -0,0 +1,139 @@
+# wb_json.py
+"""
+Потоковый разбор страниц отзывов WB.
+
+Страница seller-services на 100 отзывов весит сотни килобайт (productInfo,
+фото, wbUserDetails...), а боту из каждого отзыва нужны считанные поля.
+Вместо r.json() читаем тело кусками и декодируем отзывы по одному:
+в памяти одновременно лежит только один «полный» отзыв, остальные
+сразу превращаются в компактный Feedback (feedback.py).
+"""
+import codecs
+import json
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from feedback import normalize_feedback
+
+CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+_WS = " \t\n\r"
+
+
+class _Stream:
+    """
+    Буфер поверх итератора байтовых кусков с инкрементальным UTF-8 декодером
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._it = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        # выкидываем уже разобранное, чтобы буфер не рос
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        for chunk in self._it:
+            if chunk:
+                self.buf += self._utf8.decode(chunk)
+                return True
+        self.buf += self._utf8.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, ch: str):
+        if self.peek() != ch:
+            raise ValueError(f"ожидался {ch!r} в позиции {self.pos}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # число могло оборваться на границе куска — дочитываем и пробуем снова
+            if end >= len(self.buf) and not self.eof:
+                self.fill()
+                continue
+            self.pos = end
+            return obj
+
+
+def parse_feedbacks_page(chunks: Iterable[bytes],
+                         project: Callable[[Dict[str, Any]], Any] = normalize_feedback,
+                         list_key: str = "feedbacks") -> Tuple[List[Any], Dict[str, Any]]:
+    """
+    Разбирает ответ вида {"data": {"feedbacks": [...], "cursor": ..., ...}, ...}.
+    Возвращает (отзывы после project, остальные поля data — cursor, счётчики и т.п.).
+    Если data = null или массива нет — пустой список.
+    """
+    s = _Stream(chunks)
+    items: List[Any] = []
+    meta: Dict[str, Any] = {}
+
+    def walk_object(depth: int, path: Tuple[str, ...]):
+        s.expect("{")
+        if s.peek() == "}":
+            s.pos += 1
+            return
+        while True:
+            key = s.value()
+            s.expect(":")
+            sub = path + (key,)
+            nxt = s.peek()
+            if sub == ("data",) and nxt == "{":
+                walk_object(depth + 1, sub)
+            elif sub == ("data", list_key) and nxt == "[":
+                s.pos += 1
+                if s.peek() == "]":
+                    s.pos += 1
+                else:
+                    while True:
+                        items.append(project(s.value()))
+                        c = s.peek()
+                        s.pos += 1
+                        if c == "]":
+                            break
+                        if c != ",":
+                            raise ValueError(f"битый массив {list_key} в позиции {s.pos}")
+            else:
+                val = s.value()
+                if len(sub) == 2 and sub[0] == "data":
+                    meta[key] = val
+            c = s.peek()
+            s.pos += 1
+            if c == "}":
+                return
+            if c != ",":
+                raise ValueError(f"битый объект в позиции {s.pos}")
+
+    if s.peek() != "{":
+        raise ValueError("ответ WB не является JSON-объектом")
+    walk_object(0, ())
+    return items, meta
+
+
+def iter_response(r, chunk_size: int = CHUNK_SIZE) -> Iterable[bytes]:
+    """
+    Куски уже распакованного (gzip/br) тела ответа requests с stream=True
+    """
+    return r.iter_content(chunk_size=chunk_size)
@@ -0,0 +1,477 @@
+# wb_stub.py
+"""
+Локальный стенд WB API для бенчмарков и регрессии без похода в настоящий WB.
+
+Эмулирует эндпоинты, которыми пользуется wb_api.py:
+  GET   /api/v1/feedbacks                         — публичный список отзывов
+  POST  /api/v1/feedbacks/{id}/answer             — ответ через API-ключ
+  GET   /api/v3/suppliers                         — supplier_id по ключу
+  GET   {PORTAL}/v2/feedbacks                     — отзывы с курсорами
+  POST  {PORTAL}/v2/feedbacks/answer              — ответ через профиль
+  GET   {PORTAL}/v1/questions                     — вопросы
+  PATCH {PORTAL}/v1/questions/answer, /viewed
+
+Режимы:
+  synthetic (по умолчанию) — детерминированные данные по --seed
+  --record DIR             — проксирует в настоящий WB и сохраняет очищенные ответы
+  --replay DIR             — отдаёт ранее записанные ответы
+
+Запуск бота против стенда:
+  python wb_stub.py --port 8080 --volume 5000 --latency 150 --error-rate 0.05
+  WB_STUB_URL=http://127.0.0.1:8080 python bot.py
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+PORTAL = "/ns/fa-seller-api/reviews-ext-seller-portal/api"
+
+# откуда брать ответы в режиме --record
+UPSTREAMS = {
+    "/api/v1/feedbacks": "https://feedbacks-api.wildberries.ru",
+    "/api/v3/suppliers": "https://suppliers-api.wildberries.ru",
+    "/ns/": "https://seller-services.wildberries.ru",
+}
+
+# что вырезаем из записанных ответов (персональные данные и ссылки)
+SENSITIVE_KEYS = {
+    "userName", "wbUserDetails", "photo", "photos", "photoLinks", "video",
+    "phone", "email", "supplierName", "x-supplier-id-external",
+}
+
+# заголовки, которые не пробрасываем наверх при записи
+HOP_HEADERS = {"host", "content-length", "connection", "accept-encoding"}
+
+_TEXTS = [
+    "Все супер, спасибо!", "Размер соответствует", "Качество отличное, рекомендую",
+    "Пришло с браком, шов разошёлся", "Цвет не как на фото", "Маломерит на размер",
+    "Доставка быстрая, упаковка целая", "Ткань тонкая, просвечивает",
+    "Очень понравилось, возьму ещё", "Запах химии, пришлось стирать", "",
+]
+_PROS = ["Цена", "Качество", "Удобно сидит", "Красивый цвет", "", ""]
+_CONS = ["Маломерит", "Тонкий материал", "Нитки торчат", "", "", ""]
+_NAMES = ["Анна", "Мария", "Иван", "Ольга", "Покупатель", "Елена"]
+_QUESTIONS = [
+    "Какой состав ткани?", "Подойдёт ли на рост 170?", "Есть ли другие цвета?",
+    "Можно стирать в машинке?", "Какая длина изделия?",
+]
+
+
+class StubConfig:
+    def __init__(self, volume=1000, questions=50, latency_ms=0.0, jitter_ms=0.0,
+                 error_rate=0.0, rate_429=0.0, articles=40, seed=1,
+                 replay_dir: Optional[str] = None, record_dir: Optional[str] = None):
+        self.volume = volume
+        self.questions = questions
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.articles = articles
+        self.seed = seed
+        self.replay_dir = replay_dir
+        self.record_dir = record_dir
+
+
+# -------------------------
+# Синтетические данные
+# -------------------------
+class StubData:
+    """
+    Детерминированный набор отзывов/вопросов. Отзыв i всегда одинаковый
+    при одном и том же seed, поэтому курсоры и пагинацию можно сравнивать между прогонами.
+    """
+
+    def __init__(self, cfg: StubConfig):
+        self.cfg = cfg
+        self._answered = set()
+        self._lock = threading.Lock()
+        self._base_date = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        # каждый третий отзыв изначально отвечен
+        self._initially_answered = {i for i in range(cfg.volume) if i % 3 == 0}
+
+    def _rnd(self, i: int, salt: str = "") -> random.Random:
+        return random.Random(f"{self.cfg.seed}:{salt}:{i}")
+
+    def feedback_id(self, i: int) -> str:
+        return hashlib.md5(f"{self.cfg.seed}:fb:{i}".encode()).hexdigest()[:20]
+
+    def is_answered(self, i: int) -> bool:
+        with self._lock:
+            return i in self._initially_answered or self.feedback_id(i) in self._answered
+
+    def mark_answered(self, feedback_id: str):
+        with self._lock:
+            self._answered.add(str(feedback_id))
+
+    def _raw(self, i: int) -> Dict[str, Any]:
+        rnd = self._rnd(i)
+        art_no = rnd.randrange(self.cfg.articles)
+        # отзывы идут от новых к старым
+        created = self._base_date - timedelta(minutes=37 * i)
+        return {
+            "id": self.feedback_id(i),
+            "valuation": rnd.choices([1, 2, 3, 4, 5], weights=[1, 1, 2, 4, 12])[0],
+            "text": rnd.choice(_TEXTS),
+            "pros": rnd.choice(_PROS),
+            "cons": rnd.choice(_CONS),
+            "name": rnd.choice(_NAMES),
+            "nm_id": 100000000 + art_no * 7919,
+            "supplier_article": f"ART-{art_no:04d}",
+            "product_name": f"Товар {art_no}",
+            "created": created.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+
+    def portal_feedback(self, i: int) -> Dict[str, Any]:
+        raw = self._raw(i)
+        answered = self.is_answered(i)
+        return {
+            "id": raw["id"],
+            "createdDate": raw["created"],
+            "productValuation": raw["valuation"],
+            "feedbackInfo": {
+                "feedbackText": raw["text"],
+                "feedbackTextPros": raw["pros"],
+                "feedbackTextCons": raw["cons"],
+                "photos": [f"https://example.invalid/photo/{raw['id']}/{n}.jpg" for n in range(i % 3)],
+            },
+            "productInfo": {
+                "wbArticle": raw["nm_id"],
+                "supplierArticle": raw["supplier_article"],
+                "name": raw["product_name"],
+                "brand": "Stub",
+                "category": "Одежда",
+            },
+            "wbUserDetails": {"name": raw["name"], "country": "ru"},
+            "answerInfo": {"answerText": "Спасибо за отзыв!"} if answered else None,
+            "isAnswered": answered,
+        }
+
+    def public_feedback(self, i: int) -> Dict[str, Any]:
+        raw = self._raw(i)
+        return {
+            "id": raw["id"],
+            "text": raw["text"],
+            "pros": raw["pros"],
+            "cons": raw["cons"],
+            "productValuation": raw["valuation"],
+            "createdDate": raw["created"],
+            "answer": {"text": "Спасибо за отзыв!"} if self.is_answered(i) else None,
+            "productDetails": {
+                "nmId": raw["nm_id"],
+                "supplierArticle": raw["supplier_article"],
+                "productName": raw["product_name"],
+                "brandName": "Stub",
+            },
+            "userName": raw["name"],
+            "photoLinks": [],
+        }
+
+    def indices(self, is_answered: str) -> List[int]:
+        idx = range(self.cfg.volume)
+        if is_answered == "true":
+            return [i for i in idx if self.is_answered(i)]
+        if is_answered == "false":
+            return [i for i in idx if not self.is_answered(i)]
+        return list(idx)
+
+    def question(self, i: int) -> Dict[str, Any]:
+        rnd = self._rnd(i, "q")
+        art_no = rnd.randrange(self.cfg.articles)
+        created = self._base_date - timedelta(hours=5 * i)
+        return {
+            "id": hashlib.md5(f"{self.cfg.seed}:q:{i}".encode()).hexdigest()[:20],
+            "createdDate": int(created.timestamp() * 1000),
+            "questionInfo": {"text": rnd.choice(_QUESTIONS), "userName": rnd.choice(_NAMES)},
+            "productInfo": {
+                "wbArticle": 100000000 + art_no * 7919,
+                "supplierArticle": f"ART-{art_no:04d}",
+                "name": f"Товар {art_no}",
+            },
+        }
+
+
+def _encode_cursor(offset: int) -> str:
+    return f"c{offset}"
+
+
+def _decode_cursor(cursor: str) -> int:
+    if cursor and cursor.startswith("c") and cursor[1:].isdigit():
+        return int(cursor[1:])
+    return 0
+
+
+# -------------------------
+# Запись / воспроизведение
+# -------------------------
+def sanitize(obj: Any) -> Any:
+    """
+    Убирает персональные данные из ответа WB перед сохранением фикстуры
+    """
+    if isinstance(obj, dict):
+        out = {}
+        for k, v in obj.items():
+            if k in SENSITIVE_KEYS:
+                out[k] = None if not isinstance(v, (list, dict)) else type(v)()
+            else:
+                out[k] = sanitize(v)
+        return out
+    if isinstance(obj, list):
+        return [sanitize(v) for v in obj]
+    return obj
+
+
+def fixture_key(method: str, path: str, query: str) -> str:
+    q = "&".join(sorted(query.split("&"))) if query else ""
+    return hashlib.sha1(f"{method} {path}?{q}".encode()).hexdigest()[:16]
+
+
+def _fixture_path(directory: str, method: str, path: str, query: str) -> str:
+    return os.path.join(directory, f"{fixture_key(method, path, query)}.json")
+
+
+def save_fixture(directory: str, method: str, path: str, query: str, status: int, body: Any):
+    os.makedirs(directory, exist_ok=True)
+    with open(_fixture_path(directory, method, path, query), "w", encoding="utf-8") as f:
+        json.dump({
+            "request": {"method": method, "path": path, "query": query},
+            "status": status,
+            "body": sanitize(body),
+        }, f, ensure_ascii=False, indent=2)
+
+
+def load_fixture(directory: str, method: str, path: str, query: str) -> Optional[Tuple[int, Any]]:
+    fp = _fixture_path(directory, method, path, query)
+    if not os.path.exists(fp):
+        # нет точного совпадения — пробуем фикстуру без query (например, для POST)
+        fp = _fixture_path(directory, method, path, "")
+        if not os.path.exists(fp):
+            return None
+    with open(fp, "r", encoding="utf-8") as f:
+        j = json.load(f)
+    return j.get("status", 200), j.get("body")
+
+
+# -------------------------
+# HTTP
+# -------------------------
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "wb-stub/1.0"
+    cfg: StubConfig = None
+    data: StubData = None
+    stats: Dict[str, int] = None
+    stats_lock = threading.Lock()
+
+    def log_message(self, fmt, *args):
+        # без спама в stdout на каждый запрос
+        pass
+
+    def _send(self, status: int, body: Any):
+        raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        # как и WB, сжимаем, если клиент согласен
+        if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            raw = gzip.compress(raw)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length).decode("utf-8"))
+        except Exception:
+            return {}
+
+    def _count(self, key: str):
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _inject_faults(self) -> bool:
+        """
+        Задержка + случайные 429/5xx. True — ответ уже отправлен.
+        """
+        cfg = self.cfg
+        if cfg.latency_ms or cfg.jitter_ms:
+            delay = max(0.0, random.gauss(cfg.latency_ms, cfg.jitter_ms)) / 1000
+            time.sleep(delay)
+        if cfg.rate_429 and random.random() < cfg.rate_429:
+            self._count("429")
+            self._send(429, {"error": True, "errorText": "Too Many Requests"})
+            return True
+        if cfg.error_rate and random.random() < cfg.error_rate:
+            self._count("5xx")
+            self._send(503, {"error": True, "errorText": "Service Unavailable"})
+            return True
+        return False
+
+    def _handle(self, method: str):
+        parts = urlsplit(self.path)
+        path, query = parts.path, parts.query
+        self._count(f"{method} {path}")
+
+        if self._inject_faults():
+            return
+
+        if self.cfg.replay_dir:
+            found = load_fixture(self.cfg.replay_dir, method, path, query)
+            if found is None:
+                return self._send(404, {"error": True, "errorText": f"no fixture for {method} {path}?{query}"})
+            return self._send(*found)
+
+        if self.cfg.record_dir:
+            return self._record(method, path, query)
+
+        params = {k: v[-1] for k, v in parse_qs(query).items()}
+        status, body = self._synthetic(method, path, params)
+        self._send(status, body)
+
+    def _record(self, method: str, path: str, query: str):
+        import requests
+
+        upstream = next((host for prefix, host in UPSTREAMS.items() if path.startswith(prefix)), None)
+        if not upstream:
+            return self._send(404, {"error": True, "errorText": "unknown upstream"})
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in HOP_HEADERS}
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = self.rfile.read(length) if length else None
+        url = f"{upstream}{path}" + (f"?{query}" if query else "")
+        try:
+            r = requests.request(method, url, headers=headers, data=payload, timeout=30)
+        except Exception as e:
+            return self._send(502, {"error": True, "errorText": str(e)})
+        try:
+            body = r.json()
+        except Exception:
+            body = r.text
+        save_fixture(self.cfg.record_dir, method, path, query, r.status_code, body)
+        self._send(r.status_code, sanitize(body))
+
+    def _synthetic(self, method: str, path: str, params: Dict[str, str]) -> Tuple[int, Any]:
+        d = self.data
+
+        if method == "GET" and path == "/api/v1/feedbacks":
+            idx = d.indices(params.get("isAnswered", "false"))
+            skip = int(params.get("skip", 0))
+            take = int(params.get("take", 100))
+            page = [d.public_feedback(i) for i in idx[skip:skip + take]]
+            return 200, {
+                "data": {
+                    "countUnanswered": len(d.indices("false")),
+                    "countArchive": len(d.indices("true")),
+                    "feedbacks": page,
+                },
+                "error": False,
+            }
+
+        if method == "POST" and path.startswith("/api/v1/feedbacks/") and path.endswith("/answer"):
+            d.mark_answered(path.split("/")[-2])
+            return 200, {"data": None, "error": False}
+
+        if method == "GET" and path == "/api/v3/suppliers":
+            return 200, {"data": [{"id": 100000 + self.cfg.seed}]}
+
+        if method == "GET" and path == f"{PORTAL}/v2/feedbacks":
+            idx = d.indices(params.get("isAnswered", "false"))
+            offset = _decode_cursor(params.get("cursor", ""))
+            limit = int(params.get("limit", 100))
+            page = [d.portal_feedback(i) for i in idx[offset:offset + limit]]
+            next_offset = offset + len(page)
+            return 200, {
+                "data": {
+                    "feedbacks": page,
+                    # на последней странице WB возвращает тот же курсор
+                    "cursor": _encode_cursor(next_offset) if next_offset < len(idx) else params.get("cursor", ""),
+                },
+                "error": False,
+            }
+
+        if method == "POST" and path == f"{PORTAL}/v2/feedbacks/answer":
+            body = self._read_json()
+            d.mark_answered(body.get("feedbackId", ""))
+            return 200, {"data": None, "error": False}
+
+        if method == "GET" and path == f"{PORTAL}/v1/questions":
+            questions = [d.question(i) for i in range(self.cfg.questions)]
+            limit = int(params.get("limit", 50))
+            return 200, {"data": {"questions": questions[:limit], "totalUnanswered": len(questions)}}
+
+        if method == "PATCH" and path in (f"{PORTAL}/v1/questions/answer", f"{PORTAL}/v1/questions/viewed"):
+            self._read_json()
+            return 200, {"data": None, "error": False}
+
+        return 404, {"error": True, "errorText": f"unknown endpoint {method} {path}"}
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+
+def make_server(cfg: StubConfig, host: str = "127.0.0.1", port: int = 8080) -> ThreadingHTTPServer:
+    """
+    Создаёт сервер стенда (порт 0 — любой свободный). Запуск: server.serve_forever()
+    """
+    handler = type("BoundStubHandler", (StubHandler,), {
+        "cfg": cfg,
+        "data": StubData(cfg),
+        "stats": {},
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Локальный стенд WB API")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--volume", type=int, default=1000, help="сколько отзывов в магазине")
+    p.add_argument("--questions", type=int, default=50)
+    p.add_argument("--articles", type=int, default=40, help="сколько разных артикулов")
+    p.add_argument("--latency", type=float, default=0.0, help="средняя задержка ответа, мс")
+    p.add_argument("--jitter", type=float, default=0.0, help="разброс задержки, мс")
+    p.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    p.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    p.add_argument("--seed", type=int, default=1)
+    mode = p.add_mutually_exclusive_group()
+    mode.add_argument("--replay", metavar="DIR", help="отдавать записанные фикстуры")
+    mode.add_argument("--record", metavar="DIR", help="проксировать в WB и записывать фикстуры")
+    args = p.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    cfg = StubConfig(
+        volume=args.volume, questions=args.questions, latency_ms=args.latency,
+        jitter_ms=args.jitter, error_rate=args.error_rate, rate_429=args.rate_429,
+        articles=args.articles, seed=args.seed,
+        replay_dir=args.replay, record_dir=args.record,
+    )
+    server = make_server(cfg, args.host, args.port)
+    print(f"✅ WB stub: http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# worker.py
+"""
+Фоновые автоответы на отзывы.
+
+Модуль не импортирует aiogram/handlers, поэтому петлю можно запускать
+как внутри бота (bot.py), так и отдельным лёгким процессом:
+    python worker.py
+(тогда в боте встроенную петлю стоит выключить: RUN_AUTO_WORKER=0)
+"""
+import asyncio
+import logging
+import signal
+import sys
+from typing import Awaitable, Callable, Dict, Optional
+
+import fastpath
+import similar
+import storage
+from wb_api import (
+    get_reviews_by_stars,
+    send_reply,
+    send_reply_with_profile,
+    is_wb_available,
+    WB_UNAVAILABLE_STATUS,
+)
+
+INTERVAL = 20 * 60  # сек (20 минут)
+
+# async callback(user_id) — сообщить пользователю, что authorize_v3 протух
+TokenExpiredCallback = Callable[[int], Awaitable[None]]
+
+
+async def _answer_texts(uid: int, store_name: str, cfg: dict, reviews: list) -> Dict[str, str]:
+    """
+    {id отзыва: текст ответа}; отзыва нет — отвечать не на что (нет шаблона / AI не ответил)
+    """
+    if cfg.get("method") == "template":
+        tpl = storage.get_template(uid, cfg.get("template_id") or "")
+        # не найден шаблон — пропустить
+        return {r.id: tpl["text"] for r in reviews} if tpl else {}
+
+    # дежурная похвала — шаблон из ротации; на почти такие же отзывы
+    # магазина уже отвечали — берём тот ответ. AI не нужен ни там, ни там
+    answers: Dict[str, str] = {}
+    rest = []
+    thresholds = storage.get_fastpath_thresholds(uid, store_name)
+    for r in reviews:
+        quick = fastpath.route(uid, store_name, r, thresholds)
+        if quick:
+            answers[r.id] = quick
+            continue
+        reused = similar.find(uid, store_name, r.full_text(), r.valuation or 5)
+        if reused:
+            answers[r.id] = similar.vary(reused, r.id)
+        else:
+            rest.append(r)
+    if not rest:
+        return answers
+
+    # AI импортируем лениво: процесс с одними шаблонами не тянет AI-клиент
+    from ai import generate_ai_answers_batch
+    answers.update(await generate_ai_answers_batch(
+        [(r.id, r.text, r.valuation or 5) for r in rest], user_id=uid
+    ))
+    return answers
+
+
+async def _process_store(uid: int, store_name: str, stars_map: dict,
+                         on_token_expired: Optional[TokenExpiredCallback]):
+    token = storage.get_store_tokens(uid).get(store_name)
+    if not token:
+        return
+    profile = storage.get_store_profile_for_user(uid, store_name)
+
+    for stars, cfg in stars_map.items():
+        if not cfg.get("enabled"):
+            continue
+        # получить отзывы по звезде; requests блокирует — в отдельном потоке,
+        # чтобы внутри бота не держать event loop
+        status, reviews = await asyncio.to_thread(get_reviews_by_stars, token, int(stars))
+        if status == WB_UNAVAILABLE_STATUS:
+            return
+        if status != 200 or not reviews:
+            continue
+        # пропускаем уже обработанные
+        pending = [r for r in reviews if not storage.is_review_processed(uid, store_name, r.id)]
+        # ответы на всю пачку сразу — AI генерирует их пакетами
+        answers = await _answer_texts(uid, store_name, cfg, pending)
+        for r in pending:
+            rid = r.id
+            answer_text = answers.get(rid)
+            if not answer_text:
+                continue
+
+            # отправляем через профиль если есть
+            if profile:
+                status_send, res = await asyncio.to_thread(send_reply_with_profile, profile, rid, answer_text)
+            else:
+                # fallback to token send via legacy API (оставляем send_reply)
+                status_send, res = await asyncio.to_thread(send_reply, token, rid, answer_text)
+
+            if status_send == -1:  # токен истёк — дальше по этому магазину смысла нет
+                logging.warning(f"authorize_v3 истёк: user={uid} store={store_name}")
+                if on_token_expired:
+                    await on_token_expired(uid)
+                return
+            if status_send == WB_UNAVAILABLE_STATUS:
+                return
+
+            if status_send in (200, 201):
+                # пометить как отправленное
+                storage.mark_review_processed(uid, store_name, rid)
+                similar.remember(uid, store_name, r.full_text(), r.valuation or 5, answer_text)
+                # убрать из RAM-кэша, если он там есть
+                pages = storage.get_all_pages_for(uid, store_name)
+                for s_key, page in (pages or {}).items():
+                    page_reviews = page.get("reviews", [])
+                    page["reviews"] = [x for x in page_reviews if x.id != rid]
+            # иначе — оставляем на следующую итерацию
+
+
+async def run_once(on_token_expired: Optional[TokenExpiredCallback] = None):
+    """
+    Один проход по всем пользователям с включённой автоматизацией
+    """
+    # простая реализация: проходим по всем юзерам, которые есть в БД
+    try:
+        db = storage._load_file()
+        user_ids = [int(k) for k in db.keys() if k.isdigit()]
+    except Exception:
+        user_ids = []
+
+    for uid in user_ids:
+        auto = storage.get_auto_settings_for_user(uid)
+        # для каждого магазина в настройках
+        for store_name, stars_map in auto.items():
+            if not is_wb_available():
+                # WB лежит — не тратим итерацию на таймауты, ждём следующую
+                return
+            try:
+                await _process_store(uid, store_name, stars_map, on_token_expired)
+            except Exception:
+                logging.exception(f"Ошибка автоответа: user={uid} store={store_name}")
+
+
+async def auto_worker_loop(stop_event: asyncio.Event,
+                           on_token_expired: Optional[TokenExpiredCallback] = None):
+    """
+    Фоновая петля: каждые INTERVAL секунд проверяет для всех пользователей их настройки
+    и отвечает на новые отзывы по заданным правилам.
+    """
+    while not stop_event.is_set():
+        await run_once(on_token_expired)
+        # ждем интервал или стоп
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main():
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+    logging.info("✅ Воркер автоответов запущен")
+    try:
+        await auto_worker_loop(stop_event)
+    finally:
+        # AI-клиент открывается лениво — закрываем, только если он понадобился
+        if "ai" in sys.modules:
+            await sys.modules["ai"].close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())